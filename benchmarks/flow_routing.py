@@ -0,0 +1,91 @@
+# benchmarks/flow_routing.py
+# Micro-benchmark do encaminhamento de mensagens: a cadeia if/elif antiga do
+# BotLogic.process_message contra o fluxo compilado (src/services/flow_engine.py).
+#
+# Uso:
+#   python -m benchmarks.flow_routing [--iterations 200000]
+
+import argparse
+import random
+import time
+
+from src.services.flow_engine import FlowEngine
+
+MESSAGES = [
+    ('awaiting_choice', '1'),
+    ('awaiting_choice', '4'),
+    ('awaiting_choice', 'Oi'),
+    ('awaiting_choice', 'quero agendar uma consulta para o meu filho'),
+    ('awaiting_choice', 'Meu filho está com muita dor no dente de trás, o que faço?'),
+    ('awaiting_choice', '10'),
+    ('awaiting_choice', 'adorei o atendimento de vocês, obrigada!'),
+    ('awaiting_choice', 'vocês aceitam convênio?'),
+    ('initial', 'Boa tarde'),
+    ('name', 'Maria Eduarda'),
+    ('age', '5 anos e 3 meses'),
+    ('reason', 'dor de dente'),
+    ('period', 'Manhã'),
+]
+
+
+def legacy_route(state, message):
+    """Cópia da decisão de encaminhamento da cadeia if/elif original."""
+    message_lower = message.lower().strip()
+    if message_lower in ['oi', 'olá', 'bom dia', 'boa tarde', 'boa noite', 'menu'] or state == 'initial':
+        return 'main_menu'
+    elif '1' in message_lower and state == 'awaiting_choice':
+        return 'first_consultation_info'
+    elif '2' in message_lower and state == 'awaiting_choice':
+        return 'insurance_info'
+    elif '3' in message_lower and state == 'awaiting_choice':
+        return 'treatments_info'
+    elif '4' in message_lower and state == 'awaiting_choice':
+        return 'schedule'
+    elif '5' in message_lower and state == 'awaiting_choice':
+        return 'team_contact'
+    elif any(word in message_lower for word in ['emergência', 'emergencia', 'urgência', 'urgencia', 'dor']):
+        return 'emergency_contact'
+    elif state != 'awaiting_choice':
+        return 'appointment_step'
+    else:
+        return 'default_response'
+
+
+def time_router(route, messages, iterations):
+    started = time.perf_counter()
+    for index in range(iterations):
+        state, message = messages[index % len(messages)]
+        route(state, message)
+    return (time.perf_counter() - started) / iterations * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Encaminhamento antigo (if/elif) vs fluxo compilado.")
+    parser.add_argument('--iterations', type=int, default=200000)
+    args = parser.parse_args()
+
+    flow = FlowEngine(reload_interval=None).current()
+    compiled_route = lambda state, message: flow.route(state, message)[0]
+
+    print(f"{'estado':<16} {'mensagem':<58} {'antigo':<26} {'compilado'}")
+    for state, message in MESSAGES:
+        old, new = legacy_route(state, message), compiled_route(state, message)
+        marker = '' if old == new else '  <- difere'
+        print(f"{state:<16} {message[:56]:<58} {old:<26} {new}{marker}")
+
+    messages = MESSAGES[:]
+    random.Random(1).shuffle(messages)
+    legacy_ns = time_router(legacy_route, messages, args.iterations)
+    compiled_ns = time_router(compiled_route, messages, args.iterations)
+    print(f"\nantigo:    {legacy_ns:8.0f} ns/mensagem")
+    print(f"compilado: {compiled_ns:8.0f} ns/mensagem")
+
+    # Custo por caractere em mensagens longas (o antigo cresce com o número de palavras-chave).
+    long_message = [('awaiting_choice', 'bom dia, ' * 200 + 'gostaria de saber sobre convenio')]
+    print(f"mensagem longa ({len(long_message[0][1])} caracteres): "
+          f"antigo {time_router(legacy_route, long_message, 2000):.0f} ns, "
+          f"compilado {time_router(compiled_route, long_message, 2000):.0f} ns")
+
+
+if __name__ == '__main__':
+    main()
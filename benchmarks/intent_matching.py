@@ -0,0 +1,120 @@
+# benchmarks/intent_matching.py
+# Precisão e latência do encaminhamento com e sem correção de erros de
+# escrita (FuzzyVocabulary em src/services/flow_engine.py), sobre o corpus
+# rotulado benchmarks/data/intent_corpus.tsv.
+#
+# Para cada grupo do corpus (exato, erro, livre) mostra a taxa de acerto dos
+# dois modos; depois o tempo por mensagem (com o cache de correções vazio e
+# já preenchido) e a memória do dicionário de variantes.
+#
+# Uso:
+#   python -m benchmarks.intent_matching [--iterations 20000] [--verbose]
+
+import argparse
+import copy
+import json
+import os
+import time
+import tracemalloc
+from collections import defaultdict
+
+from src.services.flow_engine import DEFAULT_FLOW_PATH, CompiledFlow, FuzzyVocabulary
+from src.services.text_utils import tokenize
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), 'data', 'intent_corpus.tsv')
+
+
+def load_corpus(path=CORPUS_PATH):
+    """[(estado, mensagem, ação esperada, grupo)]"""
+    rows = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('#') or not line.strip():
+                continue
+            rows.append(tuple(line.rstrip('\n').split('\t')))
+    return rows
+
+
+def load_flows():
+    with open(DEFAULT_FLOW_PATH, encoding='utf-8') as f:
+        definition = json.load(f)
+    exact_only = copy.deepcopy(definition)
+    for spec in exact_only['states'].values():
+        spec.pop('fuzzy', None)
+    return CompiledFlow(exact_only), CompiledFlow(definition)
+
+
+def accuracy(flow, corpus, verbose=False, label=''):
+    hits, totals = defaultdict(int), defaultdict(int)
+    for state, message, expected, group in corpus:
+        action = flow.route(state, message)[0]
+        totals[group] += 1
+        if action == expected:
+            hits[group] += 1
+        elif verbose:
+            print(f"  [{label}] {state:<16} {message!r:<32} esperado {expected:<26} obtido {action}")
+    return {group: (hits[group], totals[group]) for group in totals}
+
+
+def time_routes(flow, corpus, iterations, cold=False):
+    """ns por mensagem; cold=True esvazia o cache de correções antes de cada passagem."""
+    elapsed = 0.0
+    rounds = max(1, iterations // len(corpus))
+    for _ in range(rounds):
+        if cold:
+            flow.fuzzy._cache.clear()
+        started = time.perf_counter()
+        for state, message, _, _ in corpus:
+            flow.route(state, message)
+        elapsed += time.perf_counter() - started
+    return elapsed / (rounds * len(corpus)) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Encaminhamento exato vs com correção de erros de escrita.")
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--verbose', action='store_true', help="lista as mensagens mal encaminhadas")
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    exact_flow, fuzzy_flow = load_flows()
+
+    if args.verbose:
+        print("Mensagens mal encaminhadas:")
+    results = {
+        'exato': accuracy(exact_flow, corpus, args.verbose, 'exato'),
+        'com correção': accuracy(fuzzy_flow, corpus, args.verbose, 'correção'),
+    }
+    groups = sorted({group for _, _, _, group in corpus})
+    print(f"\n{len(corpus)} mensagens rotuladas")
+    print(f"{'modo':<14}" + ''.join(f"{group:>14}" for group in groups) + f"{'total':>14}")
+    for label, by_group in results.items():
+        cells = [f"{by_group[g][0]}/{by_group[g][1]}" for g in groups]
+        hits = sum(h for h, _ in by_group.values())
+        print(f"{label:<14}" + ''.join(f"{cell:>14}" for cell in cells) + f"{hits / len(corpus):>13.1%}")
+
+    typos = [row for row in corpus if row[3] == 'erro']
+    print(f"\n{'ns/mensagem':<32}{'exato':>12}{'correção':>12}")
+    print(f"{'corpus inteiro':<32}{time_routes(exact_flow, corpus, args.iterations):>12.0f}"
+          f"{time_routes(fuzzy_flow, corpus, args.iterations):>12.0f}")
+    print(f"{'só erros, cache vazio':<32}{time_routes(exact_flow, typos, args.iterations):>12.0f}"
+          f"{time_routes(fuzzy_flow, typos, args.iterations, cold=True):>12.0f}")
+    print(f"{'só erros, cache preenchido':<32}{time_routes(exact_flow, typos, args.iterations):>12.0f}"
+          f"{time_routes(fuzzy_flow, typos, args.iterations):>12.0f}")
+
+    vocabulary = fuzzy_flow.fuzzy
+    tracemalloc.start()
+    rebuilt = FuzzyVocabulary(vocabulary.words, vocabulary.known_words,
+                              min_length=vocabulary.min_length, max_distance=vocabulary.max_distance)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del rebuilt
+    print(f"\ndicionário: {len(vocabulary.words)} palavras-chave + {len(vocabulary.known_words)} palavras conhecidas, "
+          f"{len(vocabulary)} variantes, {size / 1024:.0f} KiB")
+    longest = max(vocabulary.words, key=len)
+    print(f"variantes geradas por consulta (palavra de {len(longest)} letras): "
+          f"{len(FuzzyVocabulary._variants(tokenize(longest)[0], vocabulary.max_distance))}")
+
+
+if __name__ == '__main__':
+    main()
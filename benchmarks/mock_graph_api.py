@@ -0,0 +1,116 @@
+# benchmarks/mock_graph_api.py
+# Substituto local da Graph API (POST /<versão>/<phone_number_id>/messages) com
+# latência e respostas 429 configuráveis.
+#
+# Uso isolado:
+#   python -m benchmarks.mock_graph_api --port 8090 --latency-ms 80 --throttle-rate 0.05
+#   WHATSAPP_API_BASE_URL=http://127.0.0.1:8090 ...
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockGraphAPI:
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=80.0, jitter_ms=40.0, throttle_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.throttle_rate = throttle_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'throttled': 0, 'delivered': 0}
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='mock-graph-api', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_stats(self):
+        with self._lock:
+            for key in self.stats:
+                self.stats[key] = 0
+
+    def _decide(self):
+        with self._lock:
+            self.stats['requests'] += 1
+            throttled = self._rng.random() < self.throttle_rate
+            self.stats['throttled' if throttled else 'delivered'] += 1
+            delay = max(0.0, self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+        return throttled, delay
+
+    def _make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                throttled, delay = api._decide()
+                time.sleep(delay)
+                if throttled:
+                    self._reply(429, {'error': {
+                        'message': '(#130429) Rate limit hit', 'type': 'OAuthException', 'code': 130429
+                    }})
+                    return
+                try:
+                    recipient = json.loads(body).get('to')
+                except ValueError:
+                    recipient = None
+                self._reply(200, {
+                    'messaging_product': 'whatsapp',
+                    'contacts': [{'input': recipient, 'wa_id': recipient}],
+                    'messages': [{'id': 'wamid.MOCK' + uuid.uuid4().hex.upper()}]
+                })
+
+            def _reply(self, status, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Graph API local com latência e 429 injetados.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--latency-ms', type=float, default=80.0)
+    parser.add_argument('--jitter-ms', type=float, default=40.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    api = MockGraphAPI(args.host, args.port, args.latency_ms, args.jitter_ms, args.throttle_rate).start()
+    print(f"Graph API simulada em {api.base_url} (Ctrl+C para parar)")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"pedidos={api.stats['requests']} 429={api.stats['throttled']}")
+    except KeyboardInterrupt:
+        api.stop()
+
+
+if __name__ == '__main__':
+    main()
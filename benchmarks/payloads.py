@@ -0,0 +1,117 @@
+# benchmarks/payloads.py
+# Gerador de payloads de webhook da WhatsApp Cloud API com o formato real
+# (entry -> changes -> value -> messages/statuses).
+
+import random
+import time
+import uuid
+
+PHONE_NUMBER_ID = '100000000000001'
+DISPLAY_PHONE_NUMBER = '551699269238'
+
+CHILD_NAMES = ['Maria Eduarda', 'João Pedro', 'Helena', 'Miguel', 'Alice', 'Arthur', 'Laura', 'Davi', 'Valentina']
+AGES = ['3 anos', '5 anos e 6 meses', '2 anos', '7 anos', '1 ano e 8 meses']
+REASONS = ['primeira consulta', 'limpeza', 'mancha no dente', 'revisão', 'dente mole']
+PERIODS = ['Manhã', 'Tarde', 'Qualquer horário']
+EMERGENCIES = [
+    'meu filho está com muita dor de dente',
+    'URGÊNCIA, ela caiu e quebrou o dente',
+    'é uma emergência, o dente está sangrando',
+]
+# Texto longo colado linha a linha: cada linha chega como uma mensagem
+FLOOD_LINES = [
+    'bom dia', 'queria saber umas coisas', 'minha filha tem 4 anos', 'nunca foi ao dentista',
+    'ela tem uma mancha escura no dente da frente', 'e reclama quando come doce', 'vocês atendem convênio?',
+    'qual o valor da consulta', 'tem horário à tarde?', 'ela estuda de manhã',
+]
+FLOOD_MESSAGES = 30
+
+
+def new_wamid():
+    return 'wamid.BENCH' + uuid.uuid4().hex.upper()
+
+
+def _envelope(value):
+    return {
+        'object': 'whatsapp_business_account',
+        'entry': [{
+            'id': 'WHATSAPP_BUSINESS_ACCOUNT_ID',
+            'changes': [{
+                'field': 'messages',
+                'value': {
+                    'messaging_product': 'whatsapp',
+                    'metadata': {
+                        'display_phone_number': DISPLAY_PHONE_NUMBER,
+                        'phone_number_id': PHONE_NUMBER_ID
+                    },
+                    **value
+                }
+            }]
+        }]
+    }
+
+
+def text_message(phone, body, wamid=None, profile_name='Responsável'):
+    """Payload de uma mensagem de texto recebida de `phone`."""
+    return _envelope({
+        'contacts': [{'profile': {'name': profile_name}, 'wa_id': phone}],
+        'messages': [{
+            'from': phone,
+            'id': wamid or new_wamid(),
+            'timestamp': str(int(time.time())),
+            'type': 'text',
+            'text': {'body': body}
+        }]
+    })
+
+
+def status_update(recipient, wamid, status):
+    """Payload de um callback de estado (sent/delivered/read/failed) de uma mensagem enviada."""
+    return _envelope({
+        'statuses': [{
+            'id': wamid,
+            'status': status,
+            'timestamp': str(int(time.time())),
+            'recipient_id': recipient
+        }]
+    })
+
+
+def random_phone(rng):
+    return f"55169{rng.randint(10000000, 99999999)}"
+
+
+def conversation(scenario, phone, rng):
+    """Lista de payloads de uma conversa, pela ordem em que o utilizador os envia."""
+    if scenario == 'menu':
+        texts = ['oi'] + rng.sample(['1', '2', '3'], k=3)
+    elif scenario == 'appointment':
+        # O último texto escolhe um dos horários livres oferecidos (ou 0: a equipe liga)
+        texts = ['Bom dia', '4', rng.choice(CHILD_NAMES), rng.choice(AGES), rng.choice(REASONS),
+                 rng.choice(PERIODS), rng.choice(['1', '2', '3', '0'])]
+    elif scenario == 'emergency':
+        texts = [rng.choice(EMERGENCIES)]
+    elif scenario == 'flood':
+        # Menu e escolha (respondidos um a um) e depois o texto colado linha a linha
+        # no primeiro passo de texto livre do agendamento
+        texts = ['Bom dia', '4'] + [rng.choice(FLOOD_LINES) for _ in range(FLOOD_MESSAGES)]
+    elif scenario == 'status':
+        payloads = []
+        for _ in range(3):
+            wamid = new_wamid()
+            payloads.extend(status_update(phone, wamid, status) for status in ('sent', 'delivered', 'read'))
+        return payloads
+    else:
+        raise ValueError(f"Cenário desconhecido: {scenario}")
+    return [text_message(phone, text) for text in texts]
+
+
+SCENARIOS = ('menu', 'appointment', 'emergency', 'status', 'flood')
+
+
+def generate(scenario, conversations, seed=42):
+    """Gera `conversations` conversas do cenário: lista de (phone, [payloads])."""
+    # Números diferentes por cenário: o limite por remetente não passa de um cenário para o outro
+    rng = random.Random(f"{scenario}:{seed}")
+    return [(phone, conversation(scenario, phone, rng))
+            for phone in (random_phone(rng) for _ in range(conversations))]
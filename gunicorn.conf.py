@@ -0,0 +1,32 @@
+# gunicorn.conf.py
+# A aplicação é carregada uma vez no processo principal (preload_app) e os
+# workers são criados por fork. Em cada worker as conexões herdadas são
+# descartadas e os serviços em segundo plano arrancam só depois do fork
+# (ver src/main.py).
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+# Threads por worker: o webhook e as páginas passam a maior parte do tempo à espera do banco
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+preload_app = True
+timeout = 30
+graceful_timeout = 20
+
+
+def on_starting(server):
+    # Snapshots de métricas de workers de um arranque anterior seriam somados aos novos.
+    directory = os.environ.get('METRICS_MULTIPROC_DIR')
+    if directory:
+        from src.services.metrics import clear_multiprocess_dir
+        clear_multiprocess_dir(directory)
+
+
+def post_fork(server, worker):
+    from src.main import reset_after_fork, start_background_services
+
+    app = worker.app.wsgi()
+    reset_after_fork(app)
+    start_background_services(app)
@@ -0,0 +1,74 @@
+"""queue and bot state
+
+Fila de mensagens recebidas, estado partilhado do bot e o índice da agenda por
+intervalo: o que veio depois do esquema inicial (e3b988e1b334). Bancos criados
+com db.create_all() por uma versão que já tinha estas tabelas ficam com as que
+existem.
+
+Revision ID: 295bb41d6e26
+Revises: e3b988e1b334
+Create Date: 2026-10-18 06:35:10.118342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '295bb41d6e26'
+down_revision = 'e3b988e1b334'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+
+    if 'bot_state' not in tables:
+        op.create_table('bot_state',
+        sa.Column('phone_number', sa.String(length=20), nullable=False),
+        sa.Column('data', sa.Text(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('phone_number')
+        )
+        with op.batch_alter_table('bot_state', schema=None) as batch_op:
+            batch_op.create_index(batch_op.f('ix_bot_state_expires_at'), ['expires_at'], unique=False)
+
+    if 'inbound_message' not in tables:
+        op.create_table('inbound_message',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('phone_number', sa.String(length=20), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('response', sa.Text(), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('available_at', sa.DateTime(), nullable=False),
+        sa.Column('locked_until', sa.DateTime(), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('processed_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+        )
+        with op.batch_alter_table('inbound_message', schema=None) as batch_op:
+            batch_op.create_index('ix_inbound_message_status_phone_id', ['status', 'phone_number', 'id'], unique=False)
+
+    if 'ix_schedule_start_end' not in {index['name'] for index in inspector.get_indexes('schedule')}:
+        with op.batch_alter_table('schedule', schema=None) as batch_op:
+            batch_op.create_index('ix_schedule_start_end', ['start_time', 'end_time'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('schedule', schema=None) as batch_op:
+        batch_op.drop_index('ix_schedule_start_end')
+
+    with op.batch_alter_table('inbound_message', schema=None) as batch_op:
+        batch_op.drop_index('ix_inbound_message_status_phone_id')
+
+    op.drop_table('inbound_message')
+    with op.batch_alter_table('bot_state', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_bot_state_expires_at'))
+
+    op.drop_table('bot_state')
@@ -0,0 +1,26 @@
+"""booking lock row
+
+Revision ID: ae700a87ae2c
+Revises: 06518d1aa263
+Create Date: 2026-10-18 07:30:24.169061
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ae700a87ae2c'
+down_revision = '06518d1aa263'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Linha bloqueada por availability.lock_bookings enquanto se verifica e grava uma marcação.
+    op.bulk_insert(sa.table('change_sequence', sa.column('name', sa.String), sa.column('value', sa.BigInteger)),
+                   [{'name': 'booking', 'value': 0}])
+
+
+def downgrade():
+    op.execute("DELETE FROM change_sequence WHERE name = 'booking'")
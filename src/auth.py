@@ -1,32 +1,26 @@
 # src/auth.py
-# Módulo de Autenticação - Fase 1
+# Módulo de Autenticação - Fase 2: utilizadores no banco (src/models/user.py)
+# carregados pelo UserStore (src/services/user_store.py)
 
+import click
 from flask import Blueprint, render_template, redirect, url_for, flash, request
-from flask_login import LoginManager, UserMixin, login_user, logout_user, current_user, login_required
+from flask_login import login_user, logout_user, current_user, login_required
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField
 from wtforms.validators import DataRequired
 
-# --- Configuração do Login ---
-auth_bp = Blueprint('auth', __name__)
-
-login_manager = LoginManager()
-login_manager.login_view = 'auth.login'
-login_manager.login_message = "Por favor, faça o login para aceder a esta página."
-login_manager.login_message_category = "info"
-
-# --- Modelo de Utilizador Simples ---
-class User(UserMixin):
-    def __init__(self, id):
-        self.id = id
+from src.extensions import login_manager
+from src.models.conversation import db
+from src.models.user import User
+from src.services.user_store import clear_claims, get_user_store, issue_claims, load_session_user
 
-ADMIN_USER = {'id': '1', 'username': 'admin', 'password': 'password123'}
+# --- Configuração do Login ---
+# Os comandos de gestão de utilizadores ficam em `flask users ...`
+auth_bp = Blueprint('auth', __name__, cli_group='users')
 
 @login_manager.user_loader
 def load_user(user_id):
-    if user_id == ADMIN_USER['id']:
-        return User(user_id)
-    return None
+    return load_session_user(user_id)
 
 # --- Formulário de Login ---
 class LoginForm(FlaskForm):
@@ -41,18 +35,59 @@ def login():
 
     form = LoginForm()
     if form.validate_on_submit():
-        if form.username.data == ADMIN_USER['username'] and form.password.data == ADMIN_USER['password']:
-            user = User(ADMIN_USER['id'])
+        user = get_user_store().authenticate(form.username.data, form.password.data)
+        if user is not None:
             login_user(user)
+            issue_claims(user)
             return redirect(url_for('home'))
         else:
             flash('Utilizador ou senha inválidos.', 'danger')
-            
+
     return render_template('login.html', form=form)
 
 @auth_bp.route('/logout')
 @login_required
 def logout():
     logout_user()
+    clear_claims()
     flash('Você saiu do sistema com sucesso.', 'success')
     return redirect(url_for('auth.login'))
+
+# --- Comandos de Utilizadores (flask users ...) ---
+def _find_user_id(username):
+    user_id = db.session.query(User.id).filter_by(username=username).scalar()
+    if user_id is None:
+        raise click.ClickException(f"Utilizador '{username}' não encontrado.")
+    return user_id
+
+@auth_bp.cli.command('create')
+@click.argument('username')
+@click.password_option('--password', prompt='Senha')
+def create_user(username, password):
+    """Cria um utilizador do sistema de gestão."""
+    if db.session.query(User.id).filter_by(username=username).scalar() is not None:
+        raise click.ClickException(f"O utilizador '{username}' já existe.")
+    get_user_store().create(username, password)
+    click.echo(f"Utilizador '{username}' criado.")
+
+@auth_bp.cli.command('set-password')
+@click.argument('username')
+@click.password_option('--password', prompt='Nova senha')
+def set_password(username, password):
+    """Muda a senha; as sessões abertas do utilizador deixam de valer."""
+    get_user_store().set_password(_find_user_id(username), password)
+    click.echo(f"Senha de '{username}' alterada.")
+
+@auth_bp.cli.command('deactivate')
+@click.argument('username')
+def deactivate_user(username):
+    """Desativa o utilizador e termina as suas sessões."""
+    get_user_store().set_active(_find_user_id(username), False)
+    click.echo(f"Utilizador '{username}' desativado.")
+
+@auth_bp.cli.command('activate')
+@click.argument('username')
+def activate_user(username):
+    """Reativa um utilizador desativado."""
+    get_user_store().set_active(_find_user_id(username), True)
+    click.echo(f"Utilizador '{username}' reativado.")
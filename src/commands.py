@@ -0,0 +1,110 @@
+# src/commands.py
+# Comandos de manutenção da CLI do Flask (flask conversations ..., flask tenants ...)
+
+import json
+
+import click
+from flask.cli import AppGroup
+
+from src.models.conversation import db
+from src.models.tenant import Tenant
+from src.services.business_calendar import BusinessCalendar, CalendarConfigError
+from src.services.conversation_archive import archive_conversations, archive_cutoff, archive_summary
+
+conversations_cli = AppGroup('conversations', help="Manutenção do histórico de conversas.")
+tenants_cli = AppGroup('tenants', help="Clínicas servidas por esta instalação (um número do WhatsApp cada).")
+
+
+@conversations_cli.command('archive')
+@click.option('--days', type=int, default=None,
+              help="Retenção em dias na tabela ativa (padrão: CONVERSATION_RETENTION_DAYS ou 180).")
+def archive_command(days):
+    """Move os meses completos anteriores à retenção para o arquivo comprimido."""
+    click.echo(f"A arquivar conversas anteriores a {archive_cutoff(days):%d/%m/%Y} (UTC)...")
+    stats = archive_conversations(days)
+    click.echo(f"{stats['rows']} conversas arquivadas em {stats['partitions']} partições "
+               f"({stats['months']} meses).")
+
+
+@conversations_cli.command('archive-status')
+def archive_status_command():
+    """Mostra o tamanho do arquivo."""
+    summary = archive_summary()
+    if not summary['partitions']:
+        click.echo("Arquivo vazio.")
+        return
+    click.echo(f"{summary['rows']} conversas em {summary['partitions']} partições, "
+               f"{summary['bytes'] / 1e6:.1f} MB comprimidos, "
+               f"de {summary['first_month']:%m/%Y} a {summary['last_month']:%m/%Y}.")
+
+
+def _read_settings(path):
+    """Lê e valida o JSON de configuração de uma clínica ({"texts": ..., "calendar": ...})."""
+    with open(path, encoding='utf-8') as f:
+        settings = json.load(f)
+    unknown = set(settings) - {'texts', 'calendar'}
+    if unknown:
+        raise click.BadParameter(f"Chaves desconhecidas: {', '.join(sorted(unknown))}", param_hint='--settings')
+    if settings.get('calendar'):
+        try:
+            BusinessCalendar(settings['calendar'])
+        except (CalendarConfigError, KeyError, ValueError) as e:
+            raise click.BadParameter(f"Calendário inválido: {e}", param_hint='--settings')
+    return json.dumps(settings, ensure_ascii=False)
+
+
+def _get_tenant(slug):
+    tenant = Tenant.query.filter_by(slug=slug).first()
+    if tenant is None:
+        raise click.ClickException(f"Clínica '{slug}' não existe.")
+    return tenant
+
+
+@tenants_cli.command('add')
+@click.argument('slug')
+@click.option('--name', required=True, help="Nome da clínica/unidade.")
+@click.option('--phone-number-id', required=True, help="phone_number_id do número na Cloud API.")
+@click.option('--token-env', required=True, help="Variável de ambiente com o token de acesso do número.")
+@click.option('--settings', 'settings_path', type=click.Path(exists=True, dir_okay=False),
+              help="JSON com textos e calendário próprios.")
+def add_tenant_command(slug, name, phone_number_id, token_env, settings_path):
+    """Regista uma clínica e o seu número do WhatsApp."""
+    if Tenant.query.filter((Tenant.slug == slug) | (Tenant.phone_number_id == phone_number_id)).first():
+        raise click.ClickException("Já existe uma clínica com este slug ou phone_number_id.")
+    tenant = Tenant(slug=slug, name=name, phone_number_id=phone_number_id, access_token_env=token_env,
+                    settings=_read_settings(settings_path) if settings_path else '{}')
+    db.session.add(tenant)
+    db.session.commit()
+    click.echo(f"Clínica '{slug}' registada (id {tenant.id}).")
+
+
+@tenants_cli.command('configure')
+@click.argument('slug')
+@click.option('--settings', 'settings_path', required=True, type=click.Path(exists=True, dir_okay=False))
+def configure_tenant_command(slug, settings_path):
+    """Substitui os textos e o calendário de uma clínica."""
+    tenant = _get_tenant(slug)
+    tenant.settings = _read_settings(settings_path)
+    db.session.commit()
+    click.echo(f"Configuração de '{slug}' atualizada (aplicada pelos workers em até TENANT_CACHE_TTL s).")
+
+
+@tenants_cli.command('deactivate')
+@click.argument('slug')
+def deactivate_tenant_command(slug):
+    """Desativa uma clínica: as mensagens do número passam para a clínica por omissão."""
+    tenant = _get_tenant(slug)
+    tenant.active = False
+    db.session.commit()
+    click.echo(f"Clínica '{slug}' desativada.")
+
+
+@tenants_cli.command('list')
+def list_tenants_command():
+    """Lista as clínicas registadas."""
+    tenants = Tenant.query.order_by(Tenant.id).all()
+    if not tenants:
+        click.echo("Nenhuma clínica registada: só a clínica por omissão (variáveis de ambiente).")
+    for tenant in tenants:
+        state = 'ativa' if tenant.active else 'inativa'
+        click.echo(f"{tenant.id:>4}  {tenant.slug:<20} {tenant.phone_number_id:<20} {tenant.access_token_env:<30} {state}")
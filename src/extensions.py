@@ -0,0 +1,17 @@
+# src/extensions.py
+# Extensões do Flask, criadas sem aplicação e ligadas em create_app()
+# (src/main.py). Há uma só instância de cada: os modelos usam este `db` e as
+# rotas de autenticação registam o user_loader neste `login_manager`.
+# O Flask-Migrate não está aqui: só é carregado pelos comandos `flask db`.
+
+from flask_login import LoginManager
+from flask_sqlalchemy import SQLAlchemy
+from flask_wtf.csrf import CSRFProtect
+
+db = SQLAlchemy()
+csrf = CSRFProtect()
+
+login_manager = LoginManager()
+login_manager.login_view = 'auth.login'
+login_manager.login_message = "Por favor, faça login para aceder a esta página."
+login_manager.login_message_category = "info"
@@ -1,65 +1,165 @@
 # main.py
-# TESTE DE DIAGNÓSTICO: Desativar completamente o CSRF para isolar o problema.
+# Fábrica da aplicação: create_app() configura as extensões e regista os
+# blueprints sem tocar no banco nem arrancar threads. O esquema é gerido só
+# pelas migrações (`flask db upgrade`, na fase release do Procfile) e os
+# serviços em segundo plano arrancam em cada worker depois do fork
+# (start_background_services, chamado pelo gunicorn.conf.py), o que torna
+# seguro o `preload_app` do gunicorn.
 
 import os
+import atexit
+import click
 from flask import Flask, render_template
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
-from flask_login import LoginManager
-# from flask_wtf.csrf import CSRFProtect # <-- PASSO 1: Comentar a importação
 
-# --- Configuração da Aplicação ---
-app = Flask(__name__)
+from src.extensions import csrf, db, login_manager
 
-db_url = os.environ.get('DATABASE_URL')
-if db_url and db_url.startswith("postgres://"):
-    db_url = db_url.replace("postgres://", "postgresql://", 1)
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
 
-app.config['SQLALCHEMY_DATABASE_URI'] = db_url or f"sqlite:///{os.path.join(os.path.dirname(__file__), 'app.db')}"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'uma-chave-secreta-muito-segura-para-desenvolvimento')
 
-# --- Inicialização das Extensões ---
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
-login_manager = LoginManager(app)
-login_manager.login_view = 'auth.login'
-login_manager.login_message = "Por favor, faça login para aceder a esta página."
+def database_url():
+    db_url = os.environ.get('DATABASE_URL')
+    if db_url and db_url.startswith("postgres://"):
+        db_url = db_url.replace("postgres://", "postgresql://", 1)
+    return db_url or f"sqlite:///{os.path.join(os.path.dirname(__file__), 'app.db')}"
 
-# --- PASSO 2: Comentar a inicialização e a isenção do CSRF ---
-# csrf = CSRFProtect(app)
 
-# --- Modelos e Blueprints ---
-from src.models.user import User
-from src.models.conversation import Conversation, Patient, Schedule
+def create_app(config=None):
+    """Cria a aplicação. `config` sobrepõe-se à configuração vinda do ambiente."""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url()
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'uma-chave-secreta-muito-segura-para-desenvolvimento')
+    if config:
+        app.config.update(config)
 
-from src.routes.auth import auth_bp
-from src.routes.system import system_bp
-from src.routes.whatsapp import whatsapp_bp
+    # --- Inicialização das Extensões ---
+    db.init_app(app)
+    init_migrations(app)
+    login_manager.init_app(app)
+    csrf.init_app(app)
 
-# csrf.exempt(whatsapp_bp) # <-- PASSO 3: Comentar a isenção
+    # Métricas de rotas e consultas SQL, expostas em /metrics (src/routes/metrics.py)
+    from src.services import metrics
+    metrics.init_app(app, db)
 
-app.register_blueprint(auth_bp)
-app.register_blueprint(system_bp)
-app.register_blueprint(whatsapp_bp)
+    register_models()
+    register_blueprints(app)
 
-# --- Configuração do Login Manager ---
-@login_manager.user_loader
-def load_user(user_id):
-    return User.query.get(int(user_id))
+    from src.commands import conversations_cli, tenants_cli
+    app.cli.add_command(conversations_cli)
+    app.cli.add_command(tenants_cli)
 
-# --- Rotas Principais ---
-@app.route('/')
-def home():
-    return render_template('home.html')
+    # --- Rotas Principais ---
+    @app.route('/')
+    def home():
+        return render_template('home.html')
 
-@app.route('/health')
-def health_check():
-    return "OK", 200
+    @app.route('/health')
+    def health_check():
+        return "OK", 200
+
+    return app
+
+
+def init_migrations(app):
+    """
+    Liga o Flask-Migrate só quando a aplicação é carregada pela CLI do Flask
+    (`flask db ...`): importar o alembic é a parte mais lenta do arranque e os
+    workers não precisam dele.
+    """
+    if click.get_current_context(silent=True) is None:
+        return
+    from flask_migrate import Migrate
+    Migrate(app, db, directory=MIGRATIONS_DIR, render_as_batch=True)
+
+
+def register_models():
+    """Importa todos os modelos, para o metadata do `db` ficar completo (migrações)."""
+    from src.models import (bot_state, campaign, conversation, conversation_archive, message_queue,  # noqa: F401
+                            schedule_change, service_lease, tenant, user)
+
+
+def register_blueprints(app):
+    from src.auth import auth_bp
+    from src.routes.system import system_bp
+    from src.routes.whatsapp import whatsapp_bp
+    from src.routes.metrics import metrics_bp
+
+    # O webhook é chamado pela Meta e o /metrics pelo Prometheus: sem token CSRF.
+    csrf.exempt(whatsapp_bp)
+    csrf.exempt(metrics_bp)
+
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(system_bp)
+    app.register_blueprint(whatsapp_bp)
+    app.register_blueprint(metrics_bp)
+
+
+def reset_after_fork(app):
+    """
+    No worker, logo após o fork: descarta as conexões herdadas do processo pai
+    sem as fechar (o socket é do pai), para cada worker abrir as suas.
+    """
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+def start_background_services(app):
+    """Arranca os estados de entrega, o registo de conversas, a fila, os lembretes e as campanhas."""
+    # --- Estados de Entrega (sent/delivered/read/failed) ---
+    # Registado antes do registo de conversas: o atexit para-o depois, e o
+    # último flush apanha as linhas que o registo acabou de gravar.
+    from src.services.message_status import StatusCoalescer
+
+    message_status = StatusCoalescer(app)
+    app.extensions['message_status'] = message_status
+    message_status.start()
+    atexit.register(message_status.stop)
+
+    # --- Registo de Conversas (write-behind) ---
+    # Registado no atexit antes da fila: como o atexit corre por ordem inversa, a
+    # fila para primeiro e o último flush já inclui as respostas dos seus workers.
+    from src.services.conversation_log import ConversationLogWriter
+
+    conversation_log = ConversationLogWriter(app)
+    app.extensions['conversation_log'] = conversation_log
+    conversation_log.start()
+    atexit.register(conversation_log.stop)
+
+    # --- Fila de Mensagens do WhatsApp ---
+    from src.services.message_queue import MessageQueueWorker
+    from src.services.inbound_handler import handle_inbound_message
+
+    queue_workers = int(os.environ.get('MESSAGE_QUEUE_WORKERS', '4'))
+    if queue_workers > 0:
+        message_queue = MessageQueueWorker(app, handle_inbound_message, num_workers=queue_workers)
+        app.extensions['message_queue'] = message_queue
+        message_queue.start()
+        atexit.register(message_queue.stop)
+
+    # --- Lembretes de Consultas ---
+    # Arranca em todos os processos; o lease no banco garante que só um envia.
+    from src.services.reminders import ReminderScheduler
+
+    if os.environ.get('APPOINTMENT_REMINDERS', '1') != '0':
+        reminder_scheduler = ReminderScheduler(app)
+        app.extensions['reminders'] = reminder_scheduler
+        reminder_scheduler.start()
+        atexit.register(reminder_scheduler.stop)
+
+    # --- Campanhas ---
+    # Cada campanha em envio tem um lease próprio: corre num só processo e é
+    # retomada por outro se esse morrer.
+    from src.services.campaigns import CampaignSupervisor
+
+    campaign_supervisor = CampaignSupervisor(app)
+    app.extensions['campaigns'] = campaign_supervisor
+    campaign_supervisor.start()
+    atexit.register(campaign_supervisor.stop)
 
-# --- Criação do Banco de Dados ---
-with app.app_context():
-    db.create_all()
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    app = create_app()
+    start_background_services(app)
+    app.run(debug=True, use_reloader=False)
@@ -0,0 +1,15 @@
+# src/models/bot_state.py
+# Estado partilhado das conversas do bot (backend SQL do src/services/state_store.py)
+
+from datetime import datetime
+
+from src.models.conversation import db
+
+class BotState(db.Model):
+    __tablename__ = 'bot_state'
+
+    phone_number = db.Column(db.String(20), primary_key=True)
+    data = db.Column(db.Text, nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
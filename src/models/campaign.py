@@ -0,0 +1,88 @@
+# src/models/campaign.py
+# Campanhas de mensagens para todos os pacientes (avisos, fechos, promoções)
+
+from datetime import datetime
+
+from src.models.conversation import db
+
+class Campaign(db.Model):
+    __tablename__ = 'campaign'
+
+    STATUS_DRAFT = 'draft'
+    STATUS_RUNNING = 'running'
+    STATUS_PAUSED = 'paused'
+    STATUS_COMPLETED = 'completed'
+    STATUS_CANCELLED = 'cancelled'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    # Modelo aprovado no WhatsApp (obrigatório para quem não falou com a clínica nas últimas 24h)
+    template_name = db.Column(db.String(100), nullable=True)
+    template_language = db.Column(db.String(10), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default=STATUS_DRAFT)
+    # Clínica que envia (pelo seu número) aos seus pacientes (NULL = a clínica por omissão)
+    tenant_id = db.Column(db.Integer, db.ForeignKey('tenant.id'), nullable=True)
+
+    # Progresso: os pacientes são percorridos por id; last_patient_id é o ponto de retoma
+    total_recipients = db.Column(db.Integer, nullable=False, default=0)
+    sent_count = db.Column(db.Integer, nullable=False, default=0)
+    failed_count = db.Column(db.Integer, nullable=False, default=0)
+    last_patient_id = db.Column(db.Integer, nullable=False, default=0)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    deliveries = db.relationship('CampaignDelivery', backref='campaign', lazy='dynamic',
+                                 cascade="all, delete-orphan")
+
+    @property
+    def processed_count(self):
+        return self.sent_count + self.failed_count
+
+    @property
+    def progress(self):
+        """Percentagem de destinatários já processados."""
+        if not self.total_recipients:
+            return 100.0 if self.status == self.STATUS_COMPLETED else 0.0
+        return min(100.0, 100.0 * self.processed_count / self.total_recipients)
+
+    def render_message(self, full_name):
+        first_name = (full_name or '').split(' ')[0]
+        return self.message.replace('{nome}', first_name)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'status': self.status,
+            'total_recipients': self.total_recipients,
+            'sent_count': self.sent_count,
+            'failed_count': self.failed_count,
+            'progress': round(self.progress, 1),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class CampaignDelivery(db.Model):
+    """Um envio de uma campanha a um paciente; a unicidade impede que seja repetido ao retomar."""
+    __tablename__ = 'campaign_delivery'
+
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+
+    id = db.Column(db.Integer, primary_key=True)
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaign.id'), nullable=False)
+    patient_id = db.Column(db.Integer, nullable=False)
+    phone_number = db.Column(db.String(20), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default=STATUS_SENDING)
+    wamid = db.Column(db.String(128), nullable=True)
+    sent_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # Débito recente de uma campanha: envios por (campaign_id, sent_at)
+    __table_args__ = (
+        db.UniqueConstraint('campaign_id', 'patient_id', name='uq_campaign_delivery_patient'),
+        db.Index('ix_campaign_delivery_campaign_sent_at', 'campaign_id', 'sent_at'),
+    )
@@ -1,10 +1,12 @@
 # src/models/conversation.py
 # Versão 2.0 - Fase 3: Adicionada a tabela Schedule
 
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import validates
 from datetime import datetime
 
-db = SQLAlchemy()
+from src.extensions import db
+from src.services.phone import normalize_phone
+from src.services.text_utils import fold_text, only_digits
 
 class Conversation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -14,6 +16,17 @@ class Conversation(db.Model):
     message_type = db.Column(db.String(10), default='incoming')
     status = db.Column(db.String(20), default='received')
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    # Id (wamid) da resposta enviada: os callbacks de estado atualizam `status` por ele
+    wamid = db.Column(db.String(128), nullable=True)
+    # Clínica do número que recebeu a mensagem (NULL = a clínica por omissão)
+    tenant_id = db.Column(db.Integer, db.ForeignKey('tenant.id'), nullable=True)
+
+    # Histórico por número (ordenado por data), varrimentos por data e estados por wamid
+    __table_args__ = (
+        db.Index('ix_conversation_phone_timestamp', 'phone_number', 'timestamp'),
+        db.Index('ix_conversation_timestamp', 'timestamp'),
+        db.Index('ix_conversation_wamid', 'wamid'),
+    )
 
     def to_dict(self):
         return {
@@ -23,18 +36,35 @@ class Conversation(db.Model):
             'response': self.response,
             'message_type': self.message_type,
             'status': self.status,
+            'wamid': self.wamid,
+            'tenant_id': self.tenant_id,
             'timestamp': self.timestamp.isoformat()
         }
 
 class Appointment(db.Model):
+    # Pedidos nestes estados mantêm o horário escolhido ocupado na agenda;
+    # 'scheduled' (passou a consulta da agenda) e 'cancelled' libertam-no
+    SLOT_HOLDING_STATUSES = ('pending', 'confirmed')
+
     id = db.Column(db.Integer, primary_key=True)
     phone_number = db.Column(db.String(20), nullable=False)
     child_name = db.Column(db.String(100), nullable=True)
     child_age = db.Column(db.String(50), nullable=True)
     reason = db.Column(db.Text, nullable=True)
     preferred_period = db.Column(db.String(50), nullable=True)
+    # Horário escolhido no bot (hora local de São Paulo), se algum foi escolhido
+    slot_start = db.Column(db.DateTime, nullable=True)
+    slot_end = db.Column(db.DateTime, nullable=True)
     status = db.Column(db.String(20), default='pending')
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    # Clínica em que o pedido foi feito pelo bot (NULL = a clínica por omissão)
+    tenant_id = db.Column(db.Integer, db.ForeignKey('tenant.id'), nullable=True)
+
+    # Pedidos por estado, do mais recente para o mais antigo; horários reservados por início
+    __table_args__ = (
+        db.Index('ix_appointment_status_timestamp', 'status', 'timestamp'),
+        db.Index('ix_appointment_slot_start', 'slot_start'),
+    )
 
     def to_dict(self):
         return {
@@ -44,10 +74,32 @@ class Appointment(db.Model):
             'child_age': self.child_age,
             'reason': self.reason,
             'preferred_period': self.preferred_period,
+            'slot_start': self.slot_start.isoformat() if self.slot_start else None,
+            'slot_end': self.slot_end.isoformat() if self.slot_end else None,
             'status': self.status,
+            'tenant_id': self.tenant_id,
             'timestamp': self.timestamp.isoformat()
         }
 
+    def to_event(self):
+        """Evento do FullCalendar para o horário reservado pelo bot (a equipe marca a consulta ou liberta-o)."""
+        return {
+            'id': f"reserva-{self.id}",
+            'title': f"Reserva do bot: {self.child_name or self.phone_number}",
+            'start': self.slot_start.isoformat(),
+            'end': self.slot_end.isoformat(),
+            'color': '#fd7e14',
+            'kind': 'hold',
+            'appointment_id': self.id,
+            'phone_number': self.phone_number,
+            'child_name': self.child_name,
+            'child_age': self.child_age,
+            'reason': self.reason,
+            # Para pré-preencher o modal (input datetime-local, hora de São Paulo)
+            'local_start': self.slot_start.strftime('%Y-%m-%dT%H:%M'),
+            'local_end': self.slot_end.strftime('%Y-%m-%dT%H:%M'),
+        }
+
 class Patient(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     full_name = db.Column(db.String(100), nullable=False)
@@ -57,10 +109,38 @@ class Patient(db.Model):
     address = db.Column(db.String(200), nullable=True)
     medical_history = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Colunas normalizadas para a pesquisa por prefixo (preenchidas automaticamente)
+    search_name = db.Column(db.String(100), nullable=True)
+    phone_digits = db.Column(db.String(20), nullable=True)
+    # Telefone em E.164 (ver src/services/phone.py), para reconhecer o remetente das mensagens
+    phone_e164 = db.Column(db.String(20), nullable=True)
+    # Clínica do cadastro (NULL = a clínica por omissão)
+    tenant_id = db.Column(db.Integer, db.ForeignKey('tenant.id'), nullable=True)
     
     # Relação com as consultas
     schedules = db.relationship('Schedule', backref='patient', lazy=True, cascade="all, delete-orphan")
 
+    # Listagem ordenada por nome (o id desempata nomes iguais) e pesquisa por prefixo
+    __table_args__ = (
+        db.Index('ix_patient_full_name_id', 'full_name', 'id'),
+        db.Index('ix_patient_search_name_id', 'search_name', 'id'),
+        db.Index('ix_patient_phone_digits_id', 'phone_digits', 'id'),
+        db.Index('ix_patient_phone_e164', 'phone_e164'),
+        db.Index('ix_patient_tenant_phone_e164', 'tenant_id', 'phone_e164'),
+    )
+
+    @validates('full_name')
+    def _update_search_name(self, key, value):
+        self.search_name = fold_text(value)
+        return value
+
+    @validates('phone_number')
+    def _update_phone_digits(self, key, value):
+        self.phone_digits = only_digits(value)
+        self.phone_e164 = normalize_phone(value)
+        return value
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -82,6 +162,22 @@ class Schedule(db.Model):
     end_time = db.Column(db.DateTime, nullable=False)
     notes = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Marcado antes do envio do lembrete pelo WhatsApp: nunca é enviado duas vezes
+    reminder_sent_at = db.Column(db.DateTime, nullable=True)
+    # Tentativas de envio do lembrete (as falhadas libertam a marca até MAX_REMINDER_ATTEMPTS)
+    reminder_attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Permite ao agendador de lembretes apanhar as alterações de qualquer processo
+    updated_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Clínica da consulta, a mesma do paciente (NULL = a clínica por omissão)
+    tenant_id = db.Column(db.Integer, db.ForeignKey('tenant.id'), nullable=True)
+
+    # Consultas por intervalo (feed da agenda, de todas as clínicas ou de uma) e consultas de um paciente
+    __table_args__ = (
+        db.Index('ix_schedule_start_end', 'start_time', 'end_time'),
+        db.Index('ix_schedule_tenant_start', 'tenant_id', 'start_time'),
+        db.Index('ix_schedule_patient_start', 'patient_id', 'start_time'),
+        db.Index('ix_schedule_updated_at', 'updated_at'),
+    )
 
     def to_dict(self):
         return {
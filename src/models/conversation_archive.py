@@ -0,0 +1,26 @@
+# src/models/conversation_archive.py
+# Conversas antigas arquivadas: uma partição comprimida por número e por mês
+
+from datetime import datetime
+
+from src.models.conversation import db
+
+class ConversationArchive(db.Model):
+    __tablename__ = 'conversation_archive'
+
+    id = db.Column(db.Integer, primary_key=True)
+    phone_number = db.Column(db.String(20), nullable=False)
+    # Primeiro dia do mês (UTC, como Conversation.timestamp)
+    month = db.Column(db.Date, nullable=False)
+    row_count = db.Column(db.Integer, nullable=False)
+    first_timestamp = db.Column(db.DateTime, nullable=False)
+    last_timestamp = db.Column(db.DateTime, nullable=False)
+    # Linhas de Conversation em NDJSON comprimido com gzip, por ordem de timestamp
+    payload = db.Column(db.LargeBinary, nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    # Histórico de um número por mês e varrimento/contagem por mês
+    __table_args__ = (
+        db.UniqueConstraint('phone_number', 'month', name='uq_conversation_archive_phone_month'),
+        db.Index('ix_conversation_archive_month', 'month'),
+    )
@@ -0,0 +1,62 @@
+# src/models/message_queue.py
+# Fila durável de mensagens recebidas pelo webhook do WhatsApp
+
+import json
+from datetime import datetime
+
+from src.models.conversation import db
+
+class InboundMessage(db.Model):
+    """Mensagem recebida do WhatsApp à espera de processamento pelos workers."""
+    __tablename__ = 'inbound_message'
+
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_DONE = 'done'
+    STATUS_DEAD = 'dead'
+    # Gravadas mas nunca processadas: juntadas à anterior num só turno do bot
+    # (rajada) ou recusadas pelo limite por remetente do webhook
+    STATUS_MERGED = 'merged'
+    STATUS_LIMITED = 'limited'
+
+    id = db.Column(db.Integer, primary_key=True)
+    phone_number = db.Column(db.String(20), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    # Clínica do número que recebeu a mensagem (NULL = a clínica por omissão)
+    tenant_id = db.Column(db.Integer, db.ForeignKey('tenant.id'), nullable=True)
+    response = db.Column(db.Text, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default=STATUS_PENDING)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    available_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime, nullable=True)
+
+    # A cabeça da fila de cada conversa é procurada por (status, phone_number, id)
+    __table_args__ = (
+        db.Index('ix_inbound_message_status_phone_id', 'status', 'phone_number', 'id'),
+    )
+
+    @property
+    def data(self):
+        return json.loads(self.payload)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'phone_number': self.phone_number,
+            'tenant_id': self.tenant_id,
+            'status': self.status,
+            'attempts': self.attempts,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'processed_at': self.processed_at.isoformat() if self.processed_at else None
+        }
+
+class MessageReceipt(db.Model):
+    """wamid de cada mensagem já aceite, para ignorar as reentregas do WhatsApp."""
+    __tablename__ = 'message_receipt'
+
+    wamid = db.Column(db.String(128), primary_key=True)
+    received_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
@@ -0,0 +1,27 @@
+# src/models/schedule_change.py
+# Registo de alterações da agenda (Schedule) para as atualizações em tempo real
+
+from datetime import datetime
+
+from src.models.conversation import db
+
+class ChangeSequence(db.Model):
+    """Contadores por nome. A linha fica bloqueada até ao commit de quem a incrementa:
+    'schedule' dá as versões do registo de alterações (visíveis pela ordem em que
+    foram dadas) e 'booking' serializa as marcações (availability.lock_bookings)."""
+    __tablename__ = 'change_sequence'
+
+    name = db.Column(db.String(40), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+class ScheduleChange(db.Model):
+    __tablename__ = 'schedule_change'
+
+    # Versão monotónica e sem buracos (ChangeSequence 'schedule')
+    version = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    # Sem chave estrangeira: a consulta pode já ter sido apagada
+    schedule_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)  # upsert, delete
+    # Clínica da consulta: cada agenda só recebe as suas alterações
+    tenant_id = db.Column(db.Integer, nullable=True)
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
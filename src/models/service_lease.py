@@ -0,0 +1,14 @@
+# src/models/service_lease.py
+# Leases de serviços de fundo que só podem correr numa instância de cada vez
+
+from datetime import datetime
+
+from src.models.conversation import db
+
+class ServiceLease(db.Model):
+    __tablename__ = 'service_lease'
+
+    name = db.Column(db.String(64), primary_key=True)
+    holder = db.Column(db.String(128), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    acquired_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
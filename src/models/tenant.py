@@ -0,0 +1,37 @@
+# src/models/tenant.py
+# Clínicas/unidades servidas pela mesma instalação, uma por número do WhatsApp
+
+import json
+from datetime import datetime
+
+from src.models.conversation import db
+
+class Tenant(db.Model):
+    __tablename__ = 'tenant'
+
+    id = db.Column(db.Integer, primary_key=True)
+    slug = db.Column(db.String(40), nullable=False, unique=True)
+    name = db.Column(db.String(100), nullable=False)
+    # metadata.phone_number_id dos webhooks deste número
+    phone_number_id = db.Column(db.String(40), nullable=False, unique=True)
+    # Nome da variável de ambiente com o token de acesso (o token não fica no banco)
+    access_token_env = db.Column(db.String(80), nullable=False)
+    # JSON: {"texts": {...}, "calendar": {...}} (ver src/services/tenants.py)
+    settings = db.Column(db.Text, nullable=False, default='{}')
+    active = db.Column(db.Boolean, nullable=False, default=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @property
+    def settings_dict(self):
+        return json.loads(self.settings or '{}')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'slug': self.slug,
+            'name': self.name,
+            'phone_number_id': self.phone_number_id,
+            'access_token_env': self.access_token_env,
+            'active': self.active,
+        }
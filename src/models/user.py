@@ -0,0 +1,28 @@
+# src/models/user.py
+# Utilizadores do sistema de gestão (/system)
+
+from datetime import datetime
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from src.models.conversation import db
+
+class User(db.Model):
+    # "user" é palavra reservada no PostgreSQL
+    __tablename__ = 'app_user'
+
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(64), unique=True, nullable=False)
+    password_hash = db.Column(db.String(256), nullable=False)
+    active = db.Column(db.Boolean, nullable=False, default=True)
+    # Incrementada a cada mudança de senha ou desativação: as sessões emitidas
+    # com uma versão anterior deixam de ser aceites.
+    credentials_version = db.Column(db.Integer, nullable=False, default=1)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def set_password(self, password):
+        self.password_hash = generate_password_hash(password)
+
+    def check_password(self, password):
+        return check_password_hash(self.password_hash, password)
@@ -0,0 +1,24 @@
+# src/routes/metrics.py
+# Endpoint /metrics no formato de exposição de texto do Prometheus
+
+import hmac
+import os
+
+from flask import Blueprint, Response, request
+
+from src.services import metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def export_metrics():
+    """Métricas de todos os workers. Com METRICS_TOKEN definido, exige 'Authorization: Bearer <token>'."""
+    token = os.environ.get('METRICS_TOKEN')
+    if token:
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        if not hmac.compare_digest(supplied, token):
+            return Response("Não autorizado", status=401)
+    return Response(metrics.render(metrics.collect()), mimetype=None, content_type=CONTENT_TYPE)
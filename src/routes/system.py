@@ -1,22 +1,82 @@
 # src/routes/system.py
 # Módulo do Sistema de Gestão - Fase 4.2: Correção Definitiva de Fuso Horário
 
-import json
-from flask import Blueprint, render_template, request, redirect, url_for, flash
-from flask_login import login_required
+from flask import Blueprint, Response, abort, current_app, render_template, request, redirect, session, url_for, flash, jsonify, stream_with_context
+from flask_login import current_user, login_required
 from flask_wtf import FlaskForm
-from wtforms import StringField, DateField, TextAreaField, SelectField, DateTimeField
-from wtforms.validators import DataRequired, Email, Optional
-from datetime import datetime
+from wtforms import StringField, DateField, TextAreaField, IntegerField, DateTimeField
+from wtforms.widgets import HiddenInput
+from wtforms.validators import DataRequired, Email, Optional, ValidationError
+from datetime import date, datetime, timedelta
+from sqlalchemy.orm import joinedload
 import pytz
 
-from src.models.conversation import db, Patient, Schedule
+from src.models.campaign import Campaign
+from src.models.conversation import db, Appointment, Patient, Schedule
+from src.services.availability import (MAX_BOOKING_DURATION, appointment_key, booking_lookback,
+                                       get_availability_index, lock_bookings)
+from src.services.business_calendar import TIMEZONE
+from src.services.campaigns import campaign_throughput, count_recipients
+from src.services.conversation_archive import conversation_history
+from src.services.exports import ExportError, FORMATS, build_query, check_format, export_filename, stream_export
+from src.services.metrics import SCHEDULE_FEED_EVENTS
+from src.services.patient_cache import get_patient_cache
+from src.services.patient_directory import AUTOCOMPLETE_LIMIT, find_patients
+from src.services.phone import normalize_phone
+from src.services.schedule_feed import changes_since, current_version, get_schedule_feed, stream_changes
+from src.services.tenants import get_tenant_registry, tenant_filter
 
 # --- Blueprint ---
 system_bp = Blueprint('system', __name__, url_prefix='/system')
 
-# --- Fuso Horário de Brasília ---
-BR_TIMEZONE = pytz.timezone('America/Sao_Paulo')
+# --- Fuso Horário de Brasília (o mesmo do calendário de atendimento) ---
+BR_TIMEZONE = TIMEZONE
+
+# Duração máxima de uma consulta nova. A busca por intervalo em start_time usa
+# booking_lookback() (a maior duração guardada), para que o índice
+# (start_time, end_time) não percorra o histórico todo sem perder consultas antigas mais longas.
+MAX_SCHEDULE_DURATION = MAX_BOOKING_DURATION
+
+# --- Clínica atual ---
+# Pacientes, agenda, conversas, campanhas e exportações são os da clínica
+# escolhida no menu (guardada na sessão); sem escolha, os da clínica por omissão.
+CLINIC_SESSION_KEY = 'tenant_id'
+
+def current_tenant():
+    return get_tenant_registry().get(session.get(CLINIC_SESSION_KEY))
+
+def get_for_tenant_or_404(model, object_id):
+    """Linha de model da clínica atual; as das outras clínicas dão 404."""
+    obj = db.session.get(model, object_id)
+    if obj is None or obj.tenant_id != current_tenant().id:
+        abort(404)
+    return obj
+
+def duplicate_phone_message(phone_number, tenant_id, patient_id=None):
+    """Erro a mostrar se o telefone já é de outro paciente, ou None."""
+    others = Patient.query.filter(Patient.id != patient_id) if patient_id else Patient.query
+    duplicate = others.filter(tenant_filter(Patient.tenant_id, tenant_id),
+                              Patient.phone_e164 == normalize_phone(phone_number)).first()
+    if duplicate:
+        return f'O paciente "{duplicate.full_name}" já tem este número de telefone.'
+    # phone_number é único em toda a instalação, também entre clínicas
+    if others.filter(Patient.phone_number == phone_number).first():
+        return 'Este número, escrito exatamente assim, já está registado noutra clínica.'
+    return None
+
+@system_bp.app_context_processor
+def inject_clinics():
+    if not current_user.is_authenticated:
+        return {}
+    return {'clinics': get_tenant_registry().all(), 'current_clinic': current_tenant()}
+
+@system_bp.route('/clinica', methods=['POST'])
+@login_required
+def select_clinic():
+    tenant = get_tenant_registry().get(request.form.get('tenant_id', type=int))
+    session[CLINIC_SESSION_KEY] = tenant.id
+    flash(f'A mostrar a clínica "{tenant.name}".', 'info')
+    return redirect(url_for('system.list_patients'))
 
 # --- Formulários ---
 class PatientForm(FlaskForm):
@@ -27,37 +87,70 @@ class PatientForm(FlaskForm):
     address = StringField('Endereço', validators=[Optional()])
     medical_history = TextAreaField('Anamnese / Histórico Médico', validators=[Optional()])
 
+    def validate_phone_number(self, field):
+        if normalize_phone(field.data) is None:
+            raise ValidationError("Número não reconhecido. Use o DDD e o número, ex: (16) 99269-2383.")
+
 class ScheduleForm(FlaskForm):
-    patient_id = SelectField('Paciente', coerce=int, validators=[DataRequired(message="Selecione um paciente.")])
+    # Preenchido pelo campo de pesquisa do modal (ver /pacientes/autocomplete)
+    patient_id = IntegerField('Paciente', widget=HiddenInput(), validators=[DataRequired(message="Selecione um paciente.")])
     title = StringField('Título da Consulta', validators=[DataRequired(message="O título é obrigatório.")])
     start_time = DateTimeField('Início', format='%Y-%m-%dT%H:%M', validators=[DataRequired(message="A data de início é obrigatória.")])
     end_time = DateTimeField('Fim', format='%Y-%m-%dT%H:%M', validators=[DataRequired(message="A data de fim é obrigatória.")])
     notes = TextAreaField('Notas (Opcional)', validators=[Optional()])
+    # Reserva do bot que esta consulta substitui (preenchido pelo modal da reserva)
+    appointment_id = IntegerField('Reserva', widget=HiddenInput(), validators=[Optional()])
+
+class CampaignForm(FlaskForm):
+    name = StringField('Nome da Campanha', validators=[DataRequired(message="O nome é obrigatório.")])
+    message = TextAreaField('Mensagem ({nome} é substituído pelo primeiro nome)', validators=[DataRequired(message="A mensagem é obrigatória.")])
+    template_name = StringField('Modelo aprovado (Opcional)', validators=[Optional()])
+    template_language = StringField('Idioma do modelo', default='pt_BR', validators=[Optional()])
 
 # --- Rotas de Pacientes (CRUD) ---
 @system_bp.route('/')
 @system_bp.route('/pacientes')
 @login_required
 def list_patients():
-    patients = Patient.query.order_by(Patient.full_name).all()
-    return render_template('patients.html', patients=patients)
+    search = request.args.get('q', '').strip()
+    cursor = request.args.get('cursor')
+    patients, next_cursor = find_patients(search, cursor, tenant_id=current_tenant().id)
+    return render_template('patients.html', patients=patients, search=search,
+                           next_cursor=next_cursor, is_first_page=not cursor)
+
+@system_bp.route('/pacientes/autocomplete')
+@login_required
+def autocomplete_patients():
+    """Sugestões de pacientes (por prefixo do nome ou do telefone) para o modal da agenda."""
+    patients, _ = find_patients(
+        request.args.get('q', ''),
+        limit=AUTOCOMPLETE_LIMIT,
+        columns=[Patient.id, Patient.full_name, Patient.phone_number],
+        tenant_id=current_tenant().id
+    )
+    return jsonify([
+        {'id': p.id, 'full_name': p.full_name, 'phone_number': p.phone_number}
+        for p in patients
+    ])
 
 @system_bp.route('/pacientes/novo', methods=['GET', 'POST'])
 @login_required
 def add_patient():
     form = PatientForm()
     if form.validate_on_submit():
-        existing_patient_phone = Patient.query.filter_by(phone_number=form.phone_number.data).first()
+        tenant = current_tenant()
+        phone_error = duplicate_phone_message(form.phone_number.data, tenant.id)
         existing_patient_email = Patient.query.filter(Patient.email.isnot(None), Patient.email == form.email.data).first()
-        if existing_patient_phone:
-            flash('Já existe um paciente com este número de telefone.', 'danger')
+        if phone_error:
+            flash(phone_error, 'danger')
         elif form.email.data and existing_patient_email:
             flash('Já existe um paciente com este email.', 'danger')
         else:
-            new_patient = Patient()
+            new_patient = Patient(tenant_id=tenant.id)
             form.populate_obj(new_patient)
             db.session.add(new_patient)
             db.session.commit()
+            get_patient_cache().invalidate()
             flash(f'Paciente "{form.full_name.data}" adicionado com sucesso!', 'success')
             return redirect(url_for('system.list_patients'))
     return render_template('patient_form.html', form=form, title="Adicionar Novo Paciente")
@@ -65,46 +158,159 @@ def add_patient():
 @system_bp.route('/pacientes/editar/<int:patient_id>', methods=['GET', 'POST'])
 @login_required
 def edit_patient(patient_id):
-    patient = Patient.query.get_or_404(patient_id)
+    patient = get_for_tenant_or_404(Patient, patient_id)
     form = PatientForm(obj=patient)
     if form.validate_on_submit():
-        form.populate_obj(patient)
-        db.session.commit()
-        flash(f'Dados de "{patient.full_name}" atualizados com sucesso!', 'success')
-        return redirect(url_for('system.list_patients'))
+        phone_error = duplicate_phone_message(form.phone_number.data, patient.tenant_id, patient.id)
+        if phone_error:
+            flash(phone_error, 'danger')
+        else:
+            form.populate_obj(patient)
+            db.session.commit()
+            get_patient_cache().invalidate()
+            flash(f'Dados de "{patient.full_name}" atualizados com sucesso!', 'success')
+            return redirect(url_for('system.list_patients'))
     return render_template('patient_form.html', form=form, title=f"Editar Paciente: {patient.full_name}")
 
 @system_bp.route('/pacientes/apagar/<int:patient_id>', methods=['POST'])
 @login_required
 def delete_patient(patient_id):
-    patient = Patient.query.get_or_404(patient_id)
+    patient = get_for_tenant_or_404(Patient, patient_id)
     patient_name = patient.full_name
     db.session.delete(patient)
     db.session.commit()
+    get_patient_cache().invalidate()
     flash(f'Paciente "{patient_name}" apagado com sucesso.', 'warning')
     return redirect(url_for('system.list_patients'))
 
 # --- Rotas da Agenda ---
 
+def parse_calendar_datetime(value):
+    """
+    Converte as datas ISO enviadas pelo FullCalendar para a hora local de Brasília
+    sem fuso, que é como as consultas ficam gravadas na tabela Schedule.
+    """
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace(' ', '+'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(BR_TIMEZONE).replace(tzinfo=None)
+    return parsed
+
 @system_bp.route('/agenda')
 @login_required
 def schedule():
-    all_schedules = Schedule.query.all()
-    events = [s.to_dict() for s in all_schedules]
-    events_json = json.dumps(events)
-    
+    # As consultas não vão embutidas na página: o calendário pede-as a
+    # /agenda/events apenas para o intervalo visível.
+    # A versão é lida antes de o calendário pedir os eventos: as alterações
+    # seguintes chegam pelo stream (as repetidas aplicam-se sem efeito).
     form = ScheduleForm()
-    form.patient_id.choices = [(p.id, p.full_name) for p in Patient.query.order_by('full_name').all()]
-    
-    return render_template('schedule.html', events_json=events_json, form=form)
+    business_hours = current_tenant().calendar.business_hours_for_fullcalendar()
+    return render_template('schedule.html', form=form, business_hours=business_hours,
+                           schedule_version=current_version())
+
+@system_bp.route('/agenda/events')
+@login_required
+def schedule_events():
+    """Feed JSON de eventos do FullCalendar para o intervalo [start, end)."""
+    start = parse_calendar_datetime(request.args.get('start'))
+    end = parse_calendar_datetime(request.args.get('end'))
+    if start is None or end is None:
+        return jsonify({"error": "Parâmetros 'start' e 'end' inválidos ou em falta."}), 400
+
+    # Início mínimo de um evento que ainda ocupa o intervalo (a maior duração guardada)
+    earliest = start - booking_lookback()
+    tenant_id = current_tenant().id
+    schedules = (
+        Schedule.query
+        .options(joinedload(Schedule.patient))
+        .filter(tenant_filter(Schedule.tenant_id, tenant_id),
+                Schedule.start_time >= earliest,
+                Schedule.start_time < end,
+                Schedule.end_time > start)
+        .order_by(Schedule.start_time)
+        .all()
+    )
+    # Horários reservados pelo bot: ocupam a agenda até a equipe marcar a consulta ou os libertar
+    holds = (
+        Appointment.query
+        .filter(tenant_filter(Appointment.tenant_id, tenant_id),
+                Appointment.status.in_(Appointment.SLOT_HOLDING_STATUSES),
+                Appointment.slot_start >= earliest,
+                Appointment.slot_start < end,
+                Appointment.slot_end > start)
+        .order_by(Appointment.slot_start)
+        .all()
+    )
+    return jsonify([s.to_dict() for s in schedules] + [a.to_event() for a in holds])
+
+@system_bp.route('/agenda/alteracoes')
+@login_required
+def schedule_changes():
+    """Alterações da agenda depois da versão ?desde=N; resync=true pede para recarregar os eventos."""
+    since = request.args.get('desde', type=int)
+    if since is None or since < 0:
+        return jsonify({"error": "Parâmetro 'desde' inválido ou em falta."}), 400
+    return jsonify(changes_since(since, current_tenant().id))
+
+@system_bp.route('/agenda/stream')
+@login_required
+def schedule_stream():
+    """As mesmas alterações em Server-Sent Events; ao voltar a ligar vale o Last-Event-ID."""
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('desde', type=int)
+    if since is None or since < 0:
+        return jsonify({"error": "Parâmetro 'desde' inválido ou em falta."}), 400
+
+    feed = get_schedule_feed()
+    if not feed.streams.acquire():
+        # Sem threads livres para mais um stream: a página passa a consultar /agenda/alteracoes
+        SCHEDULE_FEED_EVENTS.inc('rejected')
+        return jsonify({"error": "Demasiados streams abertos."}), 503, {'Retry-After': '30'}
+
+    response = Response(stream_with_context(stream_changes(since, current_tenant().id, feed)),
+                        mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(feed.streams.release)
+    return response
 
 @system_bp.route('/agenda/novo', methods=['POST'])
 @login_required
 def add_schedule():
     form = ScheduleForm()
-    form.patient_id.choices = [(p.id, p.full_name) for p in Patient.query.order_by('full_name').all()]
+    tenant = current_tenant()
+    is_valid = form.validate_on_submit()
+    patient = db.session.get(Patient, form.patient_id.data) if is_valid else None
+    if is_valid and (patient is None or patient.tenant_id != tenant.id):
+        form.patient_id.errors.append("Paciente não encontrado. Selecione um paciente da lista.")
+        is_valid = False
+    if is_valid and not form.start_time.data < form.end_time.data <= form.start_time.data + MAX_SCHEDULE_DURATION:
+        form.end_time.errors.append("O fim tem de ser depois do início, no máximo um dia depois.")
+        is_valid = False
+    hold = None
+    if is_valid and form.appointment_id.data:
+        hold = db.session.get(Appointment, form.appointment_id.data)
+        if hold is None or hold.tenant_id != tenant.id or hold.status not in Appointment.SLOT_HOLDING_STATUSES:
+            form.appointment_id.errors.append("A reserva do bot já não existe ou já foi tratada.")
+            is_valid = False
+    if is_valid:
+        # Verificação e gravação serializadas com as marcações do bot: o lock dura até ao commit
+        lock_bookings(db.session)
+        conflict = get_availability_index(tenant).find_conflict(
+            form.start_time.data, form.end_time.data, verify=True, session=db.session,
+            exclude=appointment_key(hold.id) if hold else None)
+        if conflict is not None:
+            db.session.rollback()
+            form.start_time.errors.append(
+                f"Horário já ocupado por outra marcação ({conflict[0]:%d/%m %H:%M} - {conflict[1]:%H:%M})."
+            )
+            is_valid = False
     
-    if form.validate_on_submit():
+    if is_valid:
         # --- LÓGICA DE FUSO HORÁRIO CORRIGIDA E CENTRALIZADA AQUI ---
         # 1. Pega a data "naïve" (sem fuso) que o formulário envia.
         naive_start_time = form.start_time.data
@@ -119,9 +325,12 @@ def add_schedule():
             title=form.title.data,
             start_time=aware_start_time, # Salva a data com o fuso correto
             end_time=aware_end_time,     # Salva a data com o fuso correto
-            notes=form.notes.data
+            notes=form.notes.data,
+            tenant_id=tenant.id
         )
         db.session.add(new_schedule)
+        if hold is not None:
+            hold.status = 'scheduled'
         db.session.commit()
         flash('Consulta agendada com sucesso!', 'success')
     else:
@@ -131,11 +340,162 @@ def add_schedule():
 
     return redirect(url_for('system.schedule'))
 
+@system_bp.route('/agenda/reservas/<int:appointment_id>/libertar', methods=['POST'])
+@login_required
+def release_hold(appointment_id):
+    """Cancela o pedido do bot e liberta o horário que ele ocupava."""
+    appointment = get_for_tenant_or_404(Appointment, appointment_id)
+    if appointment.status in Appointment.SLOT_HOLDING_STATUSES:
+        appointment.status = 'cancelled'
+        db.session.commit()
+    flash('Horário libertado.', 'success')
+    return redirect(url_for('system.schedule'))
+
 @system_bp.route('/agenda/apagar/<int:schedule_id>', methods=['POST'])
 @login_required
 def delete_schedule(schedule_id):
-    schedule_item = Schedule.query.get_or_404(schedule_id)
+    schedule_item = get_for_tenant_or_404(Schedule, schedule_id)
     db.session.delete(schedule_item)
     db.session.commit()
     flash('Consulta apagada com sucesso.', 'success')
     return redirect(url_for('system.schedule'))
+
+# --- Rotas de Campanhas ---
+
+def notify_campaigns():
+    """Acorda o supervisor de campanhas deste processo (os outros apanham-na no ciclo seguinte)."""
+    supervisor = current_app.extensions.get('campaigns')
+    if supervisor is not None:
+        supervisor.notify()
+
+@system_bp.route('/campanhas')
+@login_required
+def list_campaigns():
+    form = CampaignForm()
+    campaigns = (Campaign.query.filter(tenant_filter(Campaign.tenant_id, current_tenant().id))
+                 .order_by(Campaign.id.desc()).limit(50).all())
+    return render_template('campaigns.html', form=form, campaigns=campaigns)
+
+@system_bp.route('/campanhas/nova', methods=['POST'])
+@login_required
+def add_campaign():
+    form = CampaignForm()
+    if form.validate_on_submit():
+        campaign = Campaign(
+            name=form.name.data,
+            message=form.message.data,
+            template_name=form.template_name.data or None,
+            template_language=form.template_language.data or 'pt_BR',
+            tenant_id=current_tenant().id
+        )
+        db.session.add(campaign)
+        db.session.commit()
+        flash(f'Campanha "{campaign.name}" criada. Inicie-a quando estiver pronta.', 'success')
+    else:
+        for field, errors in form.errors.items():
+            for error in errors:
+                flash(f"Erro no campo '{getattr(form, field).label.text}': {error}", 'danger')
+    return redirect(url_for('system.list_campaigns'))
+
+@system_bp.route('/campanhas/<int:campaign_id>/iniciar', methods=['POST'])
+@login_required
+def start_campaign(campaign_id):
+    campaign = get_for_tenant_or_404(Campaign, campaign_id)
+    if campaign.status not in (Campaign.STATUS_DRAFT, Campaign.STATUS_PAUSED):
+        flash('Só campanhas em rascunho ou pausadas podem ser iniciadas.', 'warning')
+        return redirect(url_for('system.list_campaigns'))
+    # O total é uma estimativa: pacientes registados durante o envio também a recebem.
+    campaign.total_recipients = count_recipients(campaign.tenant_id)
+    campaign.status = Campaign.STATUS_RUNNING
+    db.session.commit()
+    notify_campaigns()
+    flash(f'Campanha "{campaign.name}" em envio.', 'success')
+    return redirect(url_for('system.list_campaigns'))
+
+@system_bp.route('/campanhas/<int:campaign_id>/pausar', methods=['POST'])
+@login_required
+def pause_campaign(campaign_id):
+    campaign = get_for_tenant_or_404(Campaign, campaign_id)
+    if campaign.status == Campaign.STATUS_RUNNING:
+        campaign.status = Campaign.STATUS_PAUSED
+        db.session.commit()
+        flash(f'Campanha "{campaign.name}" pausada; o lote em curso ainda termina.', 'warning')
+    return redirect(url_for('system.list_campaigns'))
+
+@system_bp.route('/campanhas/<int:campaign_id>/cancelar', methods=['POST'])
+@login_required
+def cancel_campaign(campaign_id):
+    campaign = get_for_tenant_or_404(Campaign, campaign_id)
+    if campaign.status in (Campaign.STATUS_DRAFT, Campaign.STATUS_RUNNING, Campaign.STATUS_PAUSED):
+        campaign.status = Campaign.STATUS_CANCELLED
+        campaign.finished_at = datetime.utcnow()
+        db.session.commit()
+        flash(f'Campanha "{campaign.name}" cancelada.', 'warning')
+    return redirect(url_for('system.list_campaigns'))
+
+@system_bp.route('/campanhas/<int:campaign_id>/progresso')
+@login_required
+def campaign_progress(campaign_id):
+    """Progresso, débito (envios por minuto no último minuto) e tempo estimado até ao fim."""
+    campaign = get_for_tenant_or_404(Campaign, campaign_id)
+    data = campaign.to_dict()
+    per_minute = campaign_throughput(campaign.id) if campaign.status == Campaign.STATUS_RUNNING else 0.0
+    remaining = max(0, campaign.total_recipients - campaign.processed_count)
+    data['per_minute'] = round(per_minute, 1)
+    data['eta_seconds'] = int(remaining * 60 / per_minute) if per_minute else None
+    return jsonify(data)
+
+# --- Histórico de Conversas (tabela ativa e arquivo) ---
+
+def local_day_start_utc(day):
+    """Meia-noite de `day` em Brasília, em UTC sem fuso (como Conversation.timestamp)."""
+    return BR_TIMEZONE.localize(datetime.combine(day, datetime.min.time())).astimezone(pytz.utc).replace(tzinfo=None)
+
+@system_bp.route('/conversas')
+@login_required
+def conversation_log():
+    phone = request.args.get('telefone', '').strip()
+    date_from, date_to = request.args.get('de', ''), request.args.get('ate', '')
+    messages = []
+    if phone:
+        try:
+            start = local_day_start_utc(date.fromisoformat(date_from)) if date_from else None
+            end = local_day_start_utc(date.fromisoformat(date_to) + timedelta(days=1)) if date_to else None
+        except ValueError:
+            flash('Datas inválidas: use o seletor de datas.', 'danger')
+            start = end = None
+        messages = conversation_history(phone, start, end, tenant_id=current_tenant().id)
+        for message in messages:
+            message['local_time'] = pytz.utc.localize(message['timestamp']).astimezone(BR_TIMEZONE)
+    return render_template('conversations.html', messages=messages, phone=phone,
+                           date_from=date_from, date_to=date_to)
+
+# --- Exportações (CSV / NDJSON) ---
+
+@system_bp.route('/exportar/<dataset>')
+@login_required
+def export_data(dataset):
+    """
+    Exporta conversas, pedidos, pacientes ou agenda da clínica atual em streaming.
+    Parâmetros: formato (csv ou ndjson), de e ate (AAAA-MM-DD, inclusive),
+    estado (conversas e pedidos) e telefone.
+    """
+    fmt = request.args.get('formato', 'csv')
+    try:
+        check_format(fmt)
+        query = build_query(
+            dataset,
+            date_from=request.args.get('de'),
+            date_to=request.args.get('ate'),
+            status=request.args.get('estado'),
+            phone=request.args.get('telefone'),
+            tenant_id=current_tenant().id
+        )
+    except ExportError as e:
+        return jsonify({"error": str(e)}), 400
+
+    response = Response(stream_with_context(stream_export(query, fmt)), content_type=FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="{export_filename(dataset, fmt)}"'
+    # Sem buffering em proxies: os blocos chegam ao cliente à medida que são gerados
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -1,12 +1,15 @@
 # src/routes/whatsapp.py
-# TESTE DE DIAGNÓSTICO EXTREMO: Simplificar o webhook POST ao máximo.
+# Webhook do WhatsApp: as mensagens vão para a fila durável e são processadas
+# em segundo plano por src/services/message_queue.py.
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 import os
-import json # Manter para depuração, se necessário
+import time
 
-# Não vamos importar BotLogic, Conversation, Appointment, send_whatsapp_message
-# para garantir que nada interfere.
+from src.models.conversation import db
+from src.services import metrics
+from src.services.message_queue import enqueue_webhook_payload
+from src.services.message_status import extract_statuses, record_statuses
 
 whatsapp_bp = Blueprint('whatsapp', __name__, url_prefix='/api/whatsapp')
 
@@ -35,38 +38,37 @@ def verify_webhook():
 
 @whatsapp_bp.route('/webhook', methods=['POST'])
 def handle_webhook():
-    """TESTE: Processa mensagens recebidas do WhatsApp com o mínimo de lógica."""
-    print("INFO: [TESTE EXTREMO] Recebido pedido POST em /webhook.")
-    
-    # Tentar obter o corpo do pedido, mas sem processá-lo.
+    """Grava as mensagens recebidas na fila durável e responde imediatamente."""
+    started = time.perf_counter()
+    metrics.WEBHOOK_PAYLOAD_BYTES.observe(request.content_length or 0)
+    payload = request.get_json(silent=True)
+    if not payload:
+        metrics.WEBHOOK_DURATION.observe(time.perf_counter() - started, 'ignored')
+        return jsonify({"status": "ignored", "message": "Payload vazio ou inválido"}), 200
+
     try:
-        raw_data = request.get_data()
-        print(f"DEBUG: [TESTE EXTREMO] Dados brutos recebidos (tamanho: {len(raw_data)} bytes).")
-        # Opcional: imprimir os primeiros 500 caracteres para depuração
-        # print(f"DEBUG: [TESTE EXTREMO] Conteúdo: {raw_data.decode('utf-8')[:500]}")
+        queued = enqueue_webhook_payload(payload)
+        statuses = extract_statuses(payload)
+        if statuses:
+            record_statuses(statuses)
     except Exception as e:
-        print(f"ERRO: [TESTE EXTREMO] Falha ao obter dados brutos: {str(e)}")
-        # Ainda assim, tentar retornar 200 OK para não ser reenviado
-        return jsonify({"status": "error", "message": "Falha ao ler dados"}), 200
-
-    # Retornar 200 OK imediatamente, sem qualquer outra lógica.
-    print("INFO: [TESTE EXTREMO] Retornando 200 OK imediatamente.")
-    return jsonify({"status": "success", "message": "Pedido recebido e ignorado (teste)"}), 200
+        db.session.rollback()
+        print(f"ERRO: Falha ao gravar o webhook na fila: {str(e)}")
+        metrics.WEBHOOK_DURATION.observe(time.perf_counter() - started, 'error')
+        # Sem 200 o WhatsApp reenvia a entrega mais tarde, por isso nada se perde.
+        return jsonify({"status": "error", "message": "Falha ao gravar na fila"}), 500
 
-# --- Rotas de Administração (Manter para não quebrar a aplicação, mas não serão testadas) ---
-# Você pode manter as rotas get_conversations, get_appointments, update_appointment_status
-# mas elas não serão afetadas por este teste.
-# Se quiser, pode comentá-las temporariamente para um isolamento ainda maior,
-# mas lembre-se de as reativar depois.
+    message_queue = current_app.extensions.get('message_queue')
+    if queued and message_queue is not None:
+        message_queue.notify()
 
-# @whatsapp_bp.route('/conversations', methods=['GET'])
-# def get_conversations():
-#     return jsonify({"message": "Conversations route disabled for test"})
-
-# @whatsapp_bp.route('/appointments', methods=['GET'])
-# def get_appointments():
-#     return jsonify({"message": "Appointments route disabled for test"})
+    metrics.WEBHOOK_MESSAGES.inc(amount=queued)
+    if queued:
+        result = 'queued'
+    else:
+        result = 'statuses' if statuses else 'no_messages'
+    metrics.WEBHOOK_DURATION.observe(time.perf_counter() - started, result)
+    return jsonify({"status": "success", "queued": queued, "statuses": len(statuses)}), 200
 
-# @whatsapp_bp.route('/appointments/<int:appointment_id>/status', methods=['PUT'])
-# def update_appointment_status(appointment_id):
-#     return jsonify({"message": "Appointment status route disabled for test"})
+# As listagens de conversas e pedidos para administração estão em
+# /system/exportar/<conjunto> (src/routes/system.py), com autenticação.
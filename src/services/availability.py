@@ -0,0 +1,368 @@
+# src/services/availability.py
+# Disponibilidade da agenda: índice em memória dos intervalos ocupados
+# (consultas da agenda e horários reservados pelo bot), ordenado pelo início.
+# Cada clínica (src/services/tenants.py) tem a sua agenda e o seu índice.
+#
+# "Este intervalo tem conflito?" é uma busca binária seguida da verificação
+# das poucas marcações que começam até booking_lookback() antes do fim do
+# intervalo. O índice é atualizado por commit (eventos da sessão) e recarregado
+# do banco a cada REFRESH_INTERVAL segundos, para apanhar as marcações feitas
+# por outros processos. Nas escritas, o conflito é confirmado também no banco,
+# depois de lock_bookings: a verificação e a gravação da marcação ficam
+# serializadas entre processos até ao commit.
+
+import math
+import threading
+import time as time_module
+from bisect import bisect_left, insort
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import and_, event, extract, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from src.models.conversation import db, Appointment, Schedule
+from src.models.schedule_change import ChangeSequence
+from src.services.business_calendar import TIMEZONE, get_business_calendar
+from src.services.tenants import tenant_filter
+from src.services.text_utils import fold_text
+
+# Duração máxima de uma marcação nova (validada nos formulários e no bot).
+MAX_BOOKING_DURATION = timedelta(days=1)
+# De quanto em quanto tempo se relê a maior duração guardada no banco
+LOOKBACK_TTL = 300
+
+SLOT_DURATION = timedelta(minutes=60)
+SLOT_STEP = timedelta(minutes=30)
+MIN_NOTICE = timedelta(hours=2)
+SEARCH_HORIZON = timedelta(days=30)
+REFRESH_INTERVAL = 60
+
+MORNING = 'morning'
+AFTERNOON = 'afternoon'
+MIDDAY = time(12, 0)
+
+
+def parse_period(text):
+    """'Manhã' -> MORNING, 'Tarde' -> AFTERNOON, qualquer outra coisa -> None (qualquer horário)."""
+    folded = fold_text(text or '')
+    if 'manha' in folded:
+        return MORNING
+    if 'tarde' in folded:
+        return AFTERNOON
+    return None
+
+
+def _duration_seconds(conn, start, end):
+    """Expressão SQL com a duração em segundos de [start, end)."""
+    if conn.dialect.name == 'sqlite':
+        return (func.julianday(end) - func.julianday(start)) * 86400
+    return extract('epoch', end - start)
+
+
+class BookingLookback:
+    """
+    Quanto antes do início de um intervalo pode começar uma marcação que o
+    ocupa: a maior duração guardada (consultas antigas, gravadas antes da
+    validação ou importadas, podem passar de MAX_BOOKING_DURATION), nunca
+    menos do que MAX_BOOKING_DURATION. Relida do banco a cada ttl_seconds.
+    """
+
+    def __init__(self, ttl_seconds=LOOKBACK_TTL):
+        self.ttl_seconds = ttl_seconds
+        self._value = MAX_BOOKING_DURATION
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, conn=None):
+        if time_module.monotonic() < self._expires_at:
+            return self._value
+        if conn is None:
+            with db.engine.connect() as conn:
+                return self(conn)
+        longest = 0.0
+        for start, end in ((Schedule.start_time, Schedule.end_time),
+                           (Appointment.slot_start, Appointment.slot_end)):
+            longest = max(longest, conn.execute(
+                select(func.max(_duration_seconds(conn, start, end))).where(start.is_not(None))).scalar() or 0)
+        with self._lock:
+            self._value = max(MAX_BOOKING_DURATION, timedelta(seconds=math.ceil(longest)))
+            self._expires_at = time_module.monotonic() + self.ttl_seconds
+            return self._value
+
+    def invalidate(self):
+        self._expires_at = 0.0
+
+
+booking_lookback = BookingLookback()
+
+
+def local_now():
+    """Hora atual de São Paulo sem fuso, como as datas guardadas na agenda."""
+    return datetime.now(TIMEZONE).replace(tzinfo=None)
+
+
+def _round_up(moment, step=SLOT_STEP):
+    midnight = datetime.combine(moment.date(), time.min)
+    steps = -(-(moment - midnight) // step)
+    return midnight + steps * step
+
+
+class IntervalIndex:
+    """Intervalos [início, fim) com chave, ordenados pelo início."""
+
+    def __init__(self):
+        self._entries = []   # (início, fim, chave), ordenado
+        self._by_key = {}
+        self._max_duration = timedelta(0)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, key, start, end):
+        self.remove(key)
+        insort(self._entries, (start, end, key))
+        self._by_key[key] = (start, end)
+        self._max_duration = max(self._max_duration, end - start)
+
+    def remove(self, key):
+        interval = self._by_key.pop(key, None)
+        if interval is None:
+            return
+        i = bisect_left(self._entries, (interval[0], interval[1], key))
+        if i < len(self._entries) and self._entries[i][2] == key:
+            del self._entries[i]
+
+    def overlapping(self, start, end):
+        """Intervalos que se sobrepõem a [start, end), pela ordem de início."""
+        # Só podem sobrepor-se os que começam em [start - duração máxima, end).
+        i = bisect_left(self._entries, (start - self._max_duration,))
+        entries = self._entries
+        while i < len(entries) and entries[i][0] < end:
+            if entries[i][1] > start:
+                yield entries[i]
+            i += 1
+
+    def first_overlap(self, start, end):
+        return next(self.overlapping(start, end), None)
+
+
+def schedule_key(schedule_id):
+    return ('schedule', schedule_id)
+
+
+def appointment_key(appointment_id):
+    return ('appointment', appointment_id)
+
+
+def _booking_of(obj):
+    """
+    (chave, início, fim) da marcação representada por obj, ou (chave, None, None)
+    se não ocupar a agenda; a clínica é obj.tenant_id.
+    """
+    if isinstance(obj, Schedule):
+        return schedule_key(obj.id), obj.start_time, obj.end_time
+    if isinstance(obj, Appointment):
+        if obj.status in Appointment.SLOT_HOLDING_STATUSES and obj.slot_start and obj.slot_end:
+            return appointment_key(obj.id), obj.slot_start, obj.slot_end
+        return appointment_key(obj.id), None, None
+    return None
+
+
+BOOKING_LOCK = 'booking'
+
+
+def lock_bookings(session):
+    """
+    Bloqueia a linha 'booking' de change_sequence até ao fim da transação da
+    sessão: quem verifica um conflito (find_conflict(..., session=...)) e grava
+    a marcação depois disto não se cruza com outra marcação no mesmo horário.
+    """
+    conn = session.connection()
+    table = ChangeSequence.__table__
+    result = conn.execute(update(table).where(table.c.name == BOOKING_LOCK).values(value=table.c.value + 1))
+    if result.rowcount == 0:
+        # Banco criado sem a migração (create_all): a linha nasce aqui
+        conn.execute(insert(table).values(name=BOOKING_LOCK, value=1))
+
+
+def _naive(moment):
+    # A agenda grava datas com fuso de São Paulo; no banco ficam sem fuso.
+    if moment is not None and moment.tzinfo is not None:
+        return moment.astimezone(TIMEZONE).replace(tzinfo=None)
+    return moment
+
+
+class AvailabilityIndex:
+    """Marcações de uma clínica (tenant_id None = a por omissão), no horário de atendimento dela."""
+
+    def __init__(self, calendar=None, refresh_interval=REFRESH_INTERVAL, tenant_id=None):
+        self.calendar = calendar or get_business_calendar()
+        self.tenant_id = tenant_id
+        self.refresh_interval = refresh_interval
+        self._index = IntervalIndex()
+        self._lock = threading.RLock()
+        self._loaded_at = None
+
+    # --- Carregamento e manutenção ---
+    def load(self):
+        """Recarrega do banco as marcações que ainda não terminaram."""
+        index = IntervalIndex()
+        with db.engine.connect() as conn:
+            since = local_now() - booking_lookback(conn)
+            for row in conn.execute(
+                select(Schedule.id, Schedule.start_time, Schedule.end_time).where(
+                    tenant_filter(Schedule.tenant_id, self.tenant_id), Schedule.end_time > since)
+            ):
+                index.add(schedule_key(row.id), row.start_time, row.end_time)
+            for row in conn.execute(
+                select(Appointment.id, Appointment.slot_start, Appointment.slot_end).where(
+                    tenant_filter(Appointment.tenant_id, self.tenant_id),
+                    Appointment.slot_start.is_not(None),
+                    Appointment.slot_end > since,
+                    Appointment.status.in_(Appointment.SLOT_HOLDING_STATUSES)
+                )
+            ):
+                index.add(appointment_key(row.id), row.slot_start, row.slot_end)
+        with self._lock:
+            self._index = index
+            self._loaded_at = time_module.monotonic()
+
+    def _ensure_fresh(self):
+        if self._loaded_at is None or time_module.monotonic() - self._loaded_at > self.refresh_interval:
+            self.load()
+
+    def apply(self, changes):
+        """Aplica [(chave, início, fim)] confirmados por um commit (início None = libertar)."""
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            for key, start, end in changes:
+                if start is None:
+                    self._index.remove(key)
+                else:
+                    self._index.add(key, _naive(start), _naive(end))
+
+    # --- Consultas ---
+    def find_conflict(self, start, end, exclude=None, verify=False, session=None):
+        """
+        Primeira marcação (início, fim, chave) que se sobrepõe a [start, end), ou None.
+        Com verify=True o resultado livre é confirmado no banco (marcações de
+        outros processos feitas depois do último recarregamento); com session, a
+        confirmação corre na transação dela (depois de lock_bookings).
+        """
+        self._ensure_fresh()
+        with self._lock:
+            for entry in self._index.overlapping(start, end):
+                if entry[2] != exclude:
+                    return entry
+        if not verify:
+            return None
+        if session is not None:
+            conflict = self._find_conflict_in_db(session.connection(), start, end, exclude)
+        else:
+            with db.engine.connect() as conn:
+                conflict = self._find_conflict_in_db(conn, start, end, exclude)
+        if conflict is not None:
+            # Marcação de outro processo ainda não recarregada: passa já a contar
+            self.apply([(conflict[2], conflict[0], conflict[1])])
+        return conflict
+
+    def _find_conflict_in_db(self, conn, start, end, exclude=None):
+        earliest = start - booking_lookback(conn)
+        for row in conn.execute(
+            select(Schedule.id, Schedule.start_time, Schedule.end_time).where(
+                tenant_filter(Schedule.tenant_id, self.tenant_id),
+                Schedule.start_time >= earliest, Schedule.start_time < end, Schedule.end_time > start
+            )
+        ):
+            if schedule_key(row.id) != exclude:
+                return row.start_time, row.end_time, schedule_key(row.id)
+        for row in conn.execute(
+            select(Appointment.id, Appointment.slot_start, Appointment.slot_end).where(and_(
+                tenant_filter(Appointment.tenant_id, self.tenant_id),
+                Appointment.slot_start >= earliest, Appointment.slot_start < end, Appointment.slot_end > start,
+                Appointment.status.in_(Appointment.SLOT_HOLDING_STATUSES)
+            ))
+        ):
+            if appointment_key(row.id) != exclude:
+                return row.slot_start, row.slot_end, appointment_key(row.id)
+        return None
+
+    def free_slots(self, count=3, duration=SLOT_DURATION, period=None, after=None, horizon=SEARCH_HORIZON):
+        """Primeiros `count` horários livres [(início, fim)] com a clínica aberta, no período pedido."""
+        self._ensure_fresh()
+        earliest = _round_up(max(after or local_now(), local_now() + MIN_NOTICE))
+        slots = []
+        for open_start, open_end in self.calendar.open_intervals(earliest, earliest + horizon):
+            window_start, window_end = open_start.replace(tzinfo=None), open_end.replace(tzinfo=None)
+            midday = datetime.combine(window_start.date(), MIDDAY)
+            if period == MORNING:
+                window_end = min(window_end, midday)
+            elif period == AFTERNOON:
+                window_start = max(window_start, midday)
+
+            candidate = _round_up(window_start)
+            while candidate + duration <= window_end:
+                with self._lock:
+                    conflict = self._index.first_overlap(candidate, candidate + duration)
+                if conflict is None:
+                    slots.append((candidate, candidate + duration))
+                    if len(slots) == count:
+                        return slots
+                    candidate += duration
+                else:
+                    candidate = _round_up(max(conflict[1], candidate + SLOT_STEP))
+        return slots
+
+
+# --- Atualização incremental pelos commits ---
+PENDING_KEY = 'availability_changes'
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    changes = session.info.setdefault(PENDING_KEY, {})   # tenant_id -> [(chave, início, fim)]
+    for obj in list(session.new) + list(session.dirty):
+        booking = _booking_of(obj)
+        if booking is not None:
+            changes.setdefault(obj.tenant_id, []).append(booking)
+    for obj in session.deleted:
+        booking = _booking_of(obj)
+        if booking is not None:
+            changes.setdefault(obj.tenant_id, []).append((booking[0], None, None))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_changes(session):
+    changes = session.info.pop(PENDING_KEY, None)
+    for tenant_id, tenant_changes in (changes or {}).items():
+        index = _indexes.get(tenant_id)
+        if index is not None:
+            index.apply(tenant_changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop(PENDING_KEY, None)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_availability_index(tenant=None):
+    """
+    Índice partilhado do processo com a agenda da clínica (None = a por omissão),
+    carregado na primeira consulta, dentro de um app context.
+    """
+    tenant_id = tenant.id if tenant is not None else None
+    calendar = tenant.calendar if tenant is not None else get_business_calendar()
+    index = _indexes.get(tenant_id)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(tenant_id)
+            if index is None:
+                index = _indexes[tenant_id] = AvailabilityIndex(calendar, tenant_id=tenant_id)
+    # Configuração da clínica relida (TenantRegistry): vale o horário de atendimento novo
+    index.calendar = calendar
+    return index
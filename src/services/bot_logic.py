@@ -3,59 +3,117 @@
 import re
 from datetime import datetime
 from src.models.conversation import db, Appointment
+from src.services import metrics
+from src.services.availability import get_availability_index, lock_bookings, parse_period
+from src.services.business_calendar import TIMEZONE, format_opening
+from src.services.flow_engine import FlowEngine
+from src.services.patient_cache import get_patient_cache
+from src.services.state_store import StateConflictError, create_state_store
+from src.services.tenants import default_tenant
+
+def first_name(full_name):
+    return full_name.split(' ')[0]
+
+
+def format_age(birth_date, today=None):
+    """Idade a partir da data de nascimento: '5 anos e 3 meses', '1 ano', '8 meses'."""
+    today = today or datetime.now(TIMEZONE).date()
+    months = (today.year - birth_date.year) * 12 + today.month - birth_date.month - (today.day < birth_date.day)
+    years, months = divmod(max(months, 0), 12)
+    parts = []
+    if years:
+        parts.append(f"{years} ano" if years == 1 else f"{years} anos")
+    if months or not years:
+        parts.append(f"{months} mês" if months == 1 else f"{months} meses")
+    return ' e '.join(parts)
+
 
 class BotLogic:
-    def __init__(self):
-        self.user_states = {}
+    def __init__(self, state_store=None, flow_engine=None, calendar=None, availability=None, patients=None,
+                 tenant=None):
+        # Clínica servida: textos, telefones e horário (ver src/services/tenants.py).
+        self.tenant = tenant or default_tenant()
+        self.texts = self.tenant.texts
+        # Estado partilhado entre processos (ver src/services/state_store.py).
+        self.states = state_store or create_state_store()
+        # Horário de atendimento em America/Sao_Paulo (ver src/services/business_calendar.py).
+        self.calendar = calendar or self.tenant.calendar
+        # Horários livres da agenda para oferecer no agendamento (ver src/services/availability.py).
+        self.availability = availability or get_availability_index(self.tenant)
+        # Pacientes já registados, reconhecidos pelo telefone (ver src/services/patient_cache.py).
+        self.patients = patients if patients is not None else get_patient_cache()
+
+        # Ações que as transições do fluxo (src/services/conversation_flow.json) podem invocar.
+        self.actions = {
+            'main_menu': self.show_main_menu,
+            'first_consultation_info': lambda message, phone_number, record: self.get_first_consultation_info(),
+            'insurance_info': lambda message, phone_number, record: self.get_insurance_info(),
+            'treatments_info': lambda message, phone_number, record: self.get_treatments_info(),
+            'schedule': self.request_appointment,
+            'team_contact': self.request_team_contact,
+            'emergency_contact': lambda message, phone_number, record: self.get_emergency_contact(),
+            'appointment_step': self.handle_appointment_flow,
+            'default_response': lambda message, phone_number, record: self.get_default_response(),
+        }
+        self.flow = flow_engine or FlowEngine(known_actions=self.actions)
 
     def process_message(self, message, phone_number):
         """Processa a mensagem e retorna a resposta apropriada, considerando o horário comercial."""
-        message_lower = message.lower().strip()
-        state = self.user_states.get(phone_number, {}).get('step', 'initial')
-
-        # --- FLUXO DE CONVERSA PRINCIPAL ---
-        # O menu principal e as informações devem funcionar a qualquer hora.
-        if message_lower in ['oi', 'olá', 'bom dia', 'boa tarde', 'boa noite', 'menu'] or state == 'initial':
-            self.user_states[phone_number] = {'step': 'awaiting_choice'}
-            return self.get_main_menu()
-
-        elif '1' in message_lower and state == 'awaiting_choice':
-            return self.get_first_consultation_info()
-
-        elif '2' in message_lower and state == 'awaiting_choice':
-            return self.get_insurance_info()
-
-        elif '3' in message_lower and state == 'awaiting_choice':
-            return self.get_treatments_info()
-
-        # --- OPÇÕES QUE DEPENDEM DO HORÁRIO ---
-        # Agora, a verificação do horário é feita aqui, apenas para as opções relevantes.
-
-        elif '4' in message_lower and state == 'awaiting_choice': # Agendar
-            if not self.is_business_hours():
-                return self.get_after_hours_message(action="agendamento")
-            return self.start_appointment_flow(phone_number)
-
-        elif '5' in message_lower and state == 'awaiting_choice': # Falar com a equipe
-            if not self.is_business_hours():
-                return self.get_after_hours_message(action="atendimento")
-            return self.get_team_contact()
-
-        elif any(word in message_lower for word in ['emergência', 'emergencia', 'urgência', 'urgencia', 'dor']):
-            return self.get_emergency_contact()
-
-        # --- FLUXO DE AGENDAMENTO (se já estiver em andamento) ---
-        elif phone_number in self.user_states and state != 'awaiting_choice':
-            return self.handle_appointment_flow(message, phone_number)
-
+        record = self.states.get(self.tenant.state_prefix + phone_number)
+        state = record.value.get('step', 'initial') if record else 'initial'
+        action, _ = self.flow.route(state, message)
+        metrics.BOT_TRANSITIONS.inc(state, action)
+        with metrics.BOT_STEP_DURATION.time(state):
+            return self.actions[action](message, phone_number, record)
+
+    def merges_bursts(self, phone_number):
+        """Se as mensagens em rajada deste número podem ser respondidas num só turno (depende do estado)."""
+        record = self.states.get(self.tenant.state_prefix + phone_number)
+        state = record.value.get('step', 'initial') if record else 'initial'
+        return self.flow.merges_bursts(state)
+
+    # --- AÇÕES DO FLUXO ---
+    def show_main_menu(self, message, phone_number, record):
+        """O menu principal e as informações devem funcionar a qualquer hora."""
+        if record is None or record.value.get('step') != 'awaiting_choice':
+            self.save_state(phone_number, {'step': 'awaiting_choice'}, record)
+        return self.get_main_menu(self.patients.lookup(phone_number, self.tenant.id))
+
+    def request_appointment(self, message, phone_number, record):
+        """Opção 4: só inicia o agendamento dentro do horário comercial."""
+        if not self.is_business_hours():
+            return self.get_after_hours_message(action="agendamento")
+        return self.start_appointment_flow(phone_number, record)
+
+    def request_team_contact(self, message, phone_number, record):
+        """Opção 5: contacto da equipe, só dentro do horário comercial."""
+        if not self.is_business_hours():
+            return self.get_after_hours_message(action="atendimento")
+        return self.get_team_contact()
+
+    @property
+    def phones_inline(self):
+        return ' ou '.join(self.texts['phones'])
+
+    @property
+    def phones_list(self):
+        return '\n'.join(f"• {phone}" for phone in self.texts['phones'])
+
+    def save_state(self, phone_number, value, record):
+        """Grava o estado com compare-and-set sobre a versão lida (value=None apaga)."""
+        expected_version = record.version if record else None
+        if not self.states.compare_and_set(self.tenant.state_prefix + phone_number, value, expected_version):
+            raise StateConflictError(f"Estado de {phone_number} alterado em paralelo")
+
+    def get_main_menu(self, patient=None):
+        """Retorna o menu principal (com saudação pelo nome se o número for de um paciente)"""
+        if patient is not None:
+            greeting = f"Olá! Que bom falar de novo com a família de *{first_name(patient.full_name)}*! 😊"
         else:
-            return self.get_default_response()
+            greeting = "Olá! Seja bem-vindo(a)! "
+        return f"""🦷 *{self.texts['clinic_name']}*
 
-    def get_main_menu(self):
-        """Retorna o menu principal"""
-        return """🦷 *Dentinhos de Leite Odontologia*
-
-Olá! Seja bem-vindo(a)! 
+{greeting}
 
 Como posso ajudá-lo(a) hoje?
 
@@ -73,15 +131,15 @@ Como posso ajudá-lo(a) hoje?
 
 Digite o número da opção desejada ou a palavra-chave.
 
-Para emergências 24h: (16) 99269-2383 ou (16) 99212-0514"""
+Para emergências 24h: {self.phones_inline}"""
 
     def get_first_consultation_info(self):
         """Informações sobre primeira consulta"""
-        return """💰 *PRIMEIRA CONSULTA*
+        return f"""💰 *PRIMEIRA CONSULTA*
 
-🔹 *Valor:* R$ 179,90
+🔹 *Valor:* {self.texts['consultation_price']}
 🔹 *Inclui:*
-   • Consulta completa com o Dr Rafael Moreira -Odontopediatra - CRO/SP 156455
+   • Consulta completa com o {self.texts['dentist']}
    • Tem em média 1h de atendimento.
    • Atendimento humanizado e lúdico.
    • Consultório com estrutura completa.
@@ -97,7 +155,7 @@ Para emergências 24h: (16) 99269-2383 ou (16) 99212-0514"""
 
     def get_insurance_info(self):
         """Informações sobre convênios"""
-        return """🏥 *CONVÊNIOS ODONTOLÓGICOS*
+        return f"""🏥 *CONVÊNIOS ODONTOLÓGICOS*
 
 ❌ *Não trabalhamos com convênios odontológicos*
 
@@ -110,7 +168,7 @@ Para garantir a qualidade e o tempo necessário para cada atendimento, optamos p
 ✅ Foco total na saúde bucal do seu filho
 
 💳 Aceitamos cartões de débito e crédito
-💰 Consulta: R$ 179,90
+💰 Consulta: {self.texts['consultation_price']}
 
 🏠 Voltar ao menu principal: digite *menu*"""
 
@@ -138,26 +196,65 @@ Para garantir a qualidade e o tempo necessário para cada atendimento, optamos p
 📅 Agende sua consulta: digite *4*
 🏠 Menu principal: digite *menu*"""
 
-    def start_appointment_flow(self, phone_number):
-        """Inicia o fluxo de agendamento"""
-        self.user_states[phone_number] = {
+    def start_appointment_flow(self, phone_number, record=None):
+        """Inicia o fluxo de agendamento (a confirmar a criança, se o número for de um paciente)"""
+        patient = self.patients.lookup(phone_number, self.tenant.id)
+        if patient is not None:
+            self.save_state(phone_number, {
+                'step': 'confirm_patient',
+                'data': {'patient_id': patient.id}
+            }, record)
+            return f"""📅 *AGENDAMENTO DE CONSULTA*
+
+A consulta é para *{patient.full_name}*?
+
+*1* - Sim
+*2* - Não, é para outra criança"""
+
+        self.save_state(phone_number, {
             'step': 'name',
             'data': {}
-        }
+        }, record)
         return """📅 *AGENDAMENTO DE CONSULTA*
 
 Vou precisar de algumas informações:
 
 👶 *Qual o nome da criança?*"""
 
-    def handle_appointment_flow(self, message, phone_number):
+    def handle_appointment_flow(self, message, phone_number, record):
         """Gerencia o fluxo de agendamento"""
-        state = self.user_states[phone_number]
+        state = record.value
         step = state['step']
 
+        if step == 'confirm_patient':
+            patient = self.patients.lookup(phone_number, self.tenant.id)
+            answer = message.strip().lower()
+            if patient is None or patient.id != state['data'].get('patient_id') or answer in ('2', 'nao', 'não'):
+                state['step'] = 'name'
+                state['data'] = {}
+                self.save_state(phone_number, state, record)
+                return """👶 *Qual o nome da criança?*"""
+            if answer not in ('1', 'sim'):
+                return f"""Por favor, responda *1* se a consulta for para *{patient.full_name}* ou *2* se for para outra criança."""
+
+            state['data']['child_name'] = patient.full_name
+            if patient.birth_date is None:
+                state['step'] = 'age'
+                self.save_state(phone_number, state, record)
+                return """👶 *Qual a idade da criança?*
+
+(Ex: 3 anos, 5 anos e 6 meses, etc.)"""
+            state['data']['child_age'] = format_age(patient.birth_date)
+            state['step'] = 'reason'
+            self.save_state(phone_number, state, record)
+            return """🔍 *Qual o motivo da consulta?*
+
+(Ex: primeira consulta, dor de dente, limpeza, etc.)"""
+
         if step == 'name':
             state['data']['child_name'] = message
             state['step'] = 'age'
+            self.save_state(phone_number, state, record)
             return """👶 *Qual a idade da criança?*
 
 (Ex: 3 anos, 5 anos e 6 meses, etc.)"""
@@ -165,6 +262,7 @@ Vou precisar de algumas informações:
         elif step == 'age':
             state['data']['child_age'] = message
             state['step'] = 'reason'
+            self.save_state(phone_number, state, record)
             return """🔍 *Qual o motivo da consulta?*
 
 (Ex: primeira consulta, dor de dente, limpeza, etc.)"""
@@ -172,6 +270,7 @@ Vou precisar de algumas informações:
         elif step == 'reason':
             state['data']['reason'] = message
             state['step'] = 'period'
+            self.save_state(phone_number, state, record)
             return """⏰ *Qual o melhor período para você?*
 
 Digite uma das opções:
@@ -181,61 +280,124 @@ Digite uma das opções:
 
         elif step == 'period':
             state['data']['preferred_period'] = message
+            slots = self.availability.free_slots(period=parse_period(message))
+            if not slots:
+                return self.finish_appointment(phone_number, state, record)
+
+            state['step'] = 'slot'
+            state['data']['slots'] = [[start.isoformat(), end.isoformat()] for start, end in slots]
+            self.save_state(phone_number, state, record)
+            return self.get_slot_options(slots)
+
+        elif step == 'slot':
+            slots = [(datetime.fromisoformat(start), datetime.fromisoformat(end))
+                     for start, end in state['data']['slots']]
+            choice = message.strip()
+            if choice == '0':
+                return self.finish_appointment(phone_number, state, record)
+            if not choice.isdigit() or not 1 <= int(choice) <= len(slots):
+                return "Por favor, responda com o número de um dos horários.\n\n" + self.get_slot_options(slots)
+
+            slot = slots[int(choice) - 1]
+            # Outra conversa (ou a equipe) pode ter ocupado o horário desde que foi oferecido;
+            # a confirmação no banco é feita em finish_appointment, com o lock das marcações.
+            if self.availability.find_conflict(*slot) is not None:
+                return self.offer_slots_again(phone_number, state, record)
+            return self.finish_appointment(phone_number, state, record, slot)
+
+    def offer_slots_again(self, phone_number, state, record):
+        """O horário escolhido foi ocupado: oferece os livres de novo (ou passa o pedido à equipe)."""
+        slots = self.availability.free_slots(period=parse_period(state['data']['preferred_period']))
+        if not slots:
+            return self.finish_appointment(phone_number, state, record)
+        state['data']['slots'] = [[start.isoformat(), end.isoformat()] for start, end in slots]
+        self.save_state(phone_number, state, record)
+        return "😕 Esse horário acabou de ser ocupado.\n\n" + self.get_slot_options(slots)
+
+    def get_slot_options(self, slots):
+        """Lista numerada de horários livres para o responsável escolher."""
+        options = '\n'.join(
+            f"*{number}* - {format_opening(TIMEZONE.localize(start))}" for number, (start, _) in enumerate(slots, 1)
+        )
+        return f"""🗓️ *Horários disponíveis:*
+
+{options}
+*0* - Nenhum destes, prefiro que a equipe entre em contato
+
+Digite o número do horário desejado."""
+
+    def finish_appointment(self, phone_number, state, record, slot=None):
+        """Grava o pedido de agendamento (com o horário escolhido, se houver) e retorna o resumo."""
+        # O estado é apagado antes de gravar o pedido: se outro processo já
+        # tiver avançado esta conversa, nenhum agendamento duplicado é criado.
+        self.save_state(phone_number, None, record)
+
+        if slot:
+            # Verificação e gravação serializadas com as outras marcações (bot e equipe)
+            lock_bookings(db.session)
+            if self.availability.find_conflict(*slot, verify=True, session=db.session) is not None:
+                db.session.commit()   # só liberta o lock
+                return self.offer_slots_again(phone_number, state, None)
+
+        appointment = Appointment(
+            phone_number=phone_number,
+            child_name=state['data']['child_name'],
+            child_age=state['data']['child_age'],
+            reason=state['data']['reason'],
+            preferred_period=state['data']['preferred_period'],
+            slot_start=slot[0] if slot else None,
+            slot_end=slot[1] if slot else None,
+            tenant_id=self.tenant.id
+        )
+        db.session.add(appointment)
+        db.session.commit()
+
+        if slot:
+            schedule_line = f"📅 Horário reservado: {format_opening(TIMEZONE.localize(slot[0]))}"
+            next_step = "📞 Nossa equipe entrará em contato em breve para confirmar a consulta."
+        else:
+            schedule_line = f"⏰ Período: {state['data']['preferred_period']}"
+            next_step = "📞 Nossa equipe entrará em contato em breve para confirmar o horário disponível."
 
-            appointment = Appointment(
-                phone_number=phone_number,
-                child_name=state['data']['child_name'],
-                child_age=state['data']['child_age'],
-                reason=state['data']['reason'],
-                preferred_period=state['data']['preferred_period']
-            )
-            db.session.add(appointment)
-            db.session.commit()
-
-            del self.user_states[phone_number]
-
-            return f"""✅ *AGENDAMENTO SOLICITADO*
+        return f"""✅ *AGENDAMENTO SOLICITADO*
 
 📋 *Resumo:*
 👶 Criança: {state['data']['child_name']}
 🎂 Idade: {state['data']['child_age']}
 🔍 Motivo: {state['data']['reason']}
-⏰ Período: {state['data']['preferred_period']}
+{schedule_line}
 
-📞 Nossa equipe entrará em contato em breve para confirmar o horário disponível.
+{next_step}
 
 🏠 Voltar ao menu: digite *menu*
-📞 Emergências: (16) 99269-2383 ou (16) 99212-0514"""
+📞 Emergências: {self.phones_inline}"""
 
     def get_team_contact(self):
         """Informações para falar com a equipe"""
-        return """👥 *FALAR COM A EQUIPE*
+        return f"""👥 *FALAR COM A EQUIPE*
 
 📞 *Atendimento Humano:*
 Durante o horário comercial, nossa equipe está disponível para atendimento personalizado.
 
 📱 *Contatos:*
-• (16) 99269-2383
-• (16) 99212-0514
+{self.phones_list}
 
 🕐 *Horário de Atendimento:*
-Segunda a Sexta: 8h às 18h
-Sábado: 8h às 12h
+{self.calendar.weekly_summary()}
 
 🚨 *Emergências 24h:*
-(16) 99269-2383 ou (16) 99212-0514
+{self.phones_inline}
 
 🏠 Voltar ao menu: digite *menu*"""
 
     def get_emergency_contact(self):
         """Contato para emergências"""
-        return """🚨 *EMERGÊNCIAS 24H*
+        return f"""🚨 *EMERGÊNCIAS 24H*
 
 Se seu filho está com dor ou desconforto, entre em contato imediatamente:
 
 📞 *Telefones de Emergência:*
-• (16) 99269-2383
-• (16) 99212-0514
+{self.phones_list}
 
 ⚡ *Atendimento de urgências 24 horas*
 
@@ -245,25 +407,26 @@ Se seu filho está com dor ou desconforto, entre em contato imediatamente:
 
     def get_after_hours_message(self, action="atendimento"):
         """Mensagem para horário fora de expediente, personalizada pela ação."""
+        next_opening = self.calendar.next_opening()
+        reopening = f"\nVoltamos a atender {format_opening(next_opening)}.\n" if next_opening else ""
         message = f"""🌙 *FORA DO HORÁRIO DE ATENDIMENTO*
 
-Obrigado por entrar em contato com a Dentinhos de Leite Odontologia!
+Obrigado por entrar em contato com a {self.texts['clinic_name']}!
 
 Nosso horário para {action} é:
-Segunda a Sexta: 8h às 18h
-Sábado: 8h às 12h
-
+{self.calendar.weekly_summary()}
+{reopening}
 Por favor, entre em contato durante este horário, ou se preferir, deixe sua mensagem e retornaremos assim que possível.
 
 🚨 *Para emergências 24h, ligue:*
-📞 (16) 99269-2383 ou (16) 99212-0514
+📞 {self.phones_inline}
 
 Digite *menu* para ver outras opções."""
         return message
 
     def get_default_response(self):
         """Resposta padrão quando não entende a mensagem"""
-        return """❓ *Não entendi sua mensagem*
+        return f"""❓ *Não entendi sua mensagem*
 
 Digite *menu* para ver as opções disponíveis ou escolha uma das opções:
 
@@ -273,17 +436,8 @@ Digite *menu* para ver as opções disponíveis ou escolha uma das opções:
 4️⃣ Agendar consulta
 5️⃣ Falar com equipe
 
-🚨 Emergências: (16) 99269-2383 ou (16) 99212-0514"""
+🚨 Emergências: {self.phones_inline}"""
 
     def is_business_hours(self):
-        """Verifica se está no horário de atendimento"""
-        now = datetime.now()
-        weekday = now.weekday()
-        hour = now.hour
-
-        if weekday < 5:
-            return 8 <= hour < 18
-        elif weekday == 5:
-            return 8 <= hour < 12
-        else:
-            return False
+        """Verifica se está no horário de atendimento (hora de São Paulo, feriados e fechos incluídos)"""
+        return self.calendar.is_open()
@@ -0,0 +1,288 @@
+# src/services/business_calendar.py
+# Calendário de atendimento da clínica em America/Sao_Paulo.
+#
+# A partir do horário semanal, dos feriados e dos fechos pontuais
+# (src/services/business_hours.json) são pré-calculados os intervalos de
+# abertura dos próximos meses como duas listas ordenadas de instantes UTC.
+# "Está aberto?" e "quando abre?" são respondidos por busca binária, sem
+# depender do fuso horário do servidor (os dynos do Heroku correm em UTC).
+
+import json
+import os
+import threading
+from bisect import bisect_right
+from datetime import date, datetime, time, timedelta
+
+import pytz
+
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'business_hours.json')
+
+TIMEZONE = pytz.timezone('America/Sao_Paulo')
+
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+WEEKDAY_LABELS = ('Segunda', 'Terça', 'Quarta', 'Quinta', 'Sexta', 'Sábado', 'Domingo')
+
+# Feriados nacionais de data fixa (mês, dia)
+FIXED_HOLIDAYS = {
+    (1, 1): 'Confraternização Universal',
+    (4, 21): 'Tiradentes',
+    (5, 1): 'Dia do Trabalho',
+    (9, 7): 'Independência do Brasil',
+    (10, 12): 'Nossa Senhora Aparecida',
+    (11, 2): 'Finados',
+    (11, 15): 'Proclamação da República',
+    (11, 20): 'Dia da Consciência Negra',
+    (12, 25): 'Natal',
+}
+
+# Feriados móveis, em dias a partir do Domingo de Páscoa
+EASTER_OFFSETS = {
+    -48: 'Carnaval',
+    -47: 'Carnaval',
+    -2: 'Sexta-feira Santa',
+    60: 'Corpus Christi',
+}
+
+
+class CalendarConfigError(Exception):
+    """A configuração do horário de atendimento é inválida."""
+
+
+def easter_sunday(year):
+    """Domingo de Páscoa (algoritmo anónimo gregoriano)."""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def national_holidays(year):
+    holidays = {date(year, month, day): name for (month, day), name in FIXED_HOLIDAYS.items()}
+    easter = easter_sunday(year)
+    for offset, name in EASTER_OFFSETS.items():
+        holidays[easter + timedelta(days=offset)] = name
+    return holidays
+
+
+def _parse_time(value):
+    try:
+        hour, minute = value.split(':')
+        return time(int(hour), int(minute))
+    except (AttributeError, ValueError) as e:
+        raise CalendarConfigError(f"Hora inválida: {value!r}") from e
+
+
+def _parse_local(value):
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError) as e:
+        raise CalendarConfigError(f"Data/hora inválida: {value!r}") from e
+
+
+class BusinessCalendar:
+    """
+    Intervalos de abertura pré-calculados de `start` até `start + horizon_days`.
+    Consultas fora da janela recalculam-na automaticamente.
+    """
+
+    def __init__(self, config, horizon_days=180, today=None):
+        self.horizon_days = horizon_days
+        # Folga no fim da janela para next_opening encontrar sempre a próxima abertura.
+        self._margin = min(30, horizon_days // 2) * 86400
+        self.timezone = pytz.timezone(config.get('timezone', 'America/Sao_Paulo'))
+        self.national_holidays = config.get('national_holidays', True)
+
+        weekly = config.get('weekly_hours', {})
+        unknown = set(weekly) - set(WEEKDAYS)
+        if unknown:
+            raise CalendarConfigError(f"Dias da semana desconhecidos: {', '.join(sorted(unknown))}")
+        self.weekly_hours = []
+        for day in WEEKDAYS:
+            periods = sorted((_parse_time(start), _parse_time(end)) for start, end in weekly.get(day, []))
+            for start, end in periods:
+                if start >= end:
+                    raise CalendarConfigError(f"Período vazio em {day}: {start}-{end}")
+            self.weekly_hours.append(periods)
+
+        self.extra_holidays = {}
+        for holiday in config.get('holidays', []):
+            self.extra_holidays[date.fromisoformat(holiday['date'])] = holiday.get('name', 'Feriado')
+
+        self.closures = []
+        for closure in config.get('closures', []):
+            start, end = _parse_local(closure['start']), _parse_local(closure['end'])
+            if start >= end:
+                raise CalendarConfigError(f"Fecho com fim antes do início: {closure}")
+            self.closures.append((self._to_utc(start), self._to_utc(end)))
+
+        self._lock = threading.Lock()
+        self._build((today or datetime.now(self.timezone).date()) - timedelta(days=1))
+
+    @classmethod
+    def from_file(cls, path=DEFAULT_CONFIG_PATH, **kwargs):
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f), **kwargs)
+
+    # --- Pré-cálculo ---
+    def _to_utc(self, local_naive):
+        return self.timezone.localize(local_naive).astimezone(pytz.utc)
+
+    def holiday_name(self, day):
+        if day in self.extra_holidays:
+            return self.extra_holidays[day]
+        if self.national_holidays:
+            return national_holidays(day.year).get(day)
+        return None
+
+    def _build(self, first_day):
+        starts, ends = [], []
+        for offset in range(self.horizon_days + 1):
+            day = first_day + timedelta(days=offset)
+            if self.holiday_name(day):
+                continue
+            for start, end in self.weekly_hours[day.weekday()]:
+                for piece in self._subtract_closures(self._to_utc(datetime.combine(day, start)),
+                                                     self._to_utc(datetime.combine(day, end))):
+                    starts.append(piece[0].timestamp())
+                    ends.append(piece[1].timestamp())
+        # Atribuição única: quem lê em paralelo vê a janela antiga ou a nova inteira.
+        self._index = (
+            self._to_utc(datetime.combine(first_day, time.min)).timestamp(),
+            self._to_utc(datetime.combine(first_day + timedelta(days=self.horizon_days + 1), time.min)).timestamp(),
+            starts,
+            ends,
+        )
+
+    def _subtract_closures(self, start, end):
+        pieces = [(start, end)]
+        for closed_start, closed_end in self.closures:
+            remaining = []
+            for piece_start, piece_end in pieces:
+                if closed_end <= piece_start or closed_start >= piece_end:
+                    remaining.append((piece_start, piece_end))
+                    continue
+                if piece_start < closed_start:
+                    remaining.append((piece_start, closed_start))
+                if closed_end < piece_end:
+                    remaining.append((closed_end, piece_end))
+            pieces = remaining
+        return pieces
+
+    def _index_for(self, timestamp):
+        index = self._index
+        if not index[0] <= timestamp < index[1] - self._margin:
+            with self._lock:
+                index = self._index
+                if not index[0] <= timestamp < index[1] - self._margin:
+                    local_day = datetime.fromtimestamp(timestamp, self.timezone).date()
+                    self._build(local_day - timedelta(days=1))
+                index = self._index
+        return index
+
+    # --- Consultas ---
+    def _timestamp(self, at):
+        if at is None:
+            return datetime.now(pytz.utc).timestamp()
+        if at.tzinfo is None:
+            # Datas sem fuso são horas locais da clínica (como as guardadas na agenda).
+            at = self.timezone.localize(at)
+        return at.timestamp()
+
+    def _localtime(self, timestamp):
+        return datetime.fromtimestamp(timestamp, self.timezone)
+
+    def is_open(self, at=None):
+        timestamp = self._timestamp(at)
+        _, _, starts, ends = self._index_for(timestamp)
+        i = bisect_right(starts, timestamp) - 1
+        return i >= 0 and timestamp < ends[i]
+
+    def next_opening(self, at=None):
+        """Início da próxima abertura depois de `at` (hora local), ou None se não houver na janela."""
+        timestamp = self._timestamp(at)
+        _, _, starts, _ = self._index_for(timestamp)
+        i = bisect_right(starts, timestamp)
+        return self._localtime(starts[i]) if i < len(starts) else None
+
+    def closes_at(self, at=None):
+        """Fim do período de abertura em curso (hora local), ou None se estiver fechado."""
+        timestamp = self._timestamp(at)
+        _, _, starts, ends = self._index_for(timestamp)
+        i = bisect_right(starts, timestamp) - 1
+        return self._localtime(ends[i]) if i >= 0 and timestamp < ends[i] else None
+
+    def open_intervals(self, start, end):
+        """Intervalos de abertura (início, fim) em hora local que se sobrepõem a [start, end)."""
+        start_ts, end_ts = self._timestamp(start), self._timestamp(end)
+        _, _, starts, ends = self._index_for(start_ts)
+        i = max(0, bisect_right(starts, start_ts) - 1)
+        while i < len(starts) and starts[i] < end_ts:
+            if ends[i] > start_ts:
+                yield self._localtime(max(starts[i], start_ts)), self._localtime(min(ends[i], end_ts))
+            i += 1
+
+    def weekly_summary(self):
+        """Horário semanal em texto, ex.: 'Segunda a Sexta: 8h às 18h'."""
+        lines = []
+        day = 0
+        while day < 7:
+            periods = self.weekly_hours[day]
+            last = day
+            while last + 1 < 7 and self.weekly_hours[last + 1] == periods:
+                last += 1
+            if periods:
+                label = WEEKDAY_LABELS[day] if day == last else f"{WEEKDAY_LABELS[day]} a {WEEKDAY_LABELS[last]}"
+                hours = ' e '.join(f"{_format_hour(start)} às {_format_hour(end)}" for start, end in periods)
+                lines.append(f"{label}: {hours}")
+            day = last + 1
+        return '\n'.join(lines)
+
+    def business_hours_for_fullcalendar(self):
+        """Horário semanal no formato da opção businessHours do FullCalendar."""
+        # No FullCalendar o domingo é o dia 0
+        return [
+            {'daysOfWeek': [(day + 1) % 7], 'startTime': start.strftime('%H:%M'), 'endTime': end.strftime('%H:%M')}
+            for day, periods in enumerate(self.weekly_hours)
+            for start, end in periods
+        ]
+
+
+def _format_hour(value):
+    return f"{value.hour}h" if value.minute == 0 else f"{value.hour}h{value.minute:02d}"
+
+
+def format_opening(moment, now=None):
+    """'hoje às 8h', 'amanhã às 8h' ou 'segunda-feira (21/04) às 8h'."""
+    now = now or datetime.now(moment.tzinfo)
+    hour = _format_hour(moment.time())
+    days = (moment.date() - now.date()).days
+    if days == 0:
+        return f"hoje às {hour}"
+    if days == 1:
+        return f"amanhã às {hour}"
+    weekday = WEEKDAY_LABELS[moment.weekday()].lower()
+    if moment.weekday() < 5:
+        weekday += '-feira'
+    return f"{weekday} ({moment:%d/%m}) às {hour}"
+
+
+_default_calendar = None
+_default_calendar_lock = threading.Lock()
+
+
+def get_business_calendar():
+    """Calendário partilhado do processo (BUSINESS_CALENDAR_PATH ou o ficheiro por omissão)."""
+    global _default_calendar
+    if _default_calendar is None:
+        with _default_calendar_lock:
+            if _default_calendar is None:
+                path = os.environ.get('BUSINESS_CALENDAR_PATH', DEFAULT_CONFIG_PATH)
+                _default_calendar = BusinessCalendar.from_file(path)
+    return _default_calendar
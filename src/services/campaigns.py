@@ -0,0 +1,290 @@
+# src/services/campaigns.py
+# Envio de campanhas para todos os pacientes de uma clínica, pelo número dela.
+#
+# Os destinatários são lidos de Patient por ordem de id em janelas (cursor do
+# lado do servidor quando o banco o suporta), um por telefone normalizado
+# (phone_e164: irmãos com o telefone dos pais recebem uma só mensagem, pelo
+# paciente de menor id), e enviados em lotes pelo pool do
+# WhatsAppClient, limitado pelo token bucket do cliente. Cada destinatário é
+# registado em CampaignDelivery antes do envio (unicidade por campanha e
+# paciente) e o ponto de retoma (Campaign.last_patient_id) avança a cada lote,
+# por isso uma campanha interrompida continua onde parou sem repetir envios.
+#
+# O supervisor corre em todos os processos; um lease por campanha garante que
+# cada campanha em curso tem um só executor, e retoma as campanhas cujo
+# executor morreu.
+
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.orm import aliased
+
+from src.models.campaign import Campaign, CampaignDelivery
+from src.models.conversation import db, Patient
+from src.services.leases import Lease
+from src.services.tenants import get_tenant_registry, tenant_filter
+from src.services.whatsapp_service import get_tenant_client
+
+BATCH_SIZE = 100
+WINDOW_SIZE = 5000
+STREAM_CHUNK = 500
+THROUGHPUT_WINDOW = timedelta(seconds=60)
+
+
+def _first_patient_of_phone(tenant_id):
+    """Condição: o paciente é o de menor id da clínica com o seu phone_e164 (ix_patient_tenant_phone_e164)."""
+    other = aliased(Patient)
+    return Patient.id == (select(func.min(other.id))
+                          .where(tenant_filter(other.tenant_id, tenant_id), other.phone_e164 == Patient.phone_e164)
+                          .scalar_subquery())
+
+
+def count_recipients(tenant_id=None):
+    """Telefones distintos da clínica que recebem uma campanha."""
+    return db.session.query(func.count(func.distinct(Patient.phone_e164))).filter(
+        tenant_filter(Patient.tenant_id, tenant_id)).scalar()
+
+
+def iter_recipients(after_id, tenant_id=None, window=WINDOW_SIZE, chunk=STREAM_CHUNK):
+    """
+    (id, full_name, phone_e164) dos pacientes da clínica com id > after_id, por
+    ordem, um por telefone; os pacientes sem telefone válido ficam de fora.
+    Cada janela é uma consulta própria: com cursor do servidor (PostgreSQL) as
+    linhas chegam em blocos de `chunk`; no SQLite a janela é lida de uma vez,
+    para não bloquear as escritas dos envios enquanto é percorrida.
+    """
+    while True:
+        stmt = (select(Patient.id, Patient.full_name, Patient.phone_e164)
+                .where(tenant_filter(Patient.tenant_id, tenant_id), Patient.id > after_id,
+                       Patient.phone_e164.isnot(None), _first_patient_of_phone(tenant_id))
+                .order_by(Patient.id)
+                .limit(window))
+        count = 0
+        with db.engine.connect() as conn:
+            if conn.dialect.supports_server_side_cursors:
+                result = conn.execution_options(stream_results=True, yield_per=chunk).execute(stmt)
+                for row in result:
+                    count += 1
+                    after_id = row.id
+                    yield row
+                rows = ()
+            else:
+                rows = conn.execute(stmt).all()
+        for row in rows:
+            count += 1
+            after_id = row.id
+            yield row
+        if count < window:
+            return
+
+
+def campaign_throughput(campaign_id, window=THROUGHPUT_WINDOW):
+    """Envios por minuto da campanha na última `window`."""
+    since = datetime.utcnow() - window
+    recent = db.session.query(func.count(CampaignDelivery.id)).filter(
+        CampaignDelivery.campaign_id == campaign_id,
+        CampaignDelivery.sent_at >= since
+    ).scalar()
+    return recent * 60 / window.total_seconds()
+
+
+class CampaignRunner:
+    """Envia uma campanha a partir do seu ponto de retoma, enquanto o estado for 'running'."""
+
+    def __init__(self, campaign_id, lease, batch_size=BATCH_SIZE):
+        self.campaign_id = campaign_id
+        self.lease = lease
+        self.batch_size = batch_size
+
+    def run(self):
+        campaign = db.session.get(Campaign, self.campaign_id)
+        if campaign is None or campaign.status != Campaign.STATUS_RUNNING:
+            return
+        if campaign.started_at is None:
+            campaign.started_at = datetime.utcnow()
+            db.session.commit()
+        template = (campaign.template_name, campaign.template_language or 'pt_BR')
+        render = campaign.render_message
+        after_id = campaign.last_patient_id
+        tenant_id = campaign.tenant_id
+        tenant = get_tenant_registry().get(tenant_id)
+        db.session.remove()
+
+        if tenant.id != tenant_id:
+            print(f"ERRO: A clínica {tenant_id} da campanha {self.campaign_id} está inativa. Campanha não enviada.")
+            return
+        client = get_tenant_client(tenant)
+        if client is None:
+            print(f"ERRO CRÍTICO: As credenciais do WhatsApp da clínica '{tenant.slug}' não estão configuradas. "
+                  f"Campanha não enviada.")
+            return
+
+        print(f"INFO: Campanha {self.campaign_id} a enviar a partir do paciente {after_id}.")
+        batch = []
+        for recipient in iter_recipients(after_id, tenant_id):
+            batch.append(recipient)
+            if len(batch) >= self.batch_size:
+                if not self._send_batch(client, batch, render, template):
+                    return
+                batch = []
+        if batch and not self._send_batch(client, batch, render, template):
+            return
+
+        table = Campaign.__table__
+        with db.engine.begin() as conn:
+            conn.execute(
+                update(table)
+                .where(table.c.id == self.campaign_id, table.c.status == Campaign.STATUS_RUNNING)
+                .values(status=Campaign.STATUS_COMPLETED, finished_at=datetime.utcnow())
+            )
+        print(f"INFO: Campanha {self.campaign_id} concluída.")
+
+    def _send_batch(self, client, batch, render, template):
+        """Envia um lote e avança o ponto de retoma. Retorna False se a campanha deve parar."""
+        campaigns = Campaign.__table__
+        deliveries = CampaignDelivery.__table__
+
+        # Pausa, cancelamento ou perda do lease entre lotes
+        if not self.lease.acquire():
+            return False
+        with db.engine.connect() as conn:
+            status = conn.execute(select(campaigns.c.status).where(campaigns.c.id == self.campaign_id)).scalar()
+        if status != Campaign.STATUS_RUNNING:
+            print(f"INFO: Campanha {self.campaign_id} parada ({status}).")
+            return False
+
+        # Regista os destinatários antes de enviar. Os que já têm registo ficaram
+        # por confirmar numa execução interrompida a meio do lote: não recebem de
+        # novo (no máximo uma mensagem por paciente) e contam como falhados.
+        patient_ids = [row.id for row in batch]
+        with db.engine.begin() as conn:
+            already = set(conn.execute(
+                select(deliveries.c.patient_id)
+                .where(deliveries.c.campaign_id == self.campaign_id, deliveries.c.patient_id.in_(patient_ids))
+            ).scalars())
+            if already:
+                conn.execute(
+                    update(deliveries)
+                    .where(deliveries.c.campaign_id == self.campaign_id,
+                           deliveries.c.patient_id.in_(already),
+                           deliveries.c.status == CampaignDelivery.STATUS_SENDING)
+                    .values(status=CampaignDelivery.STATUS_FAILED)
+                )
+            pending = [row for row in batch if row.id not in already]
+            if pending:
+                conn.execute(insert(deliveries), [{
+                    'campaign_id': self.campaign_id,
+                    'patient_id': row.id,
+                    'phone_number': row.phone_e164,
+                    'status': CampaignDelivery.STATUS_SENDING,
+                    'sent_at': datetime.utcnow()
+                } for row in pending])
+
+        template_name, template_language = template
+        if not pending:
+            results = []
+        elif template_name:
+            results = client.send_many(
+                [(row.phone_e164, template_name, template_language, (row.full_name.split(' ')[0],))
+                 for row in pending],
+                sender=client.send_template
+            )
+        else:
+            results = client.send_many([(row.phone_e164, render(row.full_name)) for row in pending])
+
+        sent, failed = 0, len(already)
+        now = datetime.utcnow()
+        with db.engine.begin() as conn:
+            for row, result in zip(pending, results):
+                if result is None:
+                    failed += 1
+                    values = {'status': CampaignDelivery.STATUS_FAILED}
+                else:
+                    sent += 1
+                    wamid = (result.get('messages') or [{}])[0].get('id')
+                    values = {'status': CampaignDelivery.STATUS_SENT, 'wamid': wamid}
+                conn.execute(
+                    update(deliveries)
+                    .where(deliveries.c.campaign_id == self.campaign_id, deliveries.c.patient_id == row.id)
+                    .values(sent_at=now, **values)
+                )
+            conn.execute(
+                update(campaigns)
+                .where(campaigns.c.id == self.campaign_id)
+                .values(sent_count=campaigns.c.sent_count + sent,
+                        failed_count=campaigns.c.failed_count + failed,
+                        last_patient_id=batch[-1].id)
+            )
+        return True
+
+
+class CampaignSupervisor:
+    """Procura campanhas em curso sem executor e executa-as (uma thread por campanha)."""
+
+    def __init__(self, app, poll_interval=30, lease_ttl=60):
+        self.app = app
+        self.poll_interval = poll_interval
+        self.lease_ttl = lease_ttl
+        self._runners = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='campaign-supervisor', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def notify(self):
+        """Chamado quando uma campanha é iniciada ou retomada neste processo."""
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                with self.app.app_context():
+                    self._dispatch()
+            except Exception as e:
+                print(f"ERRO: Falha no supervisor de campanhas: {e}")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _dispatch(self):
+        with db.engine.connect() as conn:
+            running = conn.execute(
+                select(Campaign.id).where(Campaign.status == Campaign.STATUS_RUNNING)
+            ).scalars().all()
+        for campaign_id in running:
+            with self._lock:
+                thread = self._runners.get(campaign_id)
+                if thread is not None and thread.is_alive():
+                    continue
+            lease = Lease(f"campaign-{campaign_id}", ttl_seconds=self.lease_ttl)
+            if not lease.acquire():
+                continue
+            thread = threading.Thread(target=self._execute, args=(campaign_id, lease),
+                                      name=f"campaign-{campaign_id}", daemon=True)
+            with self._lock:
+                self._runners[campaign_id] = thread
+            thread.start()
+
+    def _execute(self, campaign_id, lease):
+        with self.app.app_context():
+            try:
+                CampaignRunner(campaign_id, lease).run()
+            except Exception as e:
+                print(f"ERRO: Campanha {campaign_id} interrompida: {e}")
+            finally:
+                db.session.remove()
+                lease.release()
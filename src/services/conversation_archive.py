@@ -0,0 +1,224 @@
+# src/services/conversation_archive.py
+# Arquivo das conversas antigas.
+#
+# As conversas de meses inteiros anteriores ao horizonte de retenção
+# (CONVERSATION_RETENTION_DAYS, 180 dias por omissão) saem da tabela
+# Conversation para conversation_archive: uma partição por número e por mês,
+# com as linhas em NDJSON comprimido com gzip. O arquivo fica no próprio banco
+# porque o disco dos dynos do Heroku é efémero. Cada grupo de números é
+# arquivado e apagado da tabela ativa na mesma transação, por isso uma
+# interrupção não perde nem duplica linhas.
+#
+# conversation_history() junta as partições arquivadas com a tabela ativa:
+# quem consulta o histórico de um número não precisa de saber onde estão.
+# iter_archived() percorre o arquivo de todos os números, mês a mês (usado
+# pelas exportações).
+
+import gzip
+import json
+import os
+from datetime import date, datetime, timedelta
+from itertools import groupby
+
+from sqlalchemy import delete, func, insert, select, update
+
+from src.models.conversation import db, Conversation
+from src.models.conversation_archive import ConversationArchive
+from src.services.tenants import tenant_filter
+
+DEFAULT_RETENTION_DAYS = 180
+PHONES_PER_BATCH = 200
+
+
+def retention_days():
+    return int(os.environ.get('CONVERSATION_RETENTION_DAYS', DEFAULT_RETENTION_DAYS))
+
+
+def month_start(moment):
+    return date(moment.year, moment.month, 1)
+
+
+def next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _as_datetime(day):
+    return datetime.combine(day, datetime.min.time())
+
+
+def archive_cutoff(days=None, now=None):
+    """Início do mês que contém (agora - retenção): tudo antes disto é arquivado."""
+    days = retention_days() if days is None else days
+    return _as_datetime(month_start((now or datetime.utcnow()) - timedelta(days=days)))
+
+
+# --- Codificação das partições ---
+def _datetime_columns():
+    return {column.name for column in Conversation.__table__.columns if isinstance(column.type, db.DateTime)}
+
+
+def encode_rows(rows):
+    """Linhas (dicts) -> NDJSON comprimido."""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps({key: value.isoformat() if isinstance(value, datetime) else value
+                                 for key, value in row.items()}, ensure_ascii=False))
+    return gzip.compress('\n'.join(lines).encode('utf-8'), compresslevel=6)
+
+
+def decode_payload(payload):
+    """NDJSON comprimido -> linhas (dicts), com as datas de volta a datetime."""
+    datetime_columns = _datetime_columns()
+    rows = []
+    for line in gzip.decompress(payload).decode('utf-8').splitlines():
+        row = json.loads(line)
+        for key in datetime_columns & row.keys():
+            if row[key] is not None:
+                row[key] = datetime.fromisoformat(row[key])
+        rows.append(row)
+    return rows
+
+
+# --- Arquivo ---
+def archive_conversations(days=None, batch_size=PHONES_PER_BATCH, now=None):
+    """Arquiva os meses completos anteriores ao horizonte. Retorna {'months', 'partitions', 'rows'}."""
+    cutoff = archive_cutoff(days, now)
+    table = Conversation.__table__
+    stats = {'months': 0, 'partitions': 0, 'rows': 0}
+    while True:
+        with db.engine.connect() as conn:
+            oldest = conn.execute(select(func.min(table.c.timestamp)).where(table.c.timestamp < cutoff)).scalar()
+            if oldest is None:
+                break
+            month = month_start(oldest)
+            start, end = _as_datetime(month), _as_datetime(next_month(month))
+            phones = conn.execute(
+                select(table.c.phone_number).distinct()
+                .where(table.c.timestamp >= start, table.c.timestamp < end)
+                .order_by(table.c.phone_number)
+            ).scalars().all()
+
+        for i in range(0, len(phones), batch_size):
+            partitions, rows = _archive_batch(month, start, end, phones[i:i + batch_size])
+            stats['partitions'] += partitions
+            stats['rows'] += rows
+        stats['months'] += 1
+        print(f"INFO: Conversas de {month:%m/%Y} arquivadas ({len(phones)} números).")
+    return stats
+
+
+def _archive_batch(month, start, end, phones):
+    conversations = Conversation.__table__
+    archive = ConversationArchive.__table__
+    in_month = (conversations.c.phone_number.in_(phones),
+                conversations.c.timestamp >= start, conversations.c.timestamp < end)
+
+    with db.engine.begin() as conn:
+        rows = conn.execute(
+            select(conversations).where(*in_month)
+            .order_by(conversations.c.phone_number, conversations.c.timestamp, conversations.c.id)
+        ).mappings().all()
+        if not rows:
+            return 0, 0
+        existing = {
+            row.phone_number: row for row in conn.execute(
+                select(archive.c.id, archive.c.phone_number, archive.c.payload)
+                .where(archive.c.phone_number.in_(phones), archive.c.month == month)
+            )
+        }
+
+        partitions = 0
+        for phone, group in groupby(rows, key=lambda row: row['phone_number']):
+            group = [dict(row) for row in group]
+            previous = existing.get(phone)
+            if previous is not None:
+                # Mês já arquivado antes (ex.: linhas gravadas com atraso): junta as duas partes
+                group = sorted(decode_payload(previous.payload) + group, key=lambda row: (row['timestamp'], row['id']))
+            values = {
+                'row_count': len(group),
+                'first_timestamp': group[0]['timestamp'],
+                'last_timestamp': group[-1]['timestamp'],
+                'payload': encode_rows(group),
+                'archived_at': datetime.utcnow(),
+            }
+            if previous is None:
+                conn.execute(insert(archive).values(phone_number=phone, month=month, **values))
+            else:
+                conn.execute(update(archive).where(archive.c.id == previous.id).values(**values))
+            partitions += 1
+
+        # Só as linhas lidas acima: o limite no id exclui inserções concorrentes
+        conn.execute(delete(conversations).where(*in_month, conversations.c.id <= max(row['id'] for row in rows)))
+    return partitions, len(rows)
+
+
+def archive_summary():
+    """Partições, linhas e bytes comprimidos no arquivo, e o intervalo de meses."""
+    archive = ConversationArchive.__table__
+    with db.engine.connect() as conn:
+        row = conn.execute(select(
+            func.count(archive.c.id),
+            func.coalesce(func.sum(archive.c.row_count), 0),
+            func.coalesce(func.sum(func.length(archive.c.payload)), 0),
+            func.min(archive.c.month),
+            func.max(archive.c.month),
+        )).one()
+    return {'partitions': row[0], 'rows': row[1], 'bytes': row[2], 'first_month': row[3], 'last_month': row[4]}
+
+
+# --- Leitura ---
+def conversation_history(phone_number, start=None, end=None, tenant_id=None):
+    """
+    Conversas de um número com a clínica em [start, end) (UTC, opcionais), por
+    ordem cronológica, das partições arquivadas e da tabela ativa. Cada linha é
+    um dict como Conversation.to_dict(), com 'archived' a indicar a origem.
+    """
+    archive = ConversationArchive.__table__
+    conversations = Conversation.__table__
+
+    archived_query = select(archive.c.payload).where(archive.c.phone_number == phone_number)
+    hot_query = select(conversations).where(conversations.c.phone_number == phone_number,
+                                            tenant_filter(conversations.c.tenant_id, tenant_id))
+    if start is not None:
+        archived_query = archived_query.where(archive.c.last_timestamp >= start)
+        hot_query = hot_query.where(conversations.c.timestamp >= start)
+    if end is not None:
+        archived_query = archived_query.where(archive.c.first_timestamp < end)
+        hot_query = hot_query.where(conversations.c.timestamp < end)
+
+    history = []
+    with db.engine.connect() as conn:
+        for payload in conn.execute(archived_query.order_by(archive.c.month)).scalars():
+            for row in decode_payload(payload):
+                if row.get('tenant_id') != tenant_id:
+                    continue
+                if (start is None or row['timestamp'] >= start) and (end is None or row['timestamp'] < end):
+                    history.append(dict(row, archived=True))
+        for row in conn.execute(hot_query.order_by(conversations.c.timestamp, conversations.c.id)).mappings():
+            history.append(dict(row, archived=False))
+    history.sort(key=lambda row: (row['timestamp'], row['id']))
+    return history
+
+
+def iter_archived(start=None, end=None, phone_number=None, partitions_per_read=50):
+    """
+    Linhas arquivadas (dicts como as da tabela) em [start, end), por ordem de
+    (timestamp, id). As partições são lidas em stream e só um mês fica em memória.
+    """
+    archive = ConversationArchive.__table__
+    query = select(archive.c.month, archive.c.payload)
+    if phone_number is not None:
+        query = query.where(archive.c.phone_number == phone_number)
+    if start is not None:
+        query = query.where(archive.c.last_timestamp >= start)
+    if end is not None:
+        query = query.where(archive.c.first_timestamp < end)
+
+    with db.engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=partitions_per_read).execute(
+            query.order_by(archive.c.month))
+        for _, partitions in groupby(result, key=lambda row: row.month):
+            rows = [row for partition in partitions for row in decode_payload(partition.payload)
+                    if (start is None or row['timestamp'] >= start) and (end is None or row['timestamp'] < end)]
+            rows.sort(key=lambda row: (row['timestamp'], row['id']))
+            yield from rows
@@ -0,0 +1,106 @@
+# src/services/conversation_log.py
+# Registo write-behind da tabela Conversation: as linhas ficam num buffer em
+# memória e são gravadas em lote (um INSERT multi-linha por flush), fora do
+# caminho da resposta ao utilizador.
+
+import threading
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import insert
+
+from src.models.conversation import db, Conversation
+
+
+class ConversationLogWriter:
+    """
+    Buffer de linhas de Conversation com flush por tamanho (max_batch) ou por
+    tempo (flush_interval). A memória é limitada por max_pending: quando o
+    buffer enche, quem regista faz o flush ele próprio (backpressure) e, se o
+    banco estiver indisponível, as linhas mais antigas são descartadas.
+    """
+
+    def __init__(self, app, max_batch=200, flush_interval=1.0, max_pending=5000):
+        self.app = app
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='conversation-log', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        """Para a thread e grava o que ainda estiver no buffer."""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def log(self, **fields):
+        fields.setdefault('timestamp', datetime.utcnow())
+        with self._lock:
+            self._buffer.append(fields)
+            pending = len(self._buffer)
+        if pending >= self.max_pending:
+            self.flush()
+        elif pending >= self.max_batch:
+            self._wakeup.set()
+
+    def pending(self):
+        with self._lock:
+            return len(self._buffer)
+
+    def flush(self):
+        """Grava o buffer inteiro em lotes de max_batch. Retorna o número de linhas gravadas."""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._buffer = self._buffer, []
+            if not rows:
+                return 0
+            try:
+                with self.app.app_context():
+                    with db.engine.begin() as conn:
+                        for start in range(0, len(rows), self.max_batch):
+                            conn.execute(insert(Conversation.__table__), rows[start:start + self.max_batch])
+                return len(rows)
+            except Exception as e:
+                print(f"ERRO: Falha ao gravar {len(rows)} conversas em lote: {e}")
+                self._requeue(rows)
+                return 0
+
+    def _requeue(self, rows):
+        with self._lock:
+            self._buffer = rows + self._buffer
+            overflow = len(self._buffer) - self.max_pending
+            if overflow > 0:
+                del self._buffer[:overflow]
+                print(f"ERRO: Buffer de conversas cheio; {overflow} registos antigos descartados.")
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+
+def log_conversation(**fields):
+    """Regista uma linha de Conversation pelo writer da aplicação (ou diretamente, se não houver)."""
+    writer = current_app.extensions.get('conversation_log')
+    if writer is None:
+        db.session.add(Conversation(**fields))
+        db.session.commit()
+        return
+    writer.log(**fields)
@@ -0,0 +1,35 @@
+# src/services/dedup.py
+# Deduplicação das mensagens recebidas pelo wamid (id da mensagem no WhatsApp)
+
+import threading
+from collections import OrderedDict
+
+
+class RecentMessageIds:
+    """
+    LRU limitado com os wamid aceites recentemente por este processo. Uma
+    reentrega que caia no mesmo processo é rejeitada sem ir ao banco; as
+    restantes são apanhadas pela chave única da tabela message_receipt.
+    """
+
+    def __init__(self, max_entries=50000):
+        self.max_entries = max_entries
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, wamid):
+        with self._lock:
+            if wamid in self._ids:
+                self._ids.move_to_end(wamid)
+                return True
+            return False
+
+    def add(self, wamid):
+        with self._lock:
+            self._ids[wamid] = None
+            self._ids.move_to_end(wamid)
+            while len(self._ids) > self.max_entries:
+                self._ids.popitem(last=False)
+
+    def __len__(self):
+        return len(self._ids)
@@ -0,0 +1,214 @@
+# src/services/exports.py
+# Exportação em CSV ou NDJSON de conversas, pedidos de agendamento, pacientes
+# e consultas da agenda de uma clínica.
+#
+# As linhas são lidas numa só consulta com stream_results/yield_per (cursor do
+# lado do servidor no PostgreSQL; no SQLite o cursor já é lido aos poucos) e
+# convertidas em blocos de texto à medida que chegam, por isso a memória usada
+# não depende do tamanho da exportação e o primeiro bloco sai logo. As conversas
+# já arquivadas (conversation_archive) são juntadas às da tabela ativa.
+
+import csv
+import heapq
+import io
+import json
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta
+
+import pytz
+from sqlalchemy import select
+
+from src.models.conversation import db, Appointment, Conversation, Patient, Schedule
+from src.services.business_calendar import TIMEZONE
+from src.services.conversation_archive import iter_archived
+from src.services.tenants import tenant_filter
+
+YIELD_PER = 1000
+# Linhas por bloco da resposta HTTP
+CHUNK_ROWS = 200
+
+# Células de texto começadas por estes caracteres levam um apóstrofo no CSV (injeção de fórmulas)
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+
+# columns: (nome na exportação, coluna). date_column: filtrada por de/até;
+# local_dates: a coluna guarda hora de São Paulo (senão UTC). tenant_column:
+# a clínica de cada linha. archived: as linhas antigas também estão no arquivo
+# (conversation_archive).
+ExportSpec = namedtuple('ExportSpec', ['columns', 'date_column', 'local_dates', 'status_column', 'phone_column',
+                                       'tenant_column', 'order_by', 'join', 'archived'])
+
+EXPORTS = {
+    'conversas': ExportSpec(
+        columns=[('id', Conversation.id), ('phone_number', Conversation.phone_number),
+                 ('message_type', Conversation.message_type), ('message', Conversation.message),
+                 ('response', Conversation.response), ('status', Conversation.status),
+                 ('wamid', Conversation.wamid), ('tenant_id', Conversation.tenant_id),
+                 ('timestamp', Conversation.timestamp)],
+        date_column=Conversation.timestamp, local_dates=False,
+        status_column=Conversation.status, phone_column=Conversation.phone_number,
+        tenant_column=Conversation.tenant_id,
+        order_by=(Conversation.timestamp, Conversation.id), join=None, archived=True),
+    'pedidos': ExportSpec(
+        columns=[('id', Appointment.id), ('phone_number', Appointment.phone_number),
+                 ('child_name', Appointment.child_name), ('child_age', Appointment.child_age),
+                 ('reason', Appointment.reason), ('preferred_period', Appointment.preferred_period),
+                 ('slot_start', Appointment.slot_start), ('slot_end', Appointment.slot_end),
+                 ('status', Appointment.status), ('tenant_id', Appointment.tenant_id),
+                 ('timestamp', Appointment.timestamp)],
+        date_column=Appointment.timestamp, local_dates=False,
+        status_column=Appointment.status, phone_column=Appointment.phone_number,
+        tenant_column=Appointment.tenant_id,
+        order_by=(Appointment.timestamp, Appointment.id), join=None, archived=False),
+    'pacientes': ExportSpec(
+        columns=[('id', Patient.id), ('full_name', Patient.full_name), ('phone_number', Patient.phone_number),
+                 ('email', Patient.email), ('birth_date', Patient.birth_date), ('address', Patient.address),
+                 ('medical_history', Patient.medical_history), ('created_at', Patient.created_at)],
+        date_column=Patient.created_at, local_dates=False,
+        status_column=None, phone_column=Patient.phone_number, tenant_column=Patient.tenant_id,
+        order_by=(Patient.id,), join=None, archived=False),
+    'agenda': ExportSpec(
+        columns=[('id', Schedule.id), ('patient_id', Schedule.patient_id), ('patient_name', Patient.full_name),
+                 ('phone_number', Patient.phone_number), ('title', Schedule.title),
+                 ('start_time', Schedule.start_time), ('end_time', Schedule.end_time),
+                 ('notes', Schedule.notes), ('created_at', Schedule.created_at)],
+        date_column=Schedule.start_time, local_dates=True,
+        status_column=None, phone_column=Patient.phone_number, tenant_column=Schedule.tenant_id,
+        order_by=(Schedule.start_time, Schedule.id), join=(Patient, Patient.id == Schedule.patient_id), archived=False),
+}
+
+
+class ExportError(ValueError):
+    """Pedido de exportação inválido (conjunto, formato ou filtro)."""
+
+
+def _parse_date(value, name):
+    try:
+        return date.fromisoformat(value)
+    except ValueError as e:
+        raise ExportError(f"Data inválida em '{name}': {value!r} (use AAAA-MM-DD).") from e
+
+
+def _day_start(day, local_dates):
+    """Meia-noite de `day` em São Paulo, no fuso em que a coluna está gravada."""
+    moment = datetime.combine(day, time.min)
+    if local_dates:
+        return moment
+    return TIMEZONE.localize(moment).astimezone(pytz.utc).replace(tzinfo=None)
+
+
+class ExportQuery:
+    """SELECT da exportação e, nos conjuntos com arquivo, os mesmos filtros sobre as linhas arquivadas."""
+
+    def __init__(self, spec, stmt, start=None, end=None, status=None, phone=None, tenant_id=None):
+        self.spec = spec
+        self.stmt = stmt
+        self.start, self.end, self.status, self.phone = start, end, status, phone
+        self.tenant_id = tenant_id
+
+    def archived_rows(self, names):
+        """Linhas arquivadas (tuplos pela ordem de names), por ordem de (timestamp, id)."""
+        for row in iter_archived(self.start, self.end, self.phone):
+            if self.status and row.get('status') != self.status:
+                continue
+            if row.get('tenant_id') != self.tenant_id:
+                continue
+            yield tuple(row.get(name) for name in names)
+
+    def sort_key(self, names):
+        """Chave de ordenação das linhas (pelas colunas de order_by), para juntar tabela e arquivo."""
+        order = [next(i for i, (_, column) in enumerate(self.spec.columns) if column is order_column)
+                 for order_column in self.spec.order_by]
+        return lambda row: tuple(row[i] for i in order)
+
+
+def build_query(dataset, date_from=None, date_to=None, status=None, phone=None, tenant_id=None):
+    """ExportQuery da exportação da clínica. As datas são dias de São Paulo, ambos inclusive."""
+    spec = EXPORTS.get(dataset)
+    if spec is None:
+        raise ExportError(f"Exportação desconhecida: {dataset!r}.")
+
+    stmt = select(*[column.label(name) for name, column in spec.columns])
+    if spec.join is not None:
+        stmt = stmt.join(*spec.join)
+    stmt = stmt.where(tenant_filter(spec.tenant_column, tenant_id))
+    start = end = None
+    if date_from:
+        start = _day_start(_parse_date(date_from, 'de'), spec.local_dates)
+        stmt = stmt.where(spec.date_column >= start)
+    if date_to:
+        end = _day_start(_parse_date(date_to, 'ate') + timedelta(days=1), spec.local_dates)
+        stmt = stmt.where(spec.date_column < end)
+    if status:
+        if spec.status_column is None:
+            raise ExportError(f"A exportação '{dataset}' não tem filtro de estado.")
+        stmt = stmt.where(spec.status_column == status)
+    if phone:
+        stmt = stmt.where(spec.phone_column == phone)
+    return ExportQuery(spec, stmt.order_by(*spec.order_by), start, end, status or None, phone or None, tenant_id)
+
+
+def _json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        # Texto das mensagens ou dos pacientes que o Excel abriria como fórmula
+        return "'" + value
+    return _json_value(value)
+
+
+def check_format(fmt):
+    if fmt not in FORMATS:
+        raise ExportError(f"Formato desconhecido: {fmt!r} (use csv ou ndjson).")
+
+
+def stream_export(query, fmt, yield_per=YIELD_PER, chunk_rows=CHUNK_ROWS):
+    """
+    Gera a exportação em blocos de texto, a ler o resultado aos poucos. Nos
+    conjuntos com arquivo, as linhas arquivadas entram pela mesma ordem.
+    """
+    with db.engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=yield_per).execute(query.stmt)
+        names = list(result.keys())
+        rows = result
+        if query.spec.archived:
+            rows = heapq.merge(query.archived_rows(names), result, key=query.sort_key(names))
+        buffer = io.StringIO()
+        writer = csv.writer(buffer) if fmt == 'csv' else None
+        if writer is not None:
+            # BOM para o Excel abrir o CSV em UTF-8
+            buffer.write('\ufeff')
+            writer.writerow(names)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+        pending = 0
+        for row in rows:
+            if writer is not None:
+                writer.writerow([_csv_value(value) for value in row])
+            else:
+                buffer.write(json.dumps(dict(zip(names, map(_json_value, row))), ensure_ascii=False))
+                buffer.write('\n')
+            pending += 1
+            if pending >= chunk_rows:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+                pending = 0
+        if buffer.tell():
+            yield buffer.getvalue()
+
+
+def export_filename(dataset, fmt):
+    return f"{dataset}-{datetime.now(TIMEZONE):%Y%m%d-%H%M}.{fmt}"
@@ -0,0 +1,319 @@
+# src/services/flow_engine.py
+# Motor do fluxo de conversa: compila a definição declarativa
+# (src/services/conversation_flow.json) em tabelas de despacho por estado, num
+# índice de palavras-chave por palavra inteira e num dicionário de correção
+# de erros de escrita.
+#
+# O encaminhamento de uma mensagem custa O(número de palavras): o texto é
+# normalizado uma vez, as palavras são cruzadas com o índice, e as intenções
+# encontradas são resolvidas pela tabela do estado atual. Nos estados com
+# "fuzzy": true, uma mensagem sem intenções é tentada de novo com as palavras
+# corrigidas ("agnedar" -> "agendar", "emergensia" -> "emergencia").
+
+import json
+import os
+import threading
+import time
+
+from src.services import metrics
+from src.services.text_utils import tokenize
+
+DEFAULT_FLOW_PATH = os.path.join(os.path.dirname(__file__), 'conversation_flow.json')
+
+class FlowDefinitionError(Exception):
+    """A definição do fluxo é inválida."""
+
+
+class KeywordIndex:
+    """
+    Índice de palavras-chave sobre as palavras do texto normalizado. As palavras
+    da mensagem são cruzadas numa única operação com o conjunto das primeiras
+    palavras de cada palavra-chave; só as frases de várias palavras cujo início
+    aparece na mensagem são confirmadas depois.
+    Como compara palavras inteiras, '1' não casa com '10' nem 'dor' com 'adorei'.
+    """
+
+    def __init__(self, keywords):
+        # keywords: iterável de (palavra_ou_frase_normalizada, intenção)
+        # _index: primeira palavra -> (intenções de uma palavra, [(restantes palavras, intenções)])
+        self._index = {}
+        for keyword, intent in keywords:
+            tokens = tokenize(keyword)
+            if not tokens:
+                continue
+            single, phrases = self._index.setdefault(tokens[0], (set(), []))
+            if len(tokens) == 1:
+                single.add(intent)
+            else:
+                phrases.append((tuple(tokens[1:]), intent))
+        self._starts = frozenset(self._index)
+
+    def find_intents(self, tokens):
+        """Retorna o conjunto de intenções cujas palavras-chave aparecem na lista de palavras."""
+        present = self._starts.intersection(tokens)
+        found = set()
+        for token in present:
+            single, phrases = self._index[token]
+            found.update(single)
+            if not phrases:
+                continue
+            for position, candidate in enumerate(tokens):
+                if candidate != token:
+                    continue
+                for rest, intent in phrases:
+                    if tuple(tokens[position + 1:position + 1 + len(rest)]) == rest:
+                        found.add(intent)
+        return found
+
+
+def edit_distance(a, b, limit):
+    """
+    Distância de Damerau-Levenshtein (com transposições de letras vizinhas)
+    entre a e b, ou limit + 1 se passar de limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            value = previous[j - 1] + (char_a != char_b)
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            if i > 1 and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b and previous2[j - 2] + 1 < value:
+                value = previous2[j - 2] + 1
+            current.append(value)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1] if previous[-1] <= limit else limit + 1
+
+
+class FuzzyVocabulary:
+    """
+    Correção de palavras pelo método symmetric delete: na compilação, cada
+    palavra do vocabulário é guardada com todas as variantes obtidas apagando
+    até max_distance letras. Uma palavra escrita com erros é corrigida gerando
+    as suas próprias variantes e procurando-as no mesmo dicionário; os
+    candidatos encontrados são confirmados com edit_distance. O custo não
+    depende do tamanho do vocabulário e a memória fica limitada pelo número de
+    variantes (e por max_cached correções recentes).
+
+    Palavras curtas não são corrigidas ('dor' não pode passar a 'dos'), as de
+    até 5 letras admitem um erro e as maiores dois. Empates entre palavras
+    diferentes não são corrigidos. known_words são palavras corretas que não
+    são palavras-chave: nunca são corrigidas e impedem correções de palavras
+    que estejam mais perto delas ('atendimento' não passa a 'agendamento').
+    """
+
+    def __init__(self, words, known_words=(), min_length=4, max_distance=2, max_length=20, max_cached=10000):
+        self.min_length = min_length
+        self.max_distance = max_distance
+        self.max_length = max_length
+        self.max_cached = max_cached
+        self.words = frozenset(word for word in words if len(word) >= min_length and not word.isdigit())
+        self.known_words = frozenset(known_words) - self.words
+        self._deletes = {}
+        for word in self.words | self.known_words:
+            for variant in self._variants(word, self._limit(word)):
+                self._deletes.setdefault(variant, set()).add(word)
+        self._cache = {}
+
+    def __len__(self):
+        """Número de entradas do dicionário de variantes."""
+        return len(self._deletes)
+
+    def _limit(self, word):
+        return 1 if len(word) <= 5 else self.max_distance
+
+    @staticmethod
+    def _variants(word, distance):
+        variants = {word}
+        for level in FuzzyVocabulary._levels(word, distance):
+            variants |= level
+        return variants
+
+    @staticmethod
+    def _levels(word, distance):
+        """Variantes de word com 0, 1, ... distance letras apagadas, nível a nível."""
+        frontier = {word}
+        yield frontier
+        for _ in range(distance):
+            frontier = {candidate[:i] + candidate[i + 1:] for candidate in frontier for i in range(len(candidate))}
+            yield frontier
+
+    def correct(self, token):
+        """A palavra do vocabulário mais próxima de token, ou None."""
+        if token in self._cache:
+            return self._cache[token]
+        correction = None
+        if (self.min_length <= len(token) <= self.max_length and not token.isdigit()
+                and token not in self.words and token not in self.known_words):
+            limit = self._limit(token)
+            best, candidates, checked = limit + 1, set(), set()
+            for deleted, level in enumerate(self._levels(token, limit)):
+                # Palavras encontradas com mais letras apagadas estão pelo menos a essa distância
+                if deleted > best:
+                    break
+                for variant in level:
+                    for word in self._deletes.get(variant, ()):
+                        if word in checked:
+                            continue
+                        checked.add(word)
+                        distance = edit_distance(token, word, min(limit, self._limit(word)))
+                        if distance < best:
+                            best, candidates = distance, {word}
+                        elif distance == best:
+                            candidates.add(word)
+            if best <= limit and len(candidates) == 1 and not candidates <= self.known_words:
+                correction = next(iter(candidates))
+        if len(self._cache) >= self.max_cached:
+            self._cache.clear()
+        self._cache[token] = correction
+        return correction
+
+    def correct_tokens(self, tokens):
+        """As palavras com as correções aplicadas, ou None se nenhuma mudou."""
+        corrected = [self.correct(token) or token for token in tokens]
+        return corrected if corrected != tokens else None
+
+
+class CompiledFlow:
+    """Fluxo pronto a usar: tabelas de despacho por estado e o autómato de palavras-chave."""
+
+    def __init__(self, definition, known_actions=None):
+        intents = definition.get('intents') or {}
+        states = definition.get('states') or {}
+        if 'initial' not in states:
+            raise FlowDefinitionError("O fluxo precisa de um estado 'initial'.")
+
+        self.exact = {}
+        self.max_exact_words = 0
+        keywords = []
+        for intent, spec in intents.items():
+            for keyword in spec.get('keywords', []):
+                if spec.get('match') == 'exact':
+                    words = tokenize(keyword)
+                    self.exact[' '.join(words)] = intent
+                    self.max_exact_words = max(self.max_exact_words, len(words))
+                else:
+                    keywords.append((keyword, intent))
+        self.keywords = KeywordIndex(keywords)
+
+        fuzzy = definition.get('fuzzy') or {}
+        vocabulary = {token for intent in intents.values() for keyword in intent.get('keywords', [])
+                      for token in tokenize(keyword)}
+        known_words = {token for word in fuzzy.get('known_words', []) for token in tokenize(word)}
+        self.fuzzy = FuzzyVocabulary(vocabulary, known_words, min_length=fuzzy.get('min_length', 4),
+                                     max_distance=fuzzy.get('max_distance', 2))
+
+        self.transitions = {}
+        self.fallbacks = {}
+        self.fuzzy_states = set()
+        self.merge_states = set()
+        for state, spec in states.items():
+            table = []
+            for intent, action in spec.get('transitions', []):
+                if intent not in intents:
+                    raise FlowDefinitionError(f"Estado '{state}': intenção desconhecida '{intent}'.")
+                table.append((intent, action))
+            self.transitions[state] = tuple(table)
+            self.fallbacks[state] = spec.get('fallback', 'default_response')
+            if spec.get('fuzzy'):
+                self.fuzzy_states.add(state)
+            if spec.get('merge_bursts'):
+                self.merge_states.add(state)
+
+        if known_actions is not None:
+            used = {action for table in self.transitions.values() for _, action in table}
+            used.update(self.fallbacks.values())
+            missing = used - set(known_actions)
+            if missing:
+                raise FlowDefinitionError(f"Ações desconhecidas no fluxo: {', '.join(sorted(missing))}")
+
+    def match_intents(self, message, fuzzy=False):
+        tokens = tokenize(message)
+        intents = self._intents_of(tokens)
+        if not intents and fuzzy:
+            # Só quando nada casou: as palavras escritas corretamente nunca mudam de sentido
+            corrected = self.fuzzy.correct_tokens(tokens)
+            if corrected is not None:
+                intents = self._intents_of(corrected)
+                if intents:
+                    metrics.BOT_FUZZY_MATCHES.inc()
+        return intents
+
+    def _intents_of(self, tokens):
+        intents = self.keywords.find_intents(tokens)
+        if len(tokens) <= self.max_exact_words:
+            exact = self.exact.get(' '.join(tokens))
+            if exact:
+                intents.add(exact)
+        return intents
+
+    def route(self, state, message):
+        """Retorna (ação, intenções encontradas) para a mensagem no estado dado."""
+        if state not in self.transitions:
+            state = 'initial'
+        intents = self.match_intents(message, fuzzy=state in self.fuzzy_states)
+        if intents:
+            for intent, action in self.transitions[state]:
+                if intent in intents:
+                    return action, intents
+        return self.fallbacks[state], intents
+
+    def merges_bursts(self, state):
+        """Se uma rajada de mensagens neste estado pode ser respondida num só turno."""
+        if state not in self.transitions:
+            state = 'initial'
+        return state in self.merge_states
+
+
+class FlowEngine:
+    """
+    Mantém o fluxo compilado e recompila-o quando o ficheiro da definição muda,
+    sem reiniciar os workers. Se a nova definição for inválida, o fluxo anterior
+    continua em uso.
+    """
+
+    def __init__(self, path=DEFAULT_FLOW_PATH, known_actions=None, reload_interval=5.0):
+        self.path = path
+        self.known_actions = known_actions
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._next_check = 0.0
+        self._flow = self._load()
+
+    def current(self):
+        if self.reload_interval is not None and time.monotonic() >= self._next_check:
+            self._maybe_reload()
+        return self._flow
+
+    def route(self, state, message):
+        return self.current().route(state, message)
+
+    def merges_bursts(self, state):
+        return self.current().merges_bursts(state)
+
+    def _load(self):
+        self._mtime = os.stat(self.path).st_mtime
+        with open(self.path, encoding='utf-8') as f:
+            return CompiledFlow(json.load(f), self.known_actions)
+
+    def _maybe_reload(self):
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._next_check = time.monotonic() + self.reload_interval
+            if os.stat(self.path).st_mtime == self._mtime:
+                return
+            self._flow = self._load()
+            print(f"INFO: Fluxo de conversa recarregado de {self.path}.")
+        except (OSError, ValueError, FlowDefinitionError) as e:
+            print(f"ERRO: Falha ao recarregar o fluxo de conversa ({e}); a manter a versão anterior.")
+        finally:
+            self._lock.release()
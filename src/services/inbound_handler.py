@@ -0,0 +1,152 @@
+# src/services/inbound_handler.py
+# Processamento de uma mensagem recebida (executado pelos workers da fila)
+
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+import requests
+
+from src.models.conversation import db
+from src.models.message_queue import InboundMessage
+from src.services import metrics
+from src.services.bot_logic import BotLogic
+from src.services.conversation_log import log_conversation
+from src.services.tenants import get_tenant_registry
+from src.services.whatsapp_service import UnconfirmedSend, send_whatsapp_message
+
+bot = BotLogic()
+
+# Um BotLogic por clínica (textos, horário, agenda e pacientes próprios); o
+# armazenamento do estado e o fluxo são os do bot por omissão, partilhados por todas.
+_tenant_bots = {}
+_tenant_bots_lock = threading.Lock()
+
+
+def bot_for(tenant):
+    if tenant.id is None:
+        return bot
+    current = _tenant_bots.get(tenant.id)
+    # A configuração recarregada é um objeto novo: o bot é refeito com ela
+    if current is None or current.tenant is not tenant:
+        with _tenant_bots_lock:
+            current = _tenant_bots.get(tenant.id)
+            if current is None or current.tenant is not tenant:
+                # Estado e fluxo partilhados; horário, agenda e reconhecimento de pacientes da clínica
+                current = _tenant_bots[tenant.id] = BotLogic(
+                    state_store=bot.states, flow_engine=bot.flow, tenant=tenant)
+    return current
+
+
+# Rajadas: mensagens do mesmo número ainda na fila, cada uma a no máximo
+# BURST_WINDOW segundos da anterior, são respondidas num só turno do bot
+# (nos estados com "merge_bursts" no fluxo). 0 desliga a junção.
+BURST_WINDOW = float(os.environ.get('MESSAGE_BURST_WINDOW', '2'))
+BURST_MAX_MESSAGES = 10
+
+
+class DeliveryError(Exception):
+    """A resposta não pôde ser enviada pela API do WhatsApp."""
+
+
+def extract_text(message):
+    """Retorna o texto de uma mensagem do WhatsApp, ou None se não for suportada."""
+    message_type = message.get('type')
+    if message_type == 'text':
+        return message.get('text', {}).get('body')
+    if message_type == 'button':
+        return message.get('button', {}).get('text')
+    if message_type == 'interactive':
+        interactive = message.get('interactive', {})
+        reply = interactive.get('button_reply') or interactive.get('list_reply') or {}
+        return reply.get('title')
+    return None
+
+
+def collect_burst(inbound, tenant_bot):
+    """
+    [(InboundMessage, texto)] das mensagens de texto enviadas logo a seguir a
+    inbound e ainda pendentes. Só a cabeça da fila de cada número é
+    reivindicada, por isso nenhum outro worker as pode processar entretanto.
+    """
+    if BURST_WINDOW <= 0:
+        return []
+    query = InboundMessage.query.filter(
+        InboundMessage.phone_number == inbound.phone_number,
+        InboundMessage.status == InboundMessage.STATUS_PENDING,
+        InboundMessage.id > inbound.id,
+    )
+    if inbound.tenant_id is None:
+        query = query.filter(InboundMessage.tenant_id.is_(None))
+    else:
+        query = query.filter(InboundMessage.tenant_id == inbound.tenant_id)
+    followers = query.order_by(InboundMessage.id).limit(BURST_MAX_MESSAGES).all()
+
+    burst = []
+    previous = inbound.created_at
+    for follower in followers:
+        text = extract_text(follower.data['message'])
+        if text is None or follower.created_at - previous > timedelta(seconds=BURST_WINDOW):
+            break
+        burst.append((follower, text))
+        previous = follower.created_at
+    if burst and not tenant_bot.merges_bursts(inbound.phone_number):
+        return []
+    return burst
+
+
+def handle_inbound_message(inbound):
+    """
+    Executa o turno do bot para uma InboundMessage e envia a resposta.
+
+    A resposta é gravada na própria linha da fila antes do envio: se o envio
+    falhar e a mensagem for reprocessada, o bot não avança o estado duas vezes.
+    Um envio por confirmar (a API pode tê-lo recebido) não é repetido: fica
+    registado como 'unconfirmed' e a mensagem dá-se por tratada.
+    Uma rajada (collect_burst) é respondida com um só turno; o texto junto fica
+    na linha da cabeça e as restantes ficam 'merged'.
+    """
+    data = inbound.data
+    phone_number = inbound.phone_number
+    text = data.get('turn_text') or extract_text(data['message'])
+    if text is None:
+        return
+
+    tenant = get_tenant_registry().get(inbound.tenant_id)
+    if inbound.response is None:
+        tenant_bot = bot_for(tenant)
+        burst = collect_burst(inbound, tenant_bot)
+        if burst:
+            text = ' '.join([text] + [follower_text for _, follower_text in burst])
+            inbound.payload = json.dumps({**data, 'turn_text': text}, ensure_ascii=False)
+            now = datetime.utcnow()
+            for follower, _ in burst:
+                follower.status = InboundMessage.STATUS_MERGED
+                follower.processed_at = now
+            metrics.BOT_MERGED_MESSAGES.inc(amount=len(burst))
+            print(f"INFO: {len(burst) + 1} mensagens seguidas de {phone_number} respondidas num só turno.")
+        inbound.response = tenant_bot.process_message(text, phone_number)
+        db.session.commit()
+
+    status = 'processed'
+    try:
+        sent = send_whatsapp_message(phone_number, inbound.response, tenant=tenant, raise_errors=True)
+    except UnconfirmedSend as e:
+        # Repetir poderia enviar a resposta duas vezes
+        print(f"ERRO: Resposta para {phone_number} por confirmar, não repetida (mensagem {inbound.id}): {e}")
+        sent, status = {}, 'unconfirmed'
+    except requests.exceptions.RequestException as e:
+        raise DeliveryError(f"Falha ao enviar a resposta para {phone_number}: {e}") from e
+    if sent is None:
+        raise DeliveryError(f"Falha ao enviar a resposta para {phone_number}")
+
+    log_conversation(
+        phone_number=phone_number,
+        message=text,
+        response=inbound.response,
+        message_type='incoming',
+        status=status,
+        tenant_id=inbound.tenant_id,
+        wamid=(sent.get('messages') or [{}])[0].get('id')
+    )
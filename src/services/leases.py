@@ -0,0 +1,78 @@
+# src/services/leases.py
+# Lease no banco para garantir que um serviço de fundo corre numa só instância,
+# entre todos os workers do gunicorn e todos os dynos.
+#
+# Quem detém o lease renova-o antes de expirar; se o processo morrer, o lease
+# expira e outra instância assume.
+
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, or_, update
+from sqlalchemy.exc import IntegrityError
+
+from src.models.conversation import db
+from src.models.service_lease import ServiceLease
+
+
+def holder_id():
+    """Identificador único deste processo (host, pid e um sufixo aleatório)."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class Lease:
+    """
+    Lease `name` com duração `ttl_seconds`. acquire() também renova quando já
+    é nosso, por isso basta chamá-lo periodicamente (bem antes do ttl).
+    Usa transações próprias, independentes da db.session.
+    """
+
+    def __init__(self, name, ttl_seconds=30, holder=None):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.holder = holder or holder_id()
+        self.held = False
+
+    def acquire(self):
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.ttl_seconds)
+        table = ServiceLease.__table__
+        with db.engine.begin() as conn:
+            result = conn.execute(
+                update(table)
+                .where(table.c.name == self.name,
+                       or_(table.c.holder == self.holder, table.c.expires_at < now))
+                .values(holder=self.holder, expires_at=expires_at,
+                        acquired_at=now if not self.held else table.c.acquired_at)
+            )
+            acquired = result.rowcount == 1
+        if not acquired:
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(insert(table).values(
+                        name=self.name, holder=self.holder, expires_at=expires_at, acquired_at=now
+                    ))
+                acquired = True
+            except IntegrityError:
+                # Existe e pertence a outra instância ainda válida.
+                acquired = False
+
+        if acquired != self.held:
+            state = "adquirido" if acquired else "perdido"
+            print(f"INFO: Lease '{self.name}' {state} por {self.holder}.")
+        self.held = acquired
+        return acquired
+
+    def release(self):
+        if not self.held:
+            return
+        table = ServiceLease.__table__
+        with db.engine.begin() as conn:
+            conn.execute(
+                update(table)
+                .where(table.c.name == self.name, table.c.holder == self.holder)
+                .values(expires_at=datetime.utcnow())
+            )
+        self.held = False
@@ -0,0 +1,284 @@
+# src/services/message_queue.py
+# Fila durável do webhook: o pedido HTTP só grava a mensagem e responde;
+# um conjunto de workers em segundo plano processa as mensagens depois.
+
+import json
+import os
+import queue
+import random
+import threading
+import zlib
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from src.models.conversation import db
+from src.models.message_queue import InboundMessage, MessageReceipt
+from src.services.dedup import RecentMessageIds
+from src.services.metrics import WEBHOOK_RATE_LIMITED
+from src.services.rate_limit import SenderRateLimiter
+from src.services.tenants import get_tenant_registry
+
+# O WhatsApp reenvia webhooks não confirmados durante até 7 dias.
+RECEIPT_RETENTION = timedelta(days=7)
+
+recent_message_ids = RecentMessageIds()
+
+# Mensagens aceites por remetente na janela; as restantes ficam gravadas sem
+# processamento (um remetente não consegue ocupar os workers de todos).
+sender_limiter = SenderRateLimiter(
+    max_messages=int(os.environ.get('WEBHOOK_SENDER_LIMIT', '20')),
+    window_seconds=float(os.environ.get('WEBHOOK_SENDER_WINDOW', '60')),
+)
+
+
+def extract_messages(payload):
+    """Extrai as mensagens de um payload de webhook, com os metadados de cada uma."""
+    messages = []
+    for entry in payload.get('entry') or []:
+        for change in entry.get('changes') or []:
+            value = change.get('value') or {}
+            contacts = {c.get('wa_id'): c for c in value.get('contacts') or []}
+            for message in value.get('messages') or []:
+                messages.append({
+                    'message': message,
+                    'metadata': value.get('metadata') or {},
+                    'contact': contacts.get(message.get('from')) or {}
+                })
+    return messages
+
+
+def enqueue_webhook_payload(payload):
+    """
+    Grava cada mensagem nova do payload na fila durável e ignora as reentregas
+    (mesmo wamid). As de remetentes acima do limite ficam gravadas como
+    'limited', sem processamento. Retorna quantas mensagens ficaram na fila.
+    """
+    accepted = []
+    queued = 0
+    tenants = get_tenant_registry()
+    for item in extract_messages(payload):
+        wamid = item['message'].get('id')
+        if wamid and wamid in recent_message_ids:
+            continue
+        phone_number = item['message'].get('from', '')
+        try:
+            # Recibo e mensagem entram juntos: se o wamid já existir, nenhum dos dois fica.
+            with db.session.begin_nested():
+                if wamid:
+                    db.session.add(MessageReceipt(wamid=wamid))
+                message = InboundMessage(
+                    phone_number=phone_number,
+                    tenant_id=tenants.resolve(item['metadata'].get('phone_number_id')).id,
+                    payload=json.dumps(item, ensure_ascii=False)
+                )
+                db.session.add(message)
+        except IntegrityError:
+            recent_message_ids.add(wamid)
+            continue
+        # Só as mensagens novas contam para o limite (as reentregas não)
+        accepted.append(wamid)
+        if not sender_limiter.allow(phone_number):
+            message.status = InboundMessage.STATUS_LIMITED
+            message.processed_at = datetime.utcnow()
+            WEBHOOK_RATE_LIMITED.inc()
+            if sender_limiter.rejected(phone_number) == 1:
+                print(f"INFO: {phone_number} passou o limite de {sender_limiter.max_messages} mensagens em "
+                      f"{sender_limiter.window_seconds:.0f}s; as seguintes ficam gravadas sem resposta.")
+        else:
+            queued += 1
+    if accepted:
+        db.session.commit()
+        for wamid in accepted:
+            if wamid:
+                recent_message_ids.add(wamid)
+    return queued
+
+
+class MessageQueueWorker:
+    """
+    Drena a tabela inbound_message com um pool de threads.
+
+    Cada conversa (phone_number) é sempre atribuída à mesma thread, e só a
+    mensagem mais antiga ainda não concluída de cada conversa pode ser
+    reivindicada. Assim a ordem é preservada por conversa, mesmo com vários
+    processos gunicorn a drenar a mesma tabela, enquanto conversas
+    diferentes são processadas em paralelo.
+    """
+
+    def __init__(self, app, handler, num_workers=4, poll_interval=0.5, batch_size=100,
+                 lease_seconds=120, max_attempts=5, retry_base_seconds=2, retry_max_seconds=300,
+                 done_retention=timedelta(days=1)):
+        self.app = app
+        self.handler = handler
+        self.num_workers = num_workers
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.done_retention = done_retention
+
+        self._shards = [queue.Queue() for _ in range(num_workers)]
+        self._inflight = set()
+        self._inflight_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._last_prune = datetime.min
+
+    # --- Ciclo de vida ---
+    def start(self):
+        if self._threads:
+            return
+        self._stopping.clear()
+        dispatcher = threading.Thread(target=self._dispatch_loop, name='queue-dispatcher', daemon=True)
+        self._threads.append(dispatcher)
+        for index, shard in enumerate(self._shards):
+            self._threads.append(threading.Thread(
+                target=self._worker_loop, args=(shard,), name=f'queue-worker-{index}', daemon=True
+            ))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout=10):
+        self._stopping.set()
+        self._wakeup.set()
+        for shard in self._shards:
+            shard.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def notify(self):
+        """Acorda o dispatcher (ex.: logo depois de o webhook gravar mensagens)."""
+        self._wakeup.set()
+
+    # --- Dispatcher ---
+    def _dispatch_loop(self):
+        while not self._stopping.is_set():
+            claimed = []
+            try:
+                with self.app.app_context():
+                    claimed = self._claim_batch()
+                    self._maybe_prune()
+            except Exception as e:
+                print(f"ERRO: Falha ao reivindicar mensagens da fila: {e}")
+            for message_id, phone_number in claimed:
+                self._shards[zlib.crc32(phone_number.encode()) % self.num_workers].put((message_id, phone_number))
+            if not claimed:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def _claim_batch(self):
+        """Reivindica a cabeça da fila de cada conversa que esteja livre e disponível."""
+        now = datetime.utcnow()
+        heads = (
+            select(func.min(InboundMessage.id))
+            .where(InboundMessage.status.in_([InboundMessage.STATUS_PENDING, InboundMessage.STATUS_PROCESSING]))
+            .group_by(InboundMessage.phone_number)
+        )
+        rows = db.session.execute(
+            select(InboundMessage.id, InboundMessage.phone_number, InboundMessage.status,
+                   InboundMessage.available_at, InboundMessage.locked_until)
+            .where(InboundMessage.id.in_(heads))
+            .order_by(InboundMessage.id)
+            .limit(self.batch_size)
+        ).all()
+
+        with self._inflight_lock:
+            inflight = set(self._inflight)
+
+        claimed = []
+        for row in rows:
+            if row.phone_number in inflight or row.available_at > now:
+                continue
+            if row.status == InboundMessage.STATUS_PROCESSING and row.locked_until and row.locked_until > now:
+                continue
+            # Reivindicação otimista: só um processo consegue mudar a linha.
+            result = db.session.execute(
+                update(InboundMessage)
+                .where(InboundMessage.id == row.id,
+                       InboundMessage.status == row.status,
+                       or_(InboundMessage.locked_until.is_(None), InboundMessage.locked_until <= now))
+                .values(status=InboundMessage.STATUS_PROCESSING,
+                        locked_until=now + timedelta(seconds=self.lease_seconds),
+                        attempts=InboundMessage.attempts + 1)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 1:
+                claimed.append((row.id, row.phone_number))
+        db.session.commit()
+
+        with self._inflight_lock:
+            self._inflight.update(phone for _, phone in claimed)
+        return claimed
+
+    def _maybe_prune(self):
+        """Remove periodicamente as mensagens processadas e os recibos fora da retenção."""
+        now = datetime.utcnow()
+        if now - self._last_prune < timedelta(minutes=10):
+            return
+        self._last_prune = now
+        db.session.execute(
+            InboundMessage.__table__.delete()
+            .where(InboundMessage.status.in_([InboundMessage.STATUS_DONE, InboundMessage.STATUS_MERGED,
+                                              InboundMessage.STATUS_LIMITED]),
+                   InboundMessage.processed_at < now - self.done_retention)
+        )
+        db.session.execute(
+            MessageReceipt.__table__.delete()
+            .where(MessageReceipt.received_at < now - RECEIPT_RETENTION)
+        )
+        db.session.commit()
+
+    # --- Workers ---
+    def _worker_loop(self, shard):
+        while True:
+            item = shard.get()
+            if item is None:
+                return
+            message_id, phone_number = item
+            try:
+                with self.app.app_context():
+                    self._process(message_id)
+            except Exception as e:
+                print(f"ERRO: Falha inesperada no worker da fila (mensagem {message_id}): {e}")
+            finally:
+                with self._inflight_lock:
+                    self._inflight.discard(phone_number)
+                self._wakeup.set()
+
+    def _process(self, message_id):
+        message = db.session.get(InboundMessage, message_id)
+        if message is None or message.status != InboundMessage.STATUS_PROCESSING:
+            return
+        try:
+            self.handler(message)
+        except Exception as e:
+            db.session.rollback()
+            self._record_failure(message_id, e)
+            return
+        message.status = InboundMessage.STATUS_DONE
+        message.locked_until = None
+        message.last_error = None
+        message.processed_at = datetime.utcnow()
+        db.session.commit()
+
+    def _record_failure(self, message_id, error):
+        message = db.session.get(InboundMessage, message_id)
+        if message is None:
+            return
+        message.last_error = str(error)[:1000]
+        message.locked_until = None
+        if message.attempts >= self.max_attempts:
+            message.status = InboundMessage.STATUS_DEAD
+            print(f"ERRO: Mensagem {message_id} movida para dead-letter após {message.attempts} tentativas: {error}")
+        else:
+            # Backoff exponencial com jitter completo.
+            delay = min(self.retry_max_seconds, self.retry_base_seconds * 2 ** (message.attempts - 1))
+            message.status = InboundMessage.STATUS_PENDING
+            message.available_at = datetime.utcnow() + timedelta(seconds=random.uniform(delay / 2, delay))
+        db.session.commit()
@@ -0,0 +1,188 @@
+# src/services/message_status.py
+# Estados de entrega das respostas do bot (sent/delivered/read/failed).
+#
+# O webhook só extrai os estados do payload e entrega-os ao StatusCoalescer,
+# que guarda em memória o estado mais avançado de cada mensagem (wamid). A
+# cada flush_interval os estados acumulados são gravados em Conversation com
+# uma consulta e no máximo um UPDATE por estado final, por isso várias
+# transições da mesma mensagem custam uma só escrita. Os estados nunca
+# recuam: um 'delivered' atrasado não apaga um 'read' já gravado.
+
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import select, update
+
+from src.models.conversation import db, Conversation
+from src.services import metrics
+
+# Ordem dos estados; 'processed' é o estado da linha antes de qualquer callback.
+STATUS_RANK = {'processed': 0, 'sent': 1, 'delivered': 2, 'read': 3, 'failed': 4}
+
+
+def extract_statuses(payload):
+    """Extrai os callbacks de estado de um payload de webhook: [{'wamid', 'status', 'recipient_id', 'errors'}]."""
+    statuses = []
+    for entry in payload.get('entry') or []:
+        for change in entry.get('changes') or []:
+            value = change.get('value') or {}
+            for status in value.get('statuses') or []:
+                if status.get('id') and status.get('status') in STATUS_RANK:
+                    statuses.append({
+                        'wamid': status['id'],
+                        'status': status['status'],
+                        'recipient_id': status.get('recipient_id'),
+                        'errors': status.get('errors') or [],
+                    })
+    return statuses
+
+
+def apply_statuses(conn, updates):
+    """
+    Grava {wamid: estado} em Conversation sem fazer recuar estados.
+    Retorna os wamids que ainda não existem na tabela.
+    """
+    table = Conversation.__table__
+    wamids = list(updates)
+    current = dict(conn.execute(
+        select(table.c.wamid, table.c.status).where(table.c.wamid.in_(wamids))
+    ).all())
+
+    by_status = {}
+    for wamid, status in updates.items():
+        if wamid in current and STATUS_RANK[status] > STATUS_RANK.get(current[wamid], -1):
+            by_status.setdefault(status, []).append(wamid)
+
+    updated = 0
+    for status, group in by_status.items():
+        lower = [name for name, rank in STATUS_RANK.items() if rank < STATUS_RANK[status]]
+        result = conn.execute(
+            update(table)
+            .where(table.c.wamid.in_(group), (table.c.status.in_(lower)) | (table.c.status.is_(None)))
+            .values(status=status)
+        )
+        updated += result.rowcount
+    metrics.MESSAGE_STATUS_UPDATES.inc(amount=updated)
+    return set(wamids) - current.keys()
+
+
+class StatusCoalescer:
+    """
+    Buffer {wamid: estado mais avançado} com flush periódico. Os estados de
+    mensagens cuja linha ainda não foi gravada (o registo de conversas também é
+    write-behind) voltam ao buffer e são tentados de novo durante retry_window
+    segundos.
+    """
+
+    def __init__(self, app, flush_interval=2.0, max_batch=500, retry_window=60.0, max_pending=50000):
+        self.app = app
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.retry_window = retry_window
+        self.max_pending = max_pending
+
+        self._pending = {}      # wamid -> (rank, estado, primeira vez visto)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='message-status', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def add(self, statuses):
+        now = time.monotonic()
+        with self._lock:
+            for status in statuses:
+                self._merge(status['wamid'], STATUS_RANK[status['status']], status['status'], now)
+            pending = len(self._pending)
+        if pending >= self.max_pending:
+            self._wakeup.set()
+
+    def _merge(self, wamid, rank, status, first_seen):
+        current = self._pending.get(wamid)
+        if current is None:
+            self._pending[wamid] = (rank, status, first_seen)
+            return
+        metrics.MESSAGE_STATUS_COALESCED.inc()
+        if rank > current[0]:
+            self._pending[wamid] = (rank, status, min(first_seen, current[2]))
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """Grava os estados acumulados. Retorna quantas mensagens foram tratadas."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            items = list(pending.items())
+            missing = set()
+            try:
+                with self.app.app_context():
+                    with db.engine.begin() as conn:
+                        for start in range(0, len(items), self.max_batch):
+                            chunk = items[start:start + self.max_batch]
+                            missing |= apply_statuses(conn, {wamid: entry[1] for wamid, entry in chunk})
+            except Exception as e:
+                print(f"ERRO: Falha ao gravar {len(items)} estados de mensagens: {e}")
+                self._requeue(items)
+                return 0
+
+            deadline = time.monotonic() - self.retry_window
+            self._requeue([(wamid, pending[wamid]) for wamid in missing if pending[wamid][2] > deadline])
+            return len(items) - len(missing)
+
+    def _requeue(self, items):
+        with self._lock:
+            for wamid, (rank, status, first_seen) in items:
+                self._merge(wamid, rank, status, first_seen)
+            overflow = len(self._pending) - self.max_pending
+            if overflow > 0:
+                oldest = sorted(self._pending, key=lambda wamid: self._pending[wamid][2])[:overflow]
+                for wamid in oldest:
+                    del self._pending[wamid]
+                print(f"ERRO: Buffer de estados cheio; {overflow} estados antigos descartados.")
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+
+def record_statuses(statuses):
+    """Entrega os estados ao coalescer da aplicação (ou grava-os já, se não houver)."""
+    for status in statuses:
+        metrics.WEBHOOK_STATUSES.inc(status['status'])
+        if status['status'] == 'failed':
+            errors = '; '.join(f"{e.get('code')} {e.get('title')}" for e in status['errors'])
+            print(f"ERRO: Mensagem {status['wamid']} para {status['recipient_id']} falhou: {errors}")
+
+    coalescer = current_app.extensions.get('message_status')
+    if coalescer is not None:
+        coalescer.add(statuses)
+        return
+    updates = {}
+    for status in statuses:
+        if STATUS_RANK[status['status']] > STATUS_RANK.get(updates.get(status['wamid']), -1):
+            updates[status['wamid']] = status['status']
+    with db.engine.begin() as conn:
+        apply_statuses(conn, updates)
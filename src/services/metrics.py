@@ -0,0 +1,369 @@
+# src/services/metrics.py
+# Métricas no formato de exposição de texto do Prometheus.
+#
+# Cada thread escreve num shard próprio (um dict só dela), por isso o caminho
+# quente não usa locks: o lock só é tomado ao criar o shard de uma thread nova
+# e ao recolher. Com vários workers do gunicorn, cada processo grava
+# periodicamente o seu snapshot em METRICS_MULTIPROC_DIR e o /metrics soma os
+# ficheiros de todos os processos.
+
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 512, 1024, 2048, 4096, 8192, 16384, 65536, 262144)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+COUNTER = 'counter'
+HISTOGRAM = 'histogram'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []      # (thread, dict) de cada thread que já escreveu
+        self._retired = {}     # valores acumulados de threads que já terminaram
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"Métrica duplicada: {metric.name}")
+            self.metrics[metric.name] = metric
+        return metric
+
+    def shard(self):
+        values = getattr(self._local, 'values', None)
+        if values is None:
+            values = self._local.values = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), values))
+        return values
+
+    def snapshot(self):
+        """Soma os shards de todas as threads: {(nome, labels): valor ou [buckets..., soma]}."""
+        with self._lock:
+            alive = []
+            for thread, values in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, values))
+                else:
+                    _merge(self._retired, dict(values))
+            self._shards = alive
+            total = {}
+            _merge(total, self._retired)
+            for _, values in alive:
+                # dict(values) é uma cópia atómica sob o GIL
+                _merge(total, dict(values))
+        return total
+
+    def reset_after_fork(self):
+        """No processo filho: descarta os valores herdados do pai (e o lock, que pode ter ficado preso)."""
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+
+
+def _merge(target, source):
+    for key, value in source.items():
+        if isinstance(value, list):
+            current = target.get(key)
+            if current is None:
+                target[key] = list(value)
+            else:
+                for i, v in enumerate(value):
+                    current[i] += v
+        else:
+            target[key] = target.get(key, 0) + value
+
+
+REGISTRY = Registry()
+
+
+class Counter:
+    kind = COUNTER
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._registry = registry
+        registry.register(self)
+
+    def inc(self, *labels, amount=1):
+        values = self._registry.shard()
+        # Valores das labels sempre em texto: 200 e 'none' têm de se poder ordenar juntos
+        key = (self.name, tuple(map(str, labels)))
+        values[key] = values.get(key, 0) + amount
+
+
+class Histogram:
+    kind = HISTOGRAM
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._registry = registry
+        registry.register(self)
+
+    def observe(self, value, *labels):
+        """Os buckets são guardados não cumulativos: [por bucket..., +Inf, soma]."""
+        values = self._registry.shard()
+        key = (self.name, tuple(map(str, labels)))
+        slots = values.get(key)
+        if slots is None:
+            slots = values[key] = [0] * (len(self.buckets) + 2)
+        slots[bisect_left(self.buckets, value)] += 1
+        slots[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+
+# --- Exposição ---
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render(snapshot, registry=REGISTRY):
+    """Texto no formato de exposição do Prometheus (versão 0.0.4)."""
+    by_metric = {}
+    for (name, labels), value in snapshot.items():
+        by_metric.setdefault(name, []).append((tuple(labels), value))
+
+    lines = []
+    for name in sorted(registry.metrics):
+        metric = registry.metrics[name]
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for labels, value in sorted(by_metric.get(name, ()), key=lambda item: tuple(map(str, item[0]))):
+            if metric.kind == COUNTER:
+                lines.append(f"{name}{_format_labels(metric.labelnames, labels)} {_format_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets + ('+Inf',), value[:-1]):
+                cumulative += count
+                le = f'le="{bound if bound == "+Inf" else _format_number(float(bound))}"'
+                lines.append(f"{name}_bucket{_format_labels(metric.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(metric.labelnames, labels)} {_format_number(value[-1])}")
+            lines.append(f"{name}_count{_format_labels(metric.labelnames, labels)} {cumulative}")
+    return '\n'.join(lines) + '\n'
+
+
+# --- Agregação entre processos ---
+class MultiprocessExporter:
+    """
+    Grava o snapshot deste processo em <directory>/metrics-<pid>.json a cada
+    `interval` segundos e soma os ficheiros de todos os processos ao recolher.
+    O diretório deve ser esvaziado no arranque do servidor (antes dos forks).
+    """
+
+    def __init__(self, directory, interval=5.0, registry=REGISTRY):
+        self.directory = directory
+        self.interval = interval
+        self.registry = registry
+        self._pid = None
+        self._thread = None
+        self._stopping = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def start(self):
+        # Depois de um fork a thread do processo pai não existe no filho.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='metrics-export', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self.write()
+
+    def write(self):
+        path = os.path.join(self.directory, f"metrics-{os.getpid()}.json")
+        rows = [[name, list(labels), value] for (name, labels), value in self.registry.snapshot().items()]
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(rows, f)
+        os.replace(tmp_path, path)
+
+    def collect(self):
+        self.write()
+        total = {}
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            try:
+                with open(path) as f:
+                    rows = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"ERRO: Ficheiro de métricas ilegível {path}: {e}")
+                continue
+            _merge(total, {(name, tuple(labels)): value for name, labels, value in rows})
+        return total
+
+    def _after_fork(self):
+        # O filho herda os valores do pai; sem isto seriam somados duas vezes.
+        self.registry.reset_after_fork()
+        self._thread = None
+        if not self._stopping.is_set():
+            self.start()
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                print(f"ERRO: Falha ao gravar as métricas do processo: {e}")
+
+
+def clear_multiprocess_dir(directory):
+    """Apaga os snapshots de execuções anteriores (no processo principal, antes dos forks)."""
+    for path in glob.glob(os.path.join(directory, 'metrics-*.json*')):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+_exporter = None
+
+
+def collect():
+    """Snapshot de todos os processos (ou só deste, sem METRICS_MULTIPROC_DIR)."""
+    if _exporter is not None:
+        _exporter.start()
+        return _exporter.collect()
+    return REGISTRY.snapshot()
+
+
+# --- Métricas da aplicação ---
+HTTP_REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Latência dos pedidos HTTP por rota.', ('endpoint', 'method', 'status'))
+HTTP_REQUEST_DB_QUERIES = Histogram(
+    'http_request_db_queries', 'Consultas SQL executadas por pedido HTTP.', ('endpoint',), buckets=COUNT_BUCKETS)
+DB_QUERY_DURATION = Histogram(
+    'db_query_duration_seconds', 'Duração das consultas SQL.', ('context',))
+
+WEBHOOK_PAYLOAD_BYTES = Histogram(
+    'whatsapp_webhook_payload_bytes', 'Tamanho dos payloads recebidos no webhook.', buckets=SIZE_BUCKETS)
+WEBHOOK_DURATION = Histogram(
+    'whatsapp_webhook_duration_seconds', 'Tempo de tratamento do webhook até à resposta.', ('result',))
+WEBHOOK_MESSAGES = Counter(
+    'whatsapp_webhook_messages_total', 'Mensagens aceites na fila pelo webhook.')
+WEBHOOK_RATE_LIMITED = Counter(
+    'whatsapp_webhook_rate_limited_total', 'Mensagens gravadas sem processamento por excederem o limite do remetente.')
+WEBHOOK_STATUSES = Counter(
+    'whatsapp_webhook_statuses_total', 'Callbacks de estado recebidos no webhook, por estado.', ('status',))
+MESSAGE_STATUS_COALESCED = Counter(
+    'message_status_coalesced_total', 'Callbacks de estado absorvidos por outro da mesma mensagem antes do flush.')
+MESSAGE_STATUS_UPDATES = Counter(
+    'message_status_updates_total', 'Linhas de Conversation atualizadas pelos callbacks de estado.')
+
+BOT_TRANSITIONS = Counter(
+    'bot_transitions_total', 'Turnos do bot por estado de origem e ação executada.', ('state', 'action'))
+BOT_STEP_DURATION = Histogram(
+    'bot_step_duration_seconds', 'Tempo de cada turno do bot por estado de origem.', ('state',))
+BOT_MERGED_MESSAGES = Counter(
+    'bot_merged_messages_total', 'Mensagens em rajada respondidas no turno da mensagem anterior.')
+BOT_FUZZY_MATCHES = Counter(
+    'bot_fuzzy_matches_total', 'Mensagens encaminhadas só depois de corrigir erros de escrita.')
+
+GRAPH_API_DURATION = Histogram(
+    'whatsapp_api_request_duration_seconds', 'Latência de cada pedido HTTP à Graph API.', ('status',))
+GRAPH_API_ERRORS = Counter(
+    'whatsapp_api_errors_total', 'Pedidos à Graph API sem sucesso, por motivo.', ('reason',))
+GRAPH_API_THROTTLED = Counter(
+    'whatsapp_api_throttled_total', 'Respostas 429 (limite de ritmo) da Graph API.')
+
+AUTH_USER_LOADS = Counter(
+    'auth_user_loads_total', 'Utilizadores carregados por pedido autenticado, por origem.', ('source',))
+
+PATIENT_LOOKUPS = Counter(
+    'bot_patient_lookups_total', 'Remetentes resolvidos pelo cache de pacientes (known/unknown).', ('result',))
+
+SCHEDULE_FEED_EVENTS = Counter(
+    'schedule_feed_events_total', 'Eventos enviados pelos streams da agenda, por tipo (changes/resync/ping/rejected).',
+    ('kind',))
+
+
+# --- Instrumentação do Flask e do SQLAlchemy ---
+def _before_request():
+    g._metrics_started = time.perf_counter()
+    g._metrics_queries = 0
+
+
+def _after_request(response):
+    started = g.pop('_metrics_started', None)
+    if started is not None:
+        endpoint = request.endpoint or 'not_found'
+        HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, endpoint, request.method, response.status_code)
+        HTTP_REQUEST_DB_QUERIES.observe(g.pop('_metrics_queries', 0), endpoint)
+    return response
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('_metrics_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stack = conn.info.get('_metrics_started')
+    if not stack:
+        return
+    elapsed = time.perf_counter() - stack.pop()
+    if has_request_context():
+        DB_QUERY_DURATION.observe(elapsed, 'request')
+        g._metrics_queries = g.get('_metrics_queries', 0) + 1
+    else:
+        DB_QUERY_DURATION.observe(elapsed, 'background')
+
+
+def init_app(app, db):
+    """Liga a instrumentação de rotas e de consultas SQL à aplicação."""
+    global _exporter
+
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    with app.app_context():
+        for engine in db.engines.values():
+            if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+                event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+                event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+    directory = os.environ.get('METRICS_MULTIPROC_DIR')
+    if directory and _exporter is None:
+        _exporter = MultiprocessExporter(directory)
+        _exporter.start()
+        atexit.register(_exporter.stop)
+    app.extensions['metrics'] = REGISTRY
@@ -0,0 +1,83 @@
+# src/services/patient_cache.py
+# Reconhecimento do remetente das mensagens: telefone (E.164) -> paciente.
+#
+# Cada processo guarda em memória o mapa completo (clínica, phone_e164) ->
+# paciente, lido com uma única consulta: cada clínica só reconhece os seus. As mensagens do bot são resolvidas só com o mapa
+# (também os números desconhecidos), sem consultas ao banco. As rotas de
+# pacientes invalidam o mapa do próprio processo; nos outros workers as
+# alterações aparecem, no máximo, ao fim de ttl_seconds.
+
+import os
+import threading
+import time
+from collections import namedtuple
+
+from sqlalchemy import select
+
+from src.models.conversation import db, Patient
+from src.services import metrics
+from src.services.phone import normalize_phone
+
+DEFAULT_TTL = 300
+
+KnownPatient = namedtuple('KnownPatient', 'id full_name birth_date')
+
+
+class PatientPhoneCache:
+    def __init__(self, ttl_seconds=None):
+        if ttl_seconds is None:
+            ttl_seconds = float(os.environ.get('PATIENT_CACHE_TTL', DEFAULT_TTL))
+        self.ttl_seconds = ttl_seconds
+        self._patients = {}
+        self._expires_at = 0.0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, phone_number, tenant_id=None):
+        """Paciente da clínica com este telefone (qualquer formato), ou None."""
+        phone = normalize_phone(phone_number)
+        if phone is None:
+            return None
+        if time.monotonic() >= self._expires_at:
+            self._reload()
+        patient = self._patients.get((tenant_id, phone))
+        metrics.PATIENT_LOOKUPS.inc('known' if patient else 'unknown')
+        return patient
+
+    def invalidate(self):
+        """Força a releitura no próximo lookup (chamado depois de alterar pacientes)."""
+        self._generation += 1
+        self._expires_at = 0.0
+
+    def _reload(self):
+        with self._lock:
+            if time.monotonic() < self._expires_at:
+                return
+            generation = self._generation
+            patients = {}
+            with db.engine.connect() as conn:
+                rows = conn.execute(
+                    select(Patient.id, Patient.full_name, Patient.birth_date, Patient.phone_e164, Patient.tenant_id)
+                    .where(Patient.phone_e164.isnot(None))
+                    .order_by(Patient.id)
+                )
+                for row in rows:
+                    # Números repetidos em formatos diferentes: fica o paciente mais antigo
+                    patients.setdefault((row.tenant_id, row.phone_e164),
+                                        KnownPatient(row.id, row.full_name, row.birth_date))
+            self._patients = patients
+            # Invalidado durante a leitura: o mapa pode não ter a alteração
+            if generation == self._generation:
+                self._expires_at = time.monotonic() + self.ttl_seconds
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_patient_cache():
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = PatientPhoneCache()
+        return _default_cache
@@ -0,0 +1,78 @@
+# src/services/patient_directory.py
+# Listagem paginada por keyset e pesquisa por prefixo de pacientes
+
+import base64
+import json
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import load_only
+
+from src.models.conversation import Patient
+from src.services.tenants import tenant_filter
+from src.services.text_utils import fold_text, only_digits
+
+PAGE_SIZE = 50
+AUTOCOMPLETE_LIMIT = 10
+
+# Limite superior para transformar "começa por X" num intervalo [X, X + PREFIX_END),
+# que os índices B-tree do SQLite e do PostgreSQL resolvem sem LIKE.
+PREFIX_END = '\U0010ffff'
+
+
+def encode_cursor(key, patient_id):
+    raw = json.dumps([key, patient_id], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Retorna (chave, id) de um cursor, ou None se for inválido."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        key, patient_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return key, int(patient_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def _search_criteria(search):
+    """
+    Escolhe a coluna de ordenação e o filtro de prefixo para o termo pesquisado:
+    termos só com dígitos pesquisam o telefone, os restantes o nome sem acentos.
+    """
+    folded = fold_text(search)
+    digits = only_digits(search)
+    if not folded:
+        return Patient.full_name, None
+    if digits and not any(ch.isalpha() for ch in folded):
+        return Patient.phone_digits, and_(Patient.phone_digits >= digits,
+                                          Patient.phone_digits < digits + PREFIX_END)
+    return Patient.search_name, and_(Patient.search_name >= folded,
+                                     Patient.search_name < folded + PREFIX_END)
+
+
+def find_patients(search=None, cursor=None, limit=PAGE_SIZE, columns=None, tenant_id=None):
+    """
+    Retorna (pacientes da clínica, próximo_cursor). Pagina por keyset sobre
+    (coluna, id), por isso cada página custa o mesmo, seja a primeira ou a centésima.
+    """
+    sort_column, prefix_filter = _search_criteria(search)
+    query = Patient.query.filter(tenant_filter(Patient.tenant_id, tenant_id))
+    if columns:
+        query = query.options(load_only(*columns))
+    if prefix_filter is not None:
+        query = query.filter(prefix_filter)
+
+    position = decode_cursor(cursor)
+    if position is not None:
+        key, last_id = position
+        query = query.filter(or_(sort_column > key, and_(sort_column == key, Patient.id > last_id)))
+
+    patients = query.order_by(sort_column, Patient.id).limit(limit + 1).all()
+    next_cursor = None
+    if len(patients) > limit:
+        patients = patients[:limit]
+        last = patients[-1]
+        next_cursor = encode_cursor(getattr(last, sort_column.key), last.id)
+    return patients, next_cursor
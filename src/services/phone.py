@@ -0,0 +1,65 @@
+# src/services/phone.py
+# Normalização de números de telefone para E.164 (+5516992692383).
+#
+# Os números dos pacientes são escritos à mão pela equipe em vários formatos
+# ("55169...", "(16) 9...", "016 9..."), e o WhatsApp envia o remetente só com
+# dígitos e, em alguns números brasileiros antigos, sem o nono dígito. Todos
+# são reduzidos à mesma forma canónica para poderem ser comparados.
+
+import os
+
+from src.services.text_utils import only_digits
+
+BRAZIL_COUNTRY_CODE = '55'
+DEFAULT_AREA_CODE = '16'
+
+
+def default_area_code():
+    """DDD assumido para números escritos sem DDD (PHONE_DEFAULT_AREA_CODE)."""
+    return os.environ.get('PHONE_DEFAULT_AREA_CODE', DEFAULT_AREA_CODE)
+
+
+def _brazilian(national):
+    """DDD + assinante -> E.164, ou None se não for um número brasileiro válido."""
+    area, subscriber = national[:2], national[2:]
+    if '0' in area:
+        return None
+    if len(subscriber) == 8 and subscriber[0] in '6789':
+        # Celular sem o nono dígito (formato antigo, ainda usado pelo WhatsApp)
+        subscriber = '9' + subscriber
+    elif len(subscriber) == 9 and subscriber[0] != '9':
+        return None
+    elif len(subscriber) not in (8, 9):
+        return None
+    return f"+{BRAZIL_COUNTRY_CODE}{area}{subscriber}"
+
+
+def normalize_phone(value, area_code=None):
+    """
+    Retorna o número em E.164, ou None se não for reconhecido.
+    Sem indicativo de país assume o Brasil; sem DDD assume area_code
+    (por omissão, PHONE_DEFAULT_AREA_CODE).
+    """
+    if not value:
+        return None
+    value = value.strip()
+    digits = only_digits(value)
+    international = value.startswith('+')
+    if digits.startswith('00'):
+        digits, international = digits[2:], True
+
+    if international:
+        if digits.startswith(BRAZIL_COUNTRY_CODE):
+            return _brazilian(digits[2:])
+        return f"+{digits}" if 8 <= len(digits) <= 15 else None
+
+    if digits.startswith('0'):
+        # Prefixo de chamada interurbana: 016 99269-2383
+        digits = digits[1:]
+    if len(digits) in (12, 13) and digits.startswith(BRAZIL_COUNTRY_CODE):
+        return _brazilian(digits[2:])
+    if len(digits) in (10, 11):
+        return _brazilian(digits)
+    if len(digits) in (8, 9):
+        return _brazilian((area_code or default_area_code()) + digits)
+    return None
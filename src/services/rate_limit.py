@@ -0,0 +1,64 @@
+# src/services/rate_limit.py
+# Limite de mensagens por remetente no webhook do WhatsApp
+
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class _SenderWindow:
+    __slots__ = ('hits', 'rejected')
+
+    def __init__(self, max_messages):
+        self.hits = deque(maxlen=max_messages)   # instantes das mensagens aceites
+        self.rejected = 0                         # recusadas seguidas desde a última aceite
+
+
+class SenderRateLimiter:
+    """
+    Janela deslizante por remetente: no máximo max_messages aceites em
+    window_seconds. Cada remetente guarda no máximo max_messages instantes, e
+    os remetentes ficam num LRU de max_senders (saem primeiro os parados há
+    mais tempo), por isso a memória é limitada qualquer que seja o tráfego.
+    O limite é por processo. max_messages <= 0 desliga o limite.
+    """
+
+    def __init__(self, max_messages=20, window_seconds=60.0, max_senders=10000, clock=time.monotonic):
+        self.max_messages = max_messages
+        self.window_seconds = window_seconds
+        self.max_senders = max_senders
+        self._clock = clock
+        self._senders = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, sender):
+        """Regista a mensagem se o remetente ainda estiver dentro do limite."""
+        if self.max_messages <= 0:
+            return True
+        now = self._clock()
+        with self._lock:
+            window = self._senders.get(sender)
+            if window is None:
+                window = self._senders[sender] = _SenderWindow(self.max_messages)
+                while len(self._senders) > self.max_senders:
+                    self._senders.popitem(last=False)
+            else:
+                self._senders.move_to_end(sender)
+            hits = window.hits
+            while hits and hits[0] <= now - self.window_seconds:
+                hits.popleft()
+            if len(hits) >= self.max_messages:
+                window.rejected += 1
+                return False
+            hits.append(now)
+            window.rejected = 0
+            return True
+
+    def rejected(self, sender):
+        """Mensagens recusadas seguidas ao remetente (0 se a última foi aceite)."""
+        with self._lock:
+            window = self._senders.get(sender)
+            return window.rejected if window else 0
+
+    def __len__(self):
+        return len(self._senders)
@@ -0,0 +1,356 @@
+# src/services/reminders.py
+# Lembretes automáticos das consultas da agenda (Schedule) pelo WhatsApp.
+#
+# Uma só instância (lease 'appointment-reminders' no banco) carrega as
+# consultas da janela seguinte com uma consulta por intervalo sobre
+# ix_schedule_start_end e guarda o momento de cada lembrete numa roda de
+# temporização hierárquica. Inserir, mover e cancelar custam O(1) e cada tique
+# só toca no slot atual. As consultas criadas ou alteradas em qualquer processo
+# são apanhadas por Schedule.updated_at (ix_schedule_updated_at); as apagadas
+# simplesmente já não existem na hora do envio. Os lembretes vencidos são
+# marcados no banco (reminder_sent_at) antes de serem enviados em lote, por
+# isso nunca saem duas vezes, nem depois de uma troca de instância. Um envio que
+# falhou de certeza liberta a marca e é tentado de novo na recarga seguinte, até
+# MAX_REMINDER_ATTEMPTS vezes. A marca não mexe em updated_at: não é uma
+# alteração da consulta e não volta a ser apanhada pela procura de alterações.
+# Cada lembrete sai pelo número da clínica da consulta, com o nome e o telefone dela.
+
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update
+
+from src.models.conversation import db, Patient, Schedule
+from src.services.business_calendar import TIMEZONE, format_opening
+from src.services.leases import Lease
+from src.services.tenants import DEFAULT_TEXTS, get_tenant_registry
+from src.services.whatsapp_service import get_tenant_client, is_unconfirmed
+
+LEASE_NAME = 'appointment-reminders'
+MAX_REMINDER_ATTEMPTS = 3
+
+
+class TimingWheel:
+    """
+    Roda de temporização hierárquica. O nível 0 tem `sizes[0]` slots de um
+    tique; cada slot do nível i cobre um giro completo do nível i-1. Uma
+    entrada fica no nível mais baixo que alcança o seu prazo e desce de nível
+    (cascata) quando o slot onde está passa a ser o atual.
+    """
+
+    def __init__(self, tick=1.0, sizes=(60, 60, 24, 32), now=None):
+        self.tick = tick
+        self.sizes = sizes
+        # granularidade (em tiques) de um slot de cada nível
+        self.granularity = [math.prod(sizes[:level]) for level in range(len(sizes))]
+        self.horizon = math.prod(sizes)
+        self.wheels = [[{} for _ in range(size)] for size in sizes]
+        self.current = self._to_tick(time.time() if now is None else now)
+        self.overflow = {}      # chave -> tique, para prazos além do horizonte
+        self.ready = {}         # chave -> tique, já vencidas
+        self._where = {}        # chave -> dict onde está a entrada
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, key):
+        return key in self._where
+
+    def _to_tick(self, timestamp):
+        return math.ceil(timestamp / self.tick)
+
+    def add(self, key, deadline):
+        """Agenda (ou reagenda) `key` para o instante `deadline` (timestamp)."""
+        self.cancel(key)
+        self._place(key, self._to_tick(deadline))
+
+    def cancel(self, key):
+        slot = self._where.pop(key, None)
+        if slot is not None:
+            del slot[key]
+
+    def _place(self, key, deadline_tick):
+        delta = deadline_tick - self.current
+        if delta <= 0:
+            slot = self.ready
+        elif delta >= self.horizon:
+            slot = self.overflow
+        else:
+            level = 0
+            while delta >= self.granularity[level] * self.sizes[level]:
+                level += 1
+            slot = self.wheels[level][(deadline_tick // self.granularity[level]) % self.sizes[level]]
+        slot[key] = deadline_tick
+        self._where[key] = slot
+
+    def advance(self, now=None):
+        """Avança até `now` e retorna as chaves vencidas."""
+        target = self._to_tick(time.time() if now is None else now)
+        while self.current < target:
+            self.current += 1
+            # Cascata do nível mais alto para o mais baixo nos limites de cada nível
+            for level in range(len(self.sizes) - 1, 0, -1):
+                if self.current % self.granularity[level] == 0:
+                    slot = self.wheels[level][(self.current // self.granularity[level]) % self.sizes[level]]
+                    entries = list(slot.items())
+                    slot.clear()
+                    for key, deadline_tick in entries:
+                        self._place(key, deadline_tick)
+            if self.overflow and self.current % self.horizon == 0:
+                entries = list(self.overflow.items())
+                self.overflow.clear()
+                for key, deadline_tick in entries:
+                    self._place(key, deadline_tick)
+            slot = self.wheels[0][self.current % self.sizes[0]]
+            if slot:
+                self.ready.update(slot)
+                for key in slot:
+                    self._where[key] = self.ready
+                slot.clear()
+
+        due = list(self.ready)
+        for key in due:
+            del self._where[key]
+        self.ready.clear()
+        return due
+
+
+def reminder_due_at(start_time, lead_time):
+    """Instante (timestamp) do lembrete de uma consulta com início em hora local de São Paulo."""
+    if start_time.tzinfo is None:
+        start_time = TIMEZONE.localize(start_time)
+    return (start_time - lead_time).timestamp()
+
+
+def reminder_message(full_name, start_time, texts=DEFAULT_TEXTS):
+    """Texto do lembrete, com o nome e o primeiro telefone da clínica (TenantConfig.texts)."""
+    return f"""🦷 *Lembrete de consulta*
+
+Olá! Passando para lembrar da consulta de *{full_name}* na {texts['clinic_name']} {format_opening(TIMEZONE.localize(start_time))}.
+
+📍 Se precisar remarcar, responda esta mensagem ou ligue para {texts['phones'][0]}.
+
+Até breve! 😊"""
+
+
+class ReminderScheduler:
+    """
+    lead_time: antecedência do lembrete. window: além do lead_time, quanto da
+    agenda fica em memória; é recarregada por inteiro a cada reload_interval
+    segundos e as alterações são procuradas a cada poll_interval segundos.
+    """
+
+    # Folga na procura por updated_at, para relógios ligeiramente desfasados entre processos
+    CHANGES_MARGIN = timedelta(seconds=5)
+
+    def __init__(self, app, lead_time=timedelta(hours=24), window=timedelta(hours=24), reload_interval=3600,
+                 poll_interval=10, tick=1.0, batch_size=50, lease_ttl=30):
+        self.app = app
+        self.lead_time = lead_time
+        self.window = window
+        self.reload_interval = reload_interval
+        self.poll_interval = poll_interval
+        self.tick = tick
+        self.batch_size = batch_size
+        self.lease = Lease(LEASE_NAME, ttl_seconds=lease_ttl)
+        # Com REMINDER_TEMPLATE_NAME os lembretes saem como modelo aprovado
+        # (parâmetros: nome do paciente, data e hora), necessário fora da janela de 24h.
+        self.template_name = os.environ.get('REMINDER_TEMPLATE_NAME')
+        self.template_language = os.environ.get('REMINDER_TEMPLATE_LANGUAGE', 'pt_BR')
+
+        self.wheel = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._next_reload = 0.0
+        self._next_poll = 0.0
+        self._changes_since = None
+        self._next_lease_check = 0.0
+        # Lembretes que falharam: só voltam à roda na recarga seguinte
+        self._failed = set()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='appointment-reminders', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        with self.app.app_context():
+            self.lease.release()
+
+    # --- Ciclo principal ---
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                with self.app.app_context():
+                    self._step()
+            except Exception as e:
+                print(f"ERRO: Falha no agendador de lembretes: {e}")
+                self._stopping.wait(5)
+            self._stopping.wait(self.tick)
+
+    def _step(self):
+        now = time.monotonic()
+        if now >= self._next_lease_check:
+            self._next_lease_check = now + self.lease.ttl_seconds / 3
+            if not self.lease.acquire():
+                with self._lock:
+                    self.wheel = None
+                return
+        if not self.lease.held:
+            return
+        if self.wheel is None or now >= self._next_reload:
+            self.reload()
+            self._next_reload = now + self.reload_interval
+            self._next_poll = now + self.poll_interval
+        elif now >= self._next_poll:
+            self.poll_changes()
+            self._next_poll = now + self.poll_interval
+        with self._lock:
+            due = self.wheel.advance()
+        for start in range(0, len(due), self.batch_size):
+            self._send_batch(due[start:start + self.batch_size])
+
+    def reload(self):
+        """Reconstrói a roda com os lembretes por enviar da janela seguinte."""
+        local_now = datetime.now(TIMEZONE).replace(tzinfo=None)
+        horizon = local_now + self.lead_time + self.window
+        changes_since = datetime.utcnow() - self.CHANGES_MARGIN
+        with db.engine.connect() as conn:
+            rows = conn.execute(
+                select(Schedule.id, Schedule.start_time)
+                .where(Schedule.start_time > local_now,
+                       Schedule.start_time <= horizon,
+                       Schedule.reminder_sent_at.is_(None))
+            ).all()
+        wheel = TimingWheel(tick=self.tick)
+        for row in rows:
+            wheel.add(row.id, reminder_due_at(row.start_time, self.lead_time))
+        with self._lock:
+            self.wheel = wheel
+            self._changes_since = changes_since
+            self._failed = set()
+        print(f"INFO: {len(rows)} lembretes de consulta agendados até {horizon:%d/%m %H:%M}.")
+
+    # --- Alterações da agenda (de qualquer processo) ---
+    def poll_changes(self):
+        """Aplica à roda as consultas criadas ou alteradas desde a última procura."""
+        since = self._changes_since
+        with db.engine.connect() as conn:
+            rows = conn.execute(
+                select(Schedule.id, Schedule.start_time, Schedule.reminder_sent_at, Schedule.updated_at)
+                .where(Schedule.updated_at > since)
+            ).all()
+        for row in rows:
+            if row.id not in self._failed:
+                self.schedule_changed(row.id, row.start_time, row.reminder_sent_at)
+            since = max(since, row.updated_at - self.CHANGES_MARGIN)
+        self._changes_since = since
+
+    def schedule_changed(self, schedule_id, start_time, reminder_sent_at):
+        with self._lock:
+            if self.wheel is None:
+                return
+            local_now = datetime.now(TIMEZONE).replace(tzinfo=None)
+            if (reminder_sent_at is not None or start_time <= local_now
+                    or start_time > local_now + self.lead_time + self.window):
+                self.wheel.cancel(schedule_id)
+            else:
+                self.wheel.add(schedule_id, reminder_due_at(start_time, self.lead_time))
+
+    # --- Envio ---
+    def _send_batch(self, schedule_ids):
+        local_now = datetime.now(TIMEZONE).replace(tzinfo=None)
+        with db.engine.connect() as conn:
+            rows = conn.execute(
+                select(Schedule.id, Schedule.start_time, Schedule.tenant_id, Patient.full_name, Patient.phone_e164)
+                .join(Patient, Patient.id == Schedule.patient_id)
+                .where(Schedule.id.in_(schedule_ids), Schedule.reminder_sent_at.is_(None),
+                       Patient.phone_e164.isnot(None))
+            ).all()
+
+        claimed = []
+        table = Schedule.__table__
+        with db.engine.begin() as conn:
+            for row in rows:
+                if row.start_time <= local_now:
+                    continue
+                if reminder_due_at(row.start_time, self.lead_time) > time.time() + self.tick:
+                    # A consulta foi movida noutro processo: volta para a roda com o novo prazo.
+                    self.schedule_changed(row.id, row.start_time, None)
+                    continue
+                # Só quem muda reminder_sent_at de NULL para preenchido envia.
+                result = conn.execute(
+                    update(table)
+                    .where(table.c.id == row.id, table.c.reminder_sent_at.is_(None),
+                           table.c.start_time == row.start_time)
+                    .values(reminder_sent_at=datetime.utcnow(), reminder_attempts=table.c.reminder_attempts + 1,
+                            updated_at=table.c.updated_at)
+                )
+                if result.rowcount == 1:
+                    claimed.append(row)
+        if not claimed:
+            return
+
+        by_tenant = {}
+        for row in claimed:
+            by_tenant.setdefault(row.tenant_id, []).append(row)
+        results = {}
+        for tenant_id, tenant_rows in by_tenant.items():
+            for row, result in zip(tenant_rows, self._send_for_tenant(tenant_id, tenant_rows)):
+                results[row.id] = result
+
+        failed, unconfirmed = [], []
+        for row in claimed:
+            result = results[row.id]
+            if result is None or isinstance(result, Exception):
+                (unconfirmed if is_unconfirmed(result) else failed).append(row.id)
+        if failed:
+            # O envio falhou de certeza (a API recusou-o, ou não chegou a sair): liberta a
+            # marca para a recarga seguinte tentar de novo, até MAX_REMINDER_ATTEMPTS vezes.
+            # updated_at fica como estava, para a procura de alterações não o reenviar já.
+            self._failed.update(failed)
+            with db.engine.begin() as conn:
+                released = conn.execute(
+                    update(table)
+                    .where(table.c.id.in_(failed), table.c.reminder_attempts < MAX_REMINDER_ATTEMPTS)
+                    .values(reminder_sent_at=None, updated_at=table.c.updated_at)
+                ).rowcount
+            print(f"ERRO: {len(failed)} lembretes de consulta não enviados; {released} voltam a ser tentados "
+                  f"na próxima recarga, os restantes esgotaram as {MAX_REMINDER_ATTEMPTS} tentativas.")
+        if unconfirmed:
+            # Pode ter saído: fica marcado (nunca dois lembretes), para verificação manual.
+            print(f"ERRO: Lembretes por confirmar (sem resposta da API), não repetidos: consultas {unconfirmed}.")
+        print(f"INFO: {len(claimed) - len(failed) - len(unconfirmed)} lembretes de consulta enviados.")
+
+    def _send_for_tenant(self, tenant_id, rows):
+        """Envia os lembretes das consultas de uma clínica pelo número dela; resultados pela mesma ordem."""
+        tenant = get_tenant_registry().get(tenant_id)
+        if tenant.id != tenant_id:
+            print(f"ERRO: A clínica {tenant_id} está inativa. Lembretes não enviados.")
+            return [None] * len(rows)
+        client = get_tenant_client(tenant)
+        if client is None:
+            print(f"ERRO CRÍTICO: As credenciais do WhatsApp da clínica '{tenant.slug}' não estão configuradas. "
+                  f"Lembretes não enviados.")
+            return [None] * len(rows)
+        if self.template_name:
+            return client.send_many(
+                [(row.phone_e164, self.template_name, self.template_language,
+                  (row.full_name, format_opening(TIMEZONE.localize(row.start_time))))
+                 for row in rows],
+                sender=client.send_template, return_errors=True
+            )
+        return client.send_many(
+            [(row.phone_e164, reminder_message(row.full_name, row.start_time, tenant.texts)) for row in rows],
+            return_errors=True
+        )
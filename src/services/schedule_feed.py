@@ -0,0 +1,300 @@
+# src/services/schedule_feed.py
+# Atualizações da agenda em tempo real (Server-Sent Events).
+#
+# Cada inserção, alteração ou remoção de uma consulta (Schedule) grava, na mesma
+# transação, uma linha em schedule_change com a versão seguinte do contador
+# 'schedule' (change_sequence). O contador fica bloqueado até ao commit, por isso
+# quem lê a versão V já vê todas as alterações até V. A página da agenda guarda
+# a última versão que aplicou e recebe só as alterações posteriores:
+#
+#   /agenda/alteracoes?desde=N  alterações depois de N (ou resync se N é antigo
+#                               demais), para quem volta de uma suspensão
+#   /agenda/stream              as mesmas alterações em SSE, à medida que chegam
+#
+# O contador é um só; cada linha guarda a clínica da consulta e cada agenda
+# recebe só as alterações da sua (as versões das outras ficam por saltar).
+#
+# Os streams de um processo partilham a versão conhecida (ScheduleFeed): os
+# commits deste processo acordam-nos de imediato e os de outros processos são
+# vistos com uma consulta ao contador a cada poll_interval, feita por um único
+# stream, quantos quer que estejam abertos.
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import delete, event, func, insert, inspect, select, update
+from sqlalchemy.orm import Session, joinedload
+
+from src.models.conversation import db, Patient, Schedule
+from src.models.schedule_change import ChangeSequence, ScheduleChange
+from src.services.metrics import SCHEDULE_FEED_EVENTS
+from src.services.tenants import tenant_filter
+
+SEQUENCE_NAME = 'schedule'
+UPSERT = 'upsert'
+DELETE = 'delete'
+
+# Campos que mudam o evento mostrado no calendário (ver Schedule.to_dict)
+DISPLAY_FIELDS = ('patient_id', 'title', 'start_time', 'end_time', 'notes')
+
+# Alterações guardadas; quem ficar mais para trás recarrega o calendário (resync)
+RETAIN_VERSIONS = 10000
+PRUNE_EVERY = 500
+# Mais alterações do que isto numa resposta: é mais barato recarregar o intervalo visível
+CHANGES_LIMIT = 500
+
+POLL_INTERVAL = 2.0
+HEARTBEAT_INTERVAL = 15.0
+STREAM_MAX_SECONDS = 300
+RETRY_MS = 3000
+
+
+# --- Registo das alterações (na transação de quem altera a agenda) ---
+PENDING_KEY = 'schedule_feed_version'
+
+
+def _changed_schedules(session, conn):
+    """[(schedule_id, tenant_id, op)] das consultas alteradas neste flush."""
+    changes = []
+    for obj in session.new:
+        if isinstance(obj, Schedule):
+            changes.append((obj.id, obj.tenant_id, UPSERT))
+    for obj in session.dirty:
+        if isinstance(obj, Schedule):
+            state = inspect(obj)
+            if any(state.attrs[name].history.has_changes() for name in DISPLAY_FIELDS):
+                changes.append((obj.id, obj.tenant_id, UPSERT))
+        elif isinstance(obj, Patient) and inspect(obj).attrs.full_name.history.has_changes():
+            # O nome do paciente faz parte do título dos eventos
+            changes.extend((row.id, row.tenant_id, UPSERT) for row in conn.execute(
+                select(Schedule.id, Schedule.tenant_id).where(Schedule.patient_id == obj.id)))
+    for obj in session.deleted:
+        if isinstance(obj, Schedule):
+            changes.append((obj.id, obj.tenant_id, DELETE))
+    return changes
+
+
+def _next_versions(conn, count):
+    """Reserva count versões seguidas e devolve a última."""
+    sequence = ChangeSequence.__table__
+    result = conn.execute(
+        update(sequence).where(sequence.c.name == SEQUENCE_NAME).values(value=sequence.c.value + count))
+    if result.rowcount == 0:
+        # Banco criado sem a migração (create_all): a linha nasce aqui
+        conn.execute(insert(sequence).values(name=SEQUENCE_NAME, value=count))
+        return count
+    return conn.execute(select(sequence.c.value).where(sequence.c.name == SEQUENCE_NAME)).scalar_one()
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_changes(session, flush_context):
+    # A conexão do flush (já dentro da transação de quem grava)
+    conn = session.connection()
+    changes = _changed_schedules(session, conn)
+    if not changes:
+        return
+    last = _next_versions(conn, len(changes))
+    first = last - len(changes) + 1
+    now = datetime.utcnow()
+    conn.execute(insert(ScheduleChange.__table__), [
+        {'version': version, 'schedule_id': schedule_id, 'tenant_id': tenant_id, 'op': op, 'changed_at': now}
+        for version, (schedule_id, tenant_id, op) in zip(range(first, last + 1), changes)
+    ])
+    if last // PRUNE_EVERY != (first - 1) // PRUNE_EVERY:
+        conn.execute(delete(ScheduleChange.__table__).where(ScheduleChange.version <= last - RETAIN_VERSIONS))
+    session.info[PENDING_KEY] = last
+
+
+@event.listens_for(Session, 'after_commit')
+def _notify_streams(session):
+    version = session.info.pop(PENDING_KEY, None)
+    if version is not None and _default_feed is not None:
+        _default_feed.notify(version)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_version(session):
+    session.info.pop(PENDING_KEY, None)
+
+
+# --- Leitura ---
+def current_version(conn=None):
+    """Última versão gravada (0 se a agenda nunca foi alterada)."""
+    if conn is None:
+        with db.engine.connect() as conn:
+            return current_version(conn)
+    value = conn.execute(select(ChangeSequence.value).where(ChangeSequence.name == SEQUENCE_NAME)).scalar()
+    return value or 0
+
+
+def changes_since(since, tenant_id=None, limit=CHANGES_LIMIT):
+    """
+    {'version': V, 'resync': bool, 'changes': [...]} com as alterações da agenda
+    da clínica em (since, V]. Várias alterações da mesma consulta resultam numa
+    só, com o estado atual. resync=True quando since já foi podado (ou é de
+    outro banco): o cliente recarrega.
+    """
+    with db.engine.connect() as conn:
+        # O contador primeiro: todas as alterações até ele já estão confirmadas
+        latest = current_version(conn)
+        if since >= latest:
+            return {'version': latest, 'resync': since > latest, 'changes': []}
+        # A poda apaga as versões mais antigas: se since + 1 já não existe, falta algo
+        oldest = conn.execute(select(func.min(ScheduleChange.version))).scalar()
+        if oldest is None or oldest > since + 1:
+            return {'version': latest, 'resync': True, 'changes': []}
+        rows = conn.execute(
+            select(ScheduleChange.version, ScheduleChange.schedule_id, ScheduleChange.op)
+            .where(ScheduleChange.version > since, ScheduleChange.version <= latest,
+                   tenant_filter(ScheduleChange.tenant_id, tenant_id))
+            .order_by(ScheduleChange.version)
+            .limit(limit + 1)
+        ).all()
+    if len(rows) > limit:
+        return {'version': latest, 'resync': True, 'changes': []}
+
+    last_change = {}
+    for row in rows:
+        last_change.pop(row.schedule_id, None)   # a ordem segue a última alteração
+        last_change[row.schedule_id] = (row.version, row.op)
+    upsert_ids = [schedule_id for schedule_id, (_, op) in last_change.items() if op == UPSERT]
+    current = {}
+    if upsert_ids:
+        # Sessão própria: o stream não prende a db.session do pedido
+        with Session(db.engine) as session:
+            schedules = session.scalars(
+                select(Schedule).options(joinedload(Schedule.patient)).where(Schedule.id.in_(upsert_ids))
+            ).all()
+            current = {s.id: s.to_dict() for s in schedules}
+
+    changes = []
+    for schedule_id, (version, op) in last_change.items():
+        event_data = current.get(schedule_id)
+        if op == UPSERT and event_data is not None:
+            changes.append({'version': version, 'op': UPSERT, 'id': schedule_id, 'event': event_data})
+        else:
+            # Apagada entretanto (a remoção tem versão acima de latest)
+            changes.append({'version': version, 'op': DELETE, 'id': schedule_id})
+    return {'version': latest, 'resync': False, 'changes': changes}
+
+
+class StreamSlots:
+    """Limite de streams abertos por processo: cada um ocupa uma thread do gunicorn."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.open = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.open >= self.limit:
+                return False
+            self.open += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.open -= 1
+
+
+class ScheduleFeed:
+    """Versão da agenda conhecida pelo processo, partilhada pelos streams abertos."""
+
+    def __init__(self, poll_interval=POLL_INTERVAL, max_streams=2):
+        self.poll_interval = poll_interval
+        self.streams = StreamSlots(max_streams)
+        self.version = None
+        self._checked_at = 0.0
+        self._condition = threading.Condition()
+        self._refreshing = False
+
+    def notify(self, version):
+        """Commit deste processo: acorda os streams sem esperar pela consulta seguinte."""
+        with self._condition:
+            if self.version is None or version > self.version:
+                self.version = version
+                self._condition.notify_all()
+
+    def wait(self, since, timeout):
+        """Espera até haver uma versão acima de since; devolve-a, ou since no fim do timeout."""
+        deadline = time.monotonic() + timeout
+        while True:
+            self._refresh_if_stale()
+            with self._condition:
+                if self.version is not None and self.version > since:
+                    return self.version
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return since
+                self._condition.wait(min(remaining, self.poll_interval))
+
+    def _refresh_if_stale(self):
+        with self._condition:
+            if self._refreshing or time.monotonic() < self._checked_at + self.poll_interval:
+                return
+            self._refreshing = True
+        try:
+            version = current_version()
+        except Exception as e:
+            print(f"ERRO: Falha ao ler a versão da agenda: {e}")
+            version = None
+        with self._condition:
+            self._refreshing = False
+            self._checked_at = time.monotonic()
+            if version is not None and (self.version is None or version > self.version):
+                self.version = version
+                self._condition.notify_all()
+
+
+def _sse(event_name, data, event_id=None):
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {event_name}", f"data: {json.dumps(data)}"]
+    return '\n'.join(lines) + '\n\n'
+
+
+def stream_changes(since, tenant_id=None, feed=None, max_seconds=STREAM_MAX_SECONDS, heartbeat=HEARTBEAT_INTERVAL):
+    """
+    Gerador SSE: as alterações da agenda da clínica depois de since, à medida que são gravadas.
+    Fecha ao fim de max_seconds; o EventSource volta a ligar com o Last-Event-ID.
+    """
+    feed = feed or get_schedule_feed()
+    deadline = time.monotonic() + max_seconds
+    yield f"retry: {RETRY_MS}\n\n"
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        latest = feed.wait(since, min(heartbeat, remaining))
+        if latest <= since:
+            SCHEDULE_FEED_EVENTS.inc('ping')
+            yield ": ping\n\n"
+            continue
+        result = changes_since(since, tenant_id)
+        if result['resync']:
+            SCHEDULE_FEED_EVENTS.inc('resync')
+            yield _sse('resync', {'version': result['version']}, result['version'])
+            if result['version'] < since:
+                return   # banco recriado: o cliente volta a ligar com a versão nova
+        elif result['changes']:
+            SCHEDULE_FEED_EVENTS.inc('changes')
+            yield _sse('changes', result, result['version'])
+        since = max(since, result['version'])
+
+
+_default_feed = None
+_default_feed_lock = threading.Lock()
+
+
+def get_schedule_feed():
+    global _default_feed
+    with _default_feed_lock:
+        if _default_feed is None:
+            # Metade das threads de cada worker, no máximo, presas em streams
+            threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+            _default_feed = ScheduleFeed(
+                max_streams=int(os.environ.get('SCHEDULE_STREAM_LIMIT', max(1, threads // 2))))
+        return _default_feed
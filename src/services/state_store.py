@@ -0,0 +1,346 @@
+# src/services/state_store.py
+# Armazenamento do estado das conversas do BotLogic, partilhado entre processos.
+#
+# Todos os backends guardam, por número de telefone, um dicionário de estado e
+# uma versão. As escritas são compare-and-set sobre a versão, e os estados sem
+# atividade expiram após ttl_seconds.
+#
+# À frente dos backends partilhados fica um cache local (CachedStateStore): cada
+# leitura pede ao backend só a marca da última escrita (stamp) e, se for a do
+# estado em cache, não lê nem descodifica o estado completo.
+
+import copy
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+try:
+    import redis
+except ImportError:  # O backend Redis é opcional (requirements-redis.txt).
+    redis = None
+
+from src.models.conversation import db
+from src.models.bot_state import BotState
+
+StateRecord = namedtuple('StateRecord', ['value', 'version'])
+
+DEFAULT_TTL_SECONDS = 30 * 60
+
+
+class StateConflictError(Exception):
+    """O estado foi alterado por outro processo entre a leitura e a escrita."""
+
+
+class StateStore:
+    """Interface comum dos backends de estado."""
+
+    def get(self, key):
+        """Retorna o StateRecord da chave, ou None se não existir ou tiver expirado."""
+        raise NotImplementedError
+
+    def compare_and_set(self, key, value, expected_version):
+        """
+        Grava value se a versão atual for expected_version (None = não existe).
+        value=None apaga o estado. Retorna True se a escrita foi aplicada.
+        """
+        raise NotImplementedError
+
+    def purge_expired(self):
+        """Remove os estados expirados."""
+
+    def stamp(self, key):
+        """
+        Marca da última escrita da chave, sem ler o estado (None se não existir).
+        Muda a cada escrita, também quando a chave é apagada e criada de novo
+        (a versão recomeça em 1): é ela que valida o CachedStateStore.
+        """
+        raise NotImplementedError
+
+
+class MemoryStateStore(StateStore):
+    """Backend em memória (por processo), com LRU limitado e TTL de inatividade."""
+
+    def __init__(self, max_entries=10000, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, version, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return StateRecord(copy.deepcopy(value), version)
+
+    def compare_and_set(self, key, value, expected_version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+            current_version = entry[1] if entry else None
+            if current_version != expected_version:
+                return False
+            if value is None:
+                self.discard(key)
+            else:
+                self.put(key, value, (current_version or 0) + 1)
+            return True
+
+    def put(self, key, value, version):
+        """Grava incondicionalmente."""
+        with self._lock:
+            self._entries[key] = (copy.deepcopy(value), version, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def purge_expired(self):
+        now = time.monotonic()
+        with self._lock:
+            for key in [k for k, entry in self._entries.items() if entry[2] <= now]:
+                del self._entries[key]
+
+
+class SQLStateStore(StateStore):
+    """
+    Backend na tabela bot_state. Usa uma transação própria em cada operação,
+    independente da db.session do pedido.
+    """
+
+    def __init__(self, ttl_seconds=DEFAULT_TTL_SECONDS, purge_interval_seconds=300):
+        self.ttl_seconds = ttl_seconds
+        self.purge_interval_seconds = purge_interval_seconds
+        self._next_purge = 0.0
+
+    def get(self, key):
+        with db.engine.connect() as conn:
+            row = conn.execute(
+                select(BotState.data, BotState.version)
+                .where(BotState.phone_number == key, BotState.expires_at > datetime.utcnow())
+            ).first()
+        if row is None:
+            return None
+        return StateRecord(json.loads(row.data), row.version)
+
+    def stamp(self, key):
+        with db.engine.connect() as conn:
+            row = conn.execute(
+                select(BotState.version, BotState.updated_at)
+                .where(BotState.phone_number == key, BotState.expires_at > datetime.utcnow())
+            ).first()
+        return None if row is None else (row.version, row.updated_at)
+
+    def compare_and_set(self, key, value, expected_version):
+        return self.compare_and_set_stamped(key, value, expected_version)[0]
+
+    def compare_and_set_stamped(self, key, value, expected_version):
+        """compare_and_set que retorna também a marca da escrita aplicada: (aplicada, marca ou None)."""
+        self._maybe_purge()
+        now = datetime.utcnow()
+        table = BotState.__table__
+        with db.engine.begin() as conn:
+            if value is None:
+                if expected_version is None:
+                    return True, None
+                result = conn.execute(
+                    delete(table).where(table.c.phone_number == key, table.c.version == expected_version)
+                )
+                return result.rowcount == 1, None
+
+            values = {
+                'data': json.dumps(value, ensure_ascii=False),
+                'updated_at': now,
+                'expires_at': now + timedelta(seconds=self.ttl_seconds)
+            }
+            if expected_version is not None:
+                result = conn.execute(
+                    update(table)
+                    .where(table.c.phone_number == key,
+                           table.c.version == expected_version,
+                           table.c.expires_at > now)
+                    .values(version=table.c.version + 1, **values)
+                )
+                applied = result.rowcount == 1
+                return applied, (expected_version + 1, now) if applied else None
+
+            # Estado novo: reaproveita uma linha expirada (versão desconhecida) ou insere uma nova.
+            result = conn.execute(
+                update(table)
+                .where(table.c.phone_number == key, table.c.expires_at <= now)
+                .values(version=table.c.version + 1, **values)
+            )
+            if result.rowcount == 1:
+                return True, None
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(insert(table).values(phone_number=key, version=1, **values))
+            return True, (1, now)
+        except IntegrityError:
+            return False, None
+
+    def purge_expired(self):
+        with db.engine.begin() as conn:
+            conn.execute(delete(BotState.__table__).where(BotState.expires_at <= datetime.utcnow()))
+
+    def _maybe_purge(self):
+        if time.monotonic() < self._next_purge:
+            return
+        self._next_purge = time.monotonic() + self.purge_interval_seconds
+        self.purge_expired()
+
+
+class RedisStateStore(StateStore):
+    """
+    Backend para qualquer servidor compatível com o protocolo Redis
+    (Redis, KeyDB, Dragonfly). O TTL de inatividade é o EXPIRE da própria chave.
+    """
+
+    def __init__(self, client, ttl_seconds=DEFAULT_TTL_SECONDS, prefix='dentinhos:state:'):
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        if redis is None:
+            raise RuntimeError("BOT_STATE_BACKEND aponta para um servidor Redis, mas o pacote 'redis' "
+                               "não está instalado: pip install -r requirements-redis.txt")
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def get(self, key):
+        data = self.client.hgetall(self.prefix + key)
+        if not data:
+            return None
+        return StateRecord(json.loads(data[b'data']), int(data[b'version']))
+
+    def stamp(self, key):
+        version, token = self.client.hmget(self.prefix + key, 'version', 'token')
+        return None if version is None else (int(version), token)
+
+    def compare_and_set(self, key, value, expected_version):
+        return self.compare_and_set_stamped(key, value, expected_version)[0]
+
+    def compare_and_set_stamped(self, key, value, expected_version):
+        """compare_and_set que retorna também a marca da escrita aplicada: (aplicada, marca ou None)."""
+        redis_key = self.prefix + key
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(redis_key)
+                current = pipe.hget(redis_key, 'version')
+                current_version = int(current) if current is not None else None
+                if current_version != expected_version:
+                    pipe.unwatch()
+                    return False, None
+                pipe.multi()
+                stamp = None
+                if value is None:
+                    pipe.delete(redis_key)
+                else:
+                    # token: distingue esta escrita de outra com a mesma versão (chave recriada)
+                    stamp = ((current_version or 0) + 1, uuid.uuid4().hex.encode('ascii'))
+                    pipe.hset(redis_key, mapping={
+                        'data': json.dumps(value, ensure_ascii=False),
+                        'version': stamp[0],
+                        'token': stamp[1]
+                    })
+                    pipe.expire(redis_key, self.ttl_seconds)
+                pipe.execute()
+                return True, stamp
+            except redis.WatchError:
+                return False, None
+
+
+class CachedStateStore(StateStore):
+    """
+    Cache local à frente de um backend partilhado (SQL ou Redis).
+
+    Só guarda os passos em cache_steps (por omissão o 'awaiting_choice', em que
+    a conversa passa a maior parte do tempo). Cada leitura compara a marca da
+    última escrita no backend (stamp, uma consulta só à versão) com a do estado
+    em cache: se outro processo avançou a conversa, a marca mudou e o estado é
+    relido, por isso o cache nunca serve um passo desatualizado.
+    """
+
+    def __init__(self, backend, max_entries=1024, cache_steps=('awaiting_choice',)):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.cache_steps = frozenset(cache_steps)
+        self._entries = OrderedDict()   # chave -> (marca, StateRecord)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        stamp = self.backend.stamp(key)
+        if stamp is None:
+            self.invalidate(key)
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self._entries.move_to_end(key)
+                return StateRecord(copy.deepcopy(entry[1].value), entry[1].version)
+        # A marca foi lida antes do estado: se houver uma escrita pelo meio, o estado
+        # guardado é mais recente do que a marca e a leitura seguinte relê-o.
+        record = self.backend.get(key)
+        self._remember(key, stamp, record)
+        return record
+
+    def compare_and_set(self, key, value, expected_version):
+        applied, stamp = self.backend.compare_and_set_stamped(key, value, expected_version)
+        if applied and stamp is not None:
+            self._remember(key, stamp, StateRecord(value, stamp[0]))
+        else:
+            self.invalidate(key)
+        return applied
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def purge_expired(self):
+        self.backend.purge_expired()
+
+    def _remember(self, key, stamp, record):
+        if record is None or record.value.get('step') not in self.cache_steps:
+            self.invalidate(key)
+            return
+        with self._lock:
+            self._entries[key] = (stamp, StateRecord(copy.deepcopy(record.value), record.version))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def create_state_store(backend=None, ttl_seconds=None):
+    """
+    Cria o backend configurado em BOT_STATE_BACKEND: 'memory', 'sql' (padrão)
+    ou um URL redis://. Os backends partilhados ganham o cache local à frente,
+    validado pela marca da última escrita (ver CachedStateStore).
+    """
+    backend = backend or os.environ.get('BOT_STATE_BACKEND', 'sql')
+    ttl_seconds = ttl_seconds or int(os.environ.get('BOT_STATE_TTL_SECONDS', DEFAULT_TTL_SECONDS))
+
+    if backend == 'memory':
+        return MemoryStateStore(ttl_seconds=ttl_seconds)
+    if backend == 'sql':
+        return CachedStateStore(SQLStateStore(ttl_seconds=ttl_seconds))
+    if backend.startswith(('redis://', 'rediss://', 'unix://')):
+        return CachedStateStore(RedisStateStore.from_url(backend, ttl_seconds=ttl_seconds))
+    raise ValueError(f"Backend de estado desconhecido: {backend}")
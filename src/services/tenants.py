@@ -0,0 +1,150 @@
+# src/services/tenants.py
+# Várias clínicas/unidades na mesma instalação.
+#
+# Cada webhook traz o metadata.phone_number_id do número que recebeu a
+# mensagem; é por ele que se escolhe a clínica (Tenant): textos do bot,
+# horário de atendimento e credenciais da Graph API. O processo guarda em
+# memória todas as clínicas ativas, lidas com uma consulta a cada ttl_seconds,
+# por isso o encaminhamento não custa consultas por mensagem. Sem linhas na
+# tabela tenant (ou para números desconhecidos) vale a clínica por omissão,
+# configurada pelas variáveis de ambiente como antes.
+#
+# O banco, a fila e os workers são partilhados: cada mensagem leva o tenant_id
+# e um único pool de workers serve todos os números. Pacientes, agenda e
+# campanhas são de cada clínica (coluna tenant_id, NULL = a por omissão).
+
+import json
+import os
+import threading
+import time
+
+from sqlalchemy import select
+
+from src.models.conversation import db
+from src.models.tenant import Tenant
+from src.services.business_calendar import BusinessCalendar, CalendarConfigError, get_business_calendar
+
+DEFAULT_TTL = 60
+
+# Textos do bot que cada clínica pode substituir em settings["texts"]
+DEFAULT_TEXTS = {
+    'clinic_name': 'Dentinhos de Leite Odontologia',
+    'consultation_price': 'R$ 179,90',
+    'dentist': 'Dr Rafael Moreira -Odontopediatra - CRO/SP 156455',
+    'phones': ['(16) 99269-2383', '(16) 99212-0514'],
+}
+
+
+class TenantConfig:
+    """Configuração de uma clínica já resolvida (imutável, partilhada entre threads)."""
+
+    def __init__(self, id, slug, name, phone_number_id, access_token, texts=None, calendar=None):
+        self.id = id
+        self.slug = slug
+        self.name = name
+        self.phone_number_id = phone_number_id
+        self.access_token = access_token
+        self.texts = {**DEFAULT_TEXTS, **(texts or {})}
+        self.calendar = calendar or get_business_calendar()
+
+    @property
+    def state_prefix(self):
+        """Prefixo das chaves de estado do bot (a clínica por omissão mantém as chaves antigas)."""
+        return '' if self.id is None else f"{self.id}:"
+
+    def __repr__(self):
+        return f"<TenantConfig {self.slug}>"
+
+
+def default_tenant():
+    """A clínica configurada pelas variáveis de ambiente (WHATSAPP_PHONE_NUMBER_ID/ACCESS_TOKEN)."""
+    return TenantConfig(
+        id=None,
+        slug='default',
+        name=DEFAULT_TEXTS['clinic_name'],
+        phone_number_id=os.environ.get('WHATSAPP_PHONE_NUMBER_ID'),
+        access_token=os.environ.get('WHATSAPP_ACCESS_TOKEN'),
+    )
+
+
+def tenant_filter(column, tenant_id):
+    """Condição SQL: linhas da clínica (a por omissão grava tenant_id NULL)."""
+    return column.is_(None) if tenant_id is None else column == tenant_id
+
+
+class TenantRegistry:
+    def __init__(self, ttl_seconds=DEFAULT_TTL):
+        self.ttl_seconds = ttl_seconds
+        self.default = default_tenant()
+        self._by_id = {}
+        self._by_phone_number_id = {}
+        self._versions = {}        # tenant_id -> updated_at da configuração em memória
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def resolve(self, phone_number_id):
+        """Clínica do número que recebeu a mensagem (a por omissão se for desconhecido)."""
+        self._ensure_fresh()
+        return self._by_phone_number_id.get(phone_number_id, self.default)
+
+    def get(self, tenant_id):
+        """Clínica pelo id gravado nas linhas (None -> a por omissão)."""
+        if tenant_id is None:
+            return self.default
+        self._ensure_fresh()
+        return self._by_id.get(tenant_id, self.default)
+
+    def all(self):
+        self._ensure_fresh()
+        return [self.default] + list(self._by_id.values())
+
+    def invalidate(self):
+        self._expires_at = 0.0
+
+    def _ensure_fresh(self):
+        if time.monotonic() >= self._expires_at:
+            self._reload()
+
+    def _reload(self):
+        with self._lock:
+            if time.monotonic() < self._expires_at:
+                return
+            with db.engine.connect() as conn:
+                rows = conn.execute(select(Tenant.__table__).where(Tenant.active.is_(True))).all()
+            by_id = {}
+            for row in rows:
+                if row.id in self._by_id and self._versions.get(row.id) == row.updated_at:
+                    # Inalterada: o mesmo objeto (e o calendário já calculado) continua em uso
+                    by_id[row.id] = self._by_id[row.id]
+                    continue
+                try:
+                    by_id[row.id] = self._build(row)
+                    self._versions[row.id] = row.updated_at
+                except (ValueError, CalendarConfigError) as e:
+                    print(f"ERRO: Configuração inválida da clínica '{row.slug}' ({e}); a usar a anterior.")
+                    if row.id in self._by_id:
+                        by_id[row.id] = self._by_id[row.id]
+            self._by_id = by_id
+            self._by_phone_number_id = {tenant.phone_number_id: tenant for tenant in by_id.values()}
+            self._expires_at = time.monotonic() + self.ttl_seconds
+
+    def _build(self, row):
+        settings = json.loads(row.settings or '{}')
+        calendar = BusinessCalendar(settings['calendar']) if settings.get('calendar') else None
+        access_token = os.environ.get(row.access_token_env)
+        if not access_token:
+            print(f"ERRO: Variável {row.access_token_env} da clínica '{row.slug}' não está definida.")
+        return TenantConfig(row.id, row.slug, row.name, row.phone_number_id, access_token,
+                            texts=settings.get('texts'), calendar=calendar)
+
+
+_default_registry = None
+_default_registry_lock = threading.Lock()
+
+
+def get_tenant_registry():
+    global _default_registry
+    with _default_registry_lock:
+        if _default_registry is None:
+            _default_registry = TenantRegistry(ttl_seconds=float(os.environ.get('TENANT_CACHE_TTL', DEFAULT_TTL)))
+        return _default_registry
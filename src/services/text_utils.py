@@ -0,0 +1,45 @@
+# src/services/text_utils.py
+# Normalização de texto partilhada (pesquisa de pacientes, palavras-chave do bot)
+
+import re
+import string
+import unicodedata
+
+_NON_DIGITS = re.compile(r'\D+')
+
+# Pontuação (e os modificadores de emoji de '1️⃣') tratada como separador de palavras.
+_SEPARATORS = str.maketrans({ch: ' ' for ch in string.punctuation + '\ufe0f\u20e3¿¡…“”‘’–—«»'})
+
+
+def _build_fold_table():
+    """Tabela para str.translate: letras latinas acentuadas -> letra base, diacríticos soltos -> nada."""
+    table = {}
+    for codepoint in range(0x00C0, 0x0250):
+        base = ''.join(ch for ch in unicodedata.normalize('NFKD', chr(codepoint)) if not unicodedata.combining(ch))
+        if base and base != chr(codepoint):
+            table[codepoint] = base
+    for codepoint in range(0x0300, 0x0370):
+        table[codepoint] = None
+    return table
+
+
+_FOLD_TABLE = _build_fold_table()
+
+
+def fold_text(text):
+    """Minúsculas, sem acentos e com espaços colapsados: 'Emergência  Já' -> 'emergencia ja'."""
+    if not text:
+        return ''
+    if not text.isascii():
+        text = text.translate(_FOLD_TABLE)
+    return ' '.join(text.split()).casefold()
+
+
+def tokenize(text):
+    """Palavras do texto normalizado, sem pontuação: 'Oi! Convênio?' -> ['oi', 'convenio']."""
+    return fold_text(text).translate(_SEPARATORS).split()
+
+
+def only_digits(text):
+    """Remove tudo o que não for dígito: '(16) 99269-2383' -> '16992692383'."""
+    return _NON_DIGITS.sub('', text or '')
@@ -0,0 +1,199 @@
+# src/services/user_store.py
+# Carregamento dos utilizadores autenticados (Flask-Login).
+#
+# No login a sessão (cookie assinado com a SECRET_KEY) recebe as claims do
+# utilizador: id, nome, versão das credenciais e momento de emissão. Enquanto
+# as claims forem recentes (CLAIMS_MAX_AGE) o pedido é autenticado só com
+# elas; depois disso o utilizador é revalidado pelo UserStore, que mantém em
+# cada worker um cache com TTL dos registos lidos do banco. Mudar a senha ou
+# desativar um utilizador incrementa a versão das credenciais e invalida o
+# cache local; nos outros workers a sessão antiga deixa de valer, no máximo,
+# ao fim de CLAIMS_MAX_AGE + CACHE_TTL.
+
+import threading
+import time
+from collections import OrderedDict
+
+from flask import session
+from flask_login import UserMixin
+from sqlalchemy import select, update
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from src.models.conversation import db
+from src.models.user import User
+from src.services import metrics
+
+CLAIMS_KEY = '_user_claims'
+CLAIMS_MAX_AGE = 300
+CACHE_TTL = 60
+
+# Comparado quando o utilizador não existe, para o login demorar o mesmo
+_DUMMY_HASH = generate_password_hash('dentinhos')
+
+
+class AuthenticatedUser(UserMixin):
+    """Utilizador da sessão: cópia imutável, sem ligação à sessão do SQLAlchemy."""
+
+    def __init__(self, id, username, active, credentials_version):
+        self.id = id
+        self.username = username
+        self.active = active
+        self.credentials_version = credentials_version
+
+    @property
+    def is_active(self):
+        return self.active
+
+    def get_id(self):
+        return str(self.id)
+
+
+def _record_from_row(row):
+    return AuthenticatedUser(row.id, row.username, row.active, row.credentials_version)
+
+
+class UserStore:
+    def __init__(self, ttl_seconds=CACHE_TTL, max_entries=1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._cache = OrderedDict()    # id -> (expira_em, AuthenticatedUser ou None)
+        self._lock = threading.Lock()
+
+    # --- Leitura ---
+    def get(self, user_id):
+        """Utilizador pelo id (cache local com TTL), ou None se não existir."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._cache.move_to_end(user_id)
+                metrics.AUTH_USER_LOADS.inc('cache')
+                return entry[1]
+
+        with db.engine.connect() as conn:
+            row = conn.execute(
+                select(User.id, User.username, User.active, User.credentials_version).where(User.id == user_id)
+            ).first()
+        record = _record_from_row(row) if row is not None else None
+        metrics.AUTH_USER_LOADS.inc('database')
+        with self._lock:
+            self._cache[user_id] = (now + self.ttl_seconds, record)
+            self._cache.move_to_end(user_id)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return record
+
+    def cached(self, user_id):
+        """Registo em cache ainda válido, sem ir ao banco (None se não houver)."""
+        with self._lock:
+            entry = self._cache.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    def authenticate(self, username, password):
+        """Utilizador ativo com estas credenciais, ou None. Vai sempre ao banco."""
+        with db.engine.connect() as conn:
+            row = conn.execute(
+                select(User.id, User.username, User.active, User.credentials_version, User.password_hash)
+                .where(User.username == username)
+            ).first()
+        if row is None:
+            check_password_hash(_DUMMY_HASH, password)
+            return None
+        if not check_password_hash(row.password_hash, password) or not row.active:
+            return None
+        record = _record_from_row(row)
+        with self._lock:
+            self._cache[row.id] = (time.monotonic() + self.ttl_seconds, record)
+        return record
+
+    # --- Escrita ---
+    def create(self, username, password):
+        user = User(username=username)
+        user.set_password(password)
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+    def set_password(self, user_id, password):
+        return self._update_credentials(user_id, password_hash=generate_password_hash(password))
+
+    def set_active(self, user_id, active):
+        return self._update_credentials(user_id, active=active)
+
+    def _update_credentials(self, user_id, **values):
+        """Altera o utilizador e incrementa a versão das credenciais. Retorna False se não existir."""
+        table = User.__table__
+        with db.engine.begin() as conn:
+            result = conn.execute(
+                update(table)
+                .where(table.c.id == user_id)
+                .values(credentials_version=table.c.credentials_version + 1, **values)
+            )
+        self.invalidate(user_id)
+        return result.rowcount == 1
+
+    def invalidate(self, user_id=None):
+        """Esquece um utilizador (ou todos) no cache deste worker."""
+        with self._lock:
+            if user_id is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(user_id, None)
+
+
+# --- Claims da sessão ---
+def issue_claims(user):
+    session[CLAIMS_KEY] = {
+        'id': user.id,
+        'username': user.username,
+        'version': user.credentials_version,
+        'issued_at': int(time.time())
+    }
+
+
+def clear_claims():
+    session.pop(CLAIMS_KEY, None)
+
+
+def load_session_user(user_id, store=None):
+    """user_loader do Flask-Login: claims recentes da sessão ou revalidação pelo UserStore."""
+    store = store or get_user_store()
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+
+    claims = session.get(CLAIMS_KEY)
+    if not claims or claims.get('id') != user_id:
+        return None
+
+    # Uma invalidação feita neste worker vale logo, mesmo com claims recentes.
+    cached = store.cached(user_id)
+    if cached is not None and (cached.credentials_version != claims['version'] or not cached.active):
+        return None
+
+    if time.time() - claims.get('issued_at', 0) <= CLAIMS_MAX_AGE:
+        metrics.AUTH_USER_LOADS.inc('claims')
+        return AuthenticatedUser(user_id, claims['username'], True, claims['version'])
+
+    user = store.get(user_id)
+    if user is None or not user.active or user.credentials_version != claims['version']:
+        return None
+    issue_claims(user)
+    return user
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_user_store():
+    """UserStore partilhado do processo."""
+    global _default_store
+    if _default_store is None:
+        with _default_store_lock:
+            if _default_store is None:
+                _default_store = UserStore()
+    return _default_store
@@ -1,45 +1,315 @@
 # src/services/whatsapp_service.py
 
-import requests
 import os
-import json
-
-def send_whatsapp_message(phone_number, message_text):
-    """
-    Envia uma mensagem de texto para um número de telefone via WhatsApp Business API.
-    """
-    ACCESS_TOKEN = os.environ.get('WHATSAPP_ACCESS_TOKEN')
-    PHONE_NUMBER_ID = os.environ.get('WHATSAPP_PHONE_NUMBER_ID')
-    
-    if not ACCESS_TOKEN or not PHONE_NUMBER_ID:
-        print("ERRO CRÍTICO: As variáveis de ambiente do WhatsApp não estão configuradas. A mensagem não pode ser enviada.")
-        return
-
-    url = f"https://graph.facebook.com/v19.0/{PHONE_NUMBER_ID}/messages"
-    
-    headers = {
-        "Authorization": f"Bearer {ACCESS_TOKEN}",
-        "Content-Type": "application/json"
-    }
-    
-    payload = {
-        "messaging_product": "whatsapp",
-        "to": phone_number,
-        "type": "text",
-        "text": {
-            "body": message_text
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from src.services import metrics
+
+GRAPH_API_BASE_URL = "https://graph.facebook.com"
+GRAPH_API_VERSION = "v19.0"
+
+# Limites de envio da Cloud API (mensagens por segundo por número).
+# O padrão é 80 mps; números com throughput elevado chegam a 1000 mps.
+THROUGHPUT_TIERS = {
+    'standard': 80,
+    'high': 1000
+}
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class UnconfirmedSend(requests.exceptions.RequestException):
+    """
+    O pedido pode ter chegado à API (ex.: sem resposta dentro do timeout): não se
+    sabe se a mensagem saiu, por isso não é repetido.
+    """
+
+
+def is_unconfirmed(error):
+    """True se a falha não garante que a mensagem não foi enviada."""
+    return isinstance(error, UnconfirmedSend)
+
+
+def _failed_before_sending(error):
+    """Falhas de rede em que o pedido de certeza não chegou à API (seguro repetir)."""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError):
+        reason = error.args[0] if error.args else None
+        # MaxRetryError do urllib3: o motivo vem em .reason (DNS, ligação recusada...)
+        return isinstance(getattr(reason, 'reason', reason), NewConnectionError)
+    return False
+
+
+def worker_count():
+    """Processos do gunicorn que enviam mensagens em paralelo (gunicorn.conf.py)."""
+    return max(1, int(os.environ.get('WEB_CONCURRENCY', '2')))
+
+
+class TokenBucket:
+    """Token bucket thread-safe: até `capacity` pedidos de rajada, `rate` por segundo em média."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Bloqueia até haver `tokens` disponíveis."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def create_session(pool_size=20):
+    """Session HTTP com um pool de conexões keep-alive para a Graph API."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class WhatsAppClient:
+    """
+    Cliente de longa duração para a WhatsApp Cloud API.
+
+    Reutiliza conexões keep-alive de um pool (requests.Session), limita o ritmo
+    de envio com um token bucket e repete os pedidos com backoff exponencial e
+    jitter em caso de 429, 5xx ou falha de ligação antes do envio. Um pedido
+    que pode já ter chegado à API (timeout de leitura, ligação cortada depois
+    do envio) não é repetido: falha com UnconfirmedSend. Os clientes de vários números
+    podem partilhar a mesma `session` (e o pool de conexões): o token vai nos
+    cabeçalhos de cada pedido.
+    """
+
+    def __init__(self, access_token, phone_number_id, base_url=GRAPH_API_BASE_URL,
+                 api_version=GRAPH_API_VERSION, messages_per_second=THROUGHPUT_TIERS['standard'],
+                 pool_size=20, timeout=(3.05, 10), max_retries=4, backoff_base=0.5, backoff_max=8.0,
+                 session=None):
+        self.phone_number_id = phone_number_id
+        self.url = f"{base_url.rstrip('/')}/{api_version}/{phone_number_id}/messages"
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.pool_size = pool_size
+        self.rate_limiter = TokenBucket(messages_per_second)
+
+        self._owns_session = session is None
+        self.session = session or create_session(pool_size)
+        self.headers = {
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/json"
         }
-    }
-    
-    try:
-        response = requests.post(url, headers=headers, data=json.dumps(payload ))
-        response.raise_for_status()
-        print(f"Mensagem enviada com sucesso para {phone_number}.")
-        return response.json()
-        
-    except requests.exceptions.RequestException as e:
-        print(f"ERRO ao enviar mensagem para {phone_number}: {e}")
-        # Adicionar mais detalhes do erro se disponíveis
-        if e.response is not None:
-            print(f"Detalhes do erro da API: {e.response.text}")
+
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, access_token=None, phone_number_id=None, session=None):
+        """
+        Cria o cliente a partir das variáveis de ambiente (ou das credenciais
+        dadas), ou retorna None se faltarem. WHATSAPP_MESSAGES_PER_SECOND é o
+        limite do número na API: cada um dos WEB_CONCURRENCY processos fica com
+        a sua parte, para que juntos não o ultrapassem.
+        """
+        access_token = access_token or os.environ.get('WHATSAPP_ACCESS_TOKEN')
+        phone_number_id = phone_number_id or os.environ.get('WHATSAPP_PHONE_NUMBER_ID')
+        if not access_token or not phone_number_id:
+            return None
+        return cls(
+            access_token,
+            phone_number_id,
+            base_url=os.environ.get('WHATSAPP_API_BASE_URL', GRAPH_API_BASE_URL),
+            messages_per_second=float(os.environ.get('WHATSAPP_MESSAGES_PER_SECOND',
+                                                     THROUGHPUT_TIERS['standard'])) / worker_count(),
+            session=session
+        )
+
+    def send_text(self, phone_number, message_text, raise_errors=False):
+        """
+        Envia uma mensagem de texto. Retorna o JSON da API, ou None em caso de
+        falha (com raise_errors, levanta a exceção).
+        """
+        return self._send(phone_number, {
+            "type": "text",
+            "text": {
+                "body": message_text
+            }
+        }, raise_errors)
+
+    def send_template(self, phone_number, template_name, language='pt_BR', parameters=(), raise_errors=False):
+        """
+        Envia uma mensagem de modelo aprovado. Fora da janela de 24h desde a
+        última mensagem do utilizador, a API só aceita modelos.
+        """
+        template = {"name": template_name, "language": {"code": language}}
+        if parameters:
+            template["components"] = [{
+                "type": "body",
+                "parameters": [{"type": "text", "text": str(value)} for value in parameters]
+            }]
+        return self._send(phone_number, {"type": "template", "template": template}, raise_errors)
+
+    def _send(self, phone_number, message, raise_errors=False):
+        payload = {"messaging_product": "whatsapp", "to": phone_number, **message}
+        try:
+            response = self._post(payload)
+            print(f"Mensagem enviada com sucesso para {phone_number}.")
+            return response
+        except requests.exceptions.RequestException as e:
+            print(f"ERRO ao enviar mensagem para {phone_number}: {e}")
+            if e.response is not None:
+                print(f"Detalhes do erro da API: {e.response.text}")
+            if raise_errors:
+                raise
+            return None
+
+    def send_many(self, messages, sender=None, return_errors=False):
+        """
+        Envia vários pares (phone_number, message_text) em paralelo, respeitando o
+        limite de ritmo. Com `sender` (ex.: self.send_template), cada tuplo são os
+        argumentos desse método. Retorna os resultados pela mesma ordem; com
+        return_errors, uma falha dá a exceção em vez de None (ver is_unconfirmed).
+        """
+        sender = sender or self.send_text
+        executor = self._get_executor()
+        futures = [executor.submit(self._send_or_error, sender, message, return_errors) for message in messages]
+        return [future.result() for future in futures]
+
+    @staticmethod
+    def _send_or_error(sender, message, return_errors):
+        if not return_errors:
+            return sender(*message)
+        try:
+            return sender(*message, raise_errors=True)
+        except requests.exceptions.RequestException as e:
+            return e
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._owns_session:
+            self.session.close()
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='whatsapp-send')
+            return self._executor
+
+    def _post(self, payload):
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            retry_after = None
+            started = time.perf_counter()
+            try:
+                response = self.session.post(self.url, json=payload, headers=self.headers, timeout=self.timeout)
+                metrics.GRAPH_API_DURATION.observe(time.perf_counter() - started, response.status_code)
+                if response.status_code == 429:
+                    metrics.GRAPH_API_THROTTLED.inc()
+                if response.status_code not in RETRYABLE_STATUS:
+                    if response.status_code >= 400:
+                        metrics.GRAPH_API_ERRORS.inc('http_error')
+                    response.raise_for_status()
+                    return response.json()
+                metrics.GRAPH_API_ERRORS.inc('throttled' if response.status_code == 429 else 'server_error')
+                retry_after = response.headers.get('Retry-After')
+                if attempt >= self.max_retries:
+                    response.raise_for_status()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                metrics.GRAPH_API_DURATION.observe(time.perf_counter() - started, 'none')
+                metrics.GRAPH_API_ERRORS.inc('timeout' if isinstance(e, requests.exceptions.Timeout) else 'connection')
+                if not _failed_before_sending(e):
+                    # A API pode ter recebido a mensagem: repetir poderia enviá-la duas vezes
+                    raise UnconfirmedSend(f"Envio por confirmar: {e}", request=e.request) from e
+                if attempt >= self.max_retries:
+                    raise
+            time.sleep(self._backoff(attempt, retry_after))
+            attempt += 1
+
+    def _backoff(self, attempt, retry_after=None):
+        """Backoff exponencial com jitter completo; respeita o Retry-After quando existe."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        return delay
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_whatsapp_client():
+    """Retorna o cliente partilhado do processo (criado na primeira utilização)."""
+    global _default_client
+    if _default_client is None:
+        with _default_client_lock:
+            if _default_client is None:
+                _default_client = WhatsAppClient.from_env()
+    return _default_client
+
+
+_tenant_clients = {}
+_tenant_clients_lock = threading.Lock()
+_shared_session = None
+
+
+def get_tenant_client(tenant):
+    """
+    Cliente do número de uma clínica (src/services/tenants.py). Os clientes de
+    todas as clínicas partilham a mesma session e o mesmo pool de conexões;
+    cada um mantém o seu limite de ritmo, que a API aplica por número.
+    """
+    global _shared_session
+    if tenant is None or tenant.id is None:
+        return get_whatsapp_client()
+    if not tenant.access_token or not tenant.phone_number_id:
+        return None
+    key = (tenant.phone_number_id, tenant.access_token)
+    client = _tenant_clients.get(key)
+    if client is None:
+        with _tenant_clients_lock:
+            client = _tenant_clients.get(key)
+            if client is None:
+                if _shared_session is None:
+                    _shared_session = create_session(pool_size=50)
+                client = WhatsAppClient.from_env(tenant.access_token, tenant.phone_number_id, session=_shared_session)
+                _tenant_clients[key] = client
+    return client
+
+
+def send_whatsapp_message(phone_number, message_text, tenant=None, raise_errors=False):
+    """
+    Envia uma mensagem de texto para um número de telefone via WhatsApp Business API
+    (pelo número da clínica indicada, ou pelo número por omissão). Com
+    raise_errors, as falhas de envio levantam a exceção (ver is_unconfirmed).
+    """
+    client = get_tenant_client(tenant)
+    if client is None:
+        clinic = f" da clínica '{tenant.slug}'" if tenant is not None and tenant.id is not None else ""
+        print(f"ERRO CRÍTICO: As credenciais do WhatsApp{clinic} não estão configuradas. A mensagem não pode ser enviada.")
         return None
+    return client.send_text(phone_number, message_text, raise_errors=raise_errors)